@@ -0,0 +1,115 @@
+"""
+Minimal stand-ins for the discord.py objects used by the bot commands
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import count
+from typing import List, Optional
+
+_ids = count(10**17)
+
+
+@dataclass
+class FakeAuthor:
+    """discord.Member stand-in"""
+
+    id: int
+    name: str
+    display_name: str
+    discriminator: str = "0001"
+
+
+@dataclass
+class FakeGuild:
+    """discord.Guild stand-in"""
+
+    id: int
+
+
+@dataclass
+class FakeMessage:
+    """discord.Message stand-in, keeps every edit"""
+
+    content: str
+    channel: "FakeChannel"
+    id: int = field(default_factory=lambda: next(_ids))
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    edits: int = 0
+
+    async def edit(self, content: str) -> None:
+        """Replace the content of the message"""
+        self.content = content
+        self.edits += 1
+
+
+@dataclass
+class FakeChannel:
+    """discord.TextChannel stand-in, keeps every sent message"""
+
+    id: int
+    sent: List[FakeMessage] = field(default_factory=list)
+
+    async def send(self, content: str) -> FakeMessage:
+        """Send a message to the channel"""
+        message = FakeMessage(content=content, channel=self)
+        self.sent.append(message)
+        return message
+
+
+@dataclass
+class FakeContext:
+    """commands.Context stand-in for a message sent by author on channel"""
+
+    bot: object
+    author: FakeAuthor
+    channel: FakeChannel
+    message: FakeMessage
+    guild: Optional[FakeGuild] = None
+
+    async def send(self, content: str) -> FakeMessage:
+        """Send a message to the channel of the context"""
+        return await self.channel.send(content)
+
+
+@dataclass
+class FakeEmoji:
+    """discord.PartialEmoji stand-in"""
+
+    name: str
+
+
+@dataclass
+class FakeReactionPayload:
+    """discord.RawReactionActionEvent stand-in"""
+
+    channel_id: int
+    user_id: int
+    emoji: FakeEmoji
+
+
+def fake_context(
+    bot: object,
+    author: FakeAuthor,
+    channel: FakeChannel,
+    content: str,
+    guild: FakeGuild = None,
+) -> FakeContext:
+    """Context of a new message sent by author on channel.
+
+    Args:
+        bot (object): bot running the command.
+        author (FakeAuthor): author of the message.
+        channel (FakeChannel): channel of the message.
+        content (str): full content, command included.
+        guild (FakeGuild, optional): guild of the channel. Defaults to None.
+
+    Returns:
+        FakeContext: context to call a command callback with.
+    """
+    return FakeContext(
+        bot=bot,
+        author=author,
+        channel=channel,
+        message=FakeMessage(content=content, channel=channel),
+        guild=guild,
+    )
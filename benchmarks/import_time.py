@@ -0,0 +1,119 @@
+"""
+Benchmark of the cold start of the bot.
+
+Imports a module, chat_bot.bot.bot by default, on fresh interpreters started
+with -X importtime from an empty directory, and reports the best cumulative
+import time, the modules taking the most of it and the files the import left
+behind (it must leave none, sinks and handlers are set when the bot starts).
+Run from the repository root:
+
+    python -m benchmarks.import_time --repeat 5 --budget-ms 1000
+
+Exits with code 1 when the import takes longer than the budget or creates files.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+"""Placeholders of the env vars required to import the bot"""
+REQUIRED_ENVIRONMENT = {"OPENAI_API_KEY": "sk-benchmark", "DISCORD_BOT_TOKEN": "x"}
+
+
+@dataclass
+class ImportResult:
+    """
+    Measures of an import on a fresh interpreter
+    """
+
+    module: str
+    total_ms: float
+    modules: Dict[str, Tuple[float, float]]
+    files_created: List[str]
+
+
+def run_import(module: str) -> ImportResult:
+    """Import module on a fresh interpreter, from an empty working directory.
+
+    Args:
+        module (str): module to import.
+
+    Raises:
+        RuntimeError: the import failed.
+
+    Returns:
+        ImportResult: import time of the module and of everything it imported,
+            as self and cumulative milliseconds.
+    """
+    environment = {**REQUIRED_ENVIRONMENT, **os.environ}
+    environment["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(ROOT), environment.get("PYTHONPATH")])
+    )
+    with tempfile.TemporaryDirectory(prefix="chat-bot-import-") as directory:
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=directory,
+            env=environment,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        files_created = sorted(
+            str(path.relative_to(directory)) for path in Path(directory).rglob("*")
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    modules = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules[name.strip()] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+    return ImportResult(
+        module=module,
+        total_ms=modules[module][1],
+        modules=modules,
+        files_created=files_created,
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--module", default="chat_bot.bot.bot")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument(
+        "--budget-ms", type=float, default=None, help="fail above this import time"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    best = min(
+        (run_import(arguments.module) for _ in range(arguments.repeat)),
+        key=lambda result: result.total_ms,
+    )
+    print(f"{best.module}: {best.total_ms:.1f} ms (best of {arguments.repeat})")
+    print(f"{'self_ms':>10}  {'cumulative_ms':>13}  module")
+    for name, (self_ms, cumulative_ms) in sorted(
+        best.modules.items(), key=lambda item: item[1][0], reverse=True
+    )[: arguments.top]:
+        print(f"{self_ms:>10.1f}  {cumulative_ms:>13.1f}  {name}")
+    failed = False
+    if best.files_created:
+        print(f"files created on import: {', '.join(best.files_created)}")
+        failed = True
+    if arguments.budget_ms is not None and best.total_ms > arguments.budget_ms:
+        print(f"over the budget of {arguments.budget_ms:.1f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,146 @@
+"""
+Benchmark of the memory held by a cached conversation.
+
+Builds conversations of several lengths from log records, as the storage
+loads them, and measures with tracemalloc the memory held by:
+
+    validated  ChatHistorial built with parse_obj
+    trusted    ChatHistorial built with ChatHistorial.from_trusted
+    compact    CompactHistorial, as kept by the ChatHistorialHandler cache
+
+The content of the messages is reported apart, it is the same for all of
+them. Run from the repository root:
+
+    python -m benchmarks.memory --messages 1000 --conversations 50
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List
+
+from chat_bot.models.compact import CompactHistorial
+from chat_bot.models.historial import ChatHistorial
+from chat_bot.utils.enums import Roles
+
+GIB = 2**30
+
+
+@dataclass
+class MemoryResult:
+    """
+    Memory held by a representation of a conversation
+    """
+
+    representation: str
+    messages: int
+    bytes_per_conversation: int
+    overhead_per_message: float
+    conversations_per_gib: int
+
+
+def conversation_json(messages: int, index: int) -> str:
+    """Serialized conversation, each one with its own contents"""
+    return json.dumps(
+        {
+            "id": f"chat{index}",
+            "message_to_react_id": "message",
+            "reacted_to_profiling_step": True,
+            "messages": [
+                {
+                    "role": Roles.USER.value
+                    if number % 2 == 0
+                    else Roles.ASSISTANT.value,
+                    "content": f"conversacion {index} mensaje {number} " * 6,
+                    "name": "user" if number % 2 == 0 else None,
+                    "tokens": 42,
+                }
+                for number in range(messages)
+            ],
+        }
+    )
+
+
+def traced_bytes(build: Callable[[], List[Any]]) -> int:
+    """Bytes still allocated by what build returns"""
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    held = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del held
+    return used
+
+
+def run(messages: int, conversations: int) -> List[MemoryResult]:
+    """Measures of every representation for a conversation length"""
+    documents = [conversation_json(messages, index) for index in range(conversations)]
+    builders: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+        "validated": ChatHistorial.parse_obj,
+        "trusted": ChatHistorial.from_trusted,
+        "compact": lambda data: CompactHistorial.from_historial(
+            ChatHistorial.from_trusted(data)
+        ),
+    }
+    """Contents alone, held by every representation"""
+    contents = traced_bytes(
+        lambda: [
+            [message["content"] for message in json.loads(document)["messages"]]
+            for document in documents
+        ]
+    )
+    results = []
+    for name, builder in builders.items():
+        used = traced_bytes(
+            lambda builder=builder: [
+                builder(json.loads(document)) for document in documents
+            ]
+        )
+        per_conversation = used // conversations
+        results.append(
+            MemoryResult(
+                representation=name,
+                messages=messages,
+                bytes_per_conversation=per_conversation,
+                overhead_per_message=round(
+                    (used - contents) / conversations / max(messages, 1), 1
+                ),
+                conversations_per_gib=GIB // max(per_conversation, 1),
+            )
+        )
+    return results
+
+
+def print_table(results: List[MemoryResult]) -> None:
+    """Print the results as an aligned table"""
+    rows = [list(asdict(results[0]).keys())] + [
+        [str(value) for value in asdict(result).values()] for result in results
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def parse_args() -> argparse.Namespace:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--messages",
+        type=lambda value: [int(item) for item in value.split(",")],
+        default=[100, 1000],
+    )
+    parser.add_argument("--conversations", type=int, default=50)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    benchmark_results = []
+    for amount in arguments.messages:
+        benchmark_results.extend(run(amount, arguments.conversations))
+    print_table(benchmark_results)
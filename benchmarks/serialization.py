@@ -0,0 +1,214 @@
+"""
+Benchmark of the ChatHistorial serialization paths.
+
+Compares, for conversations of several lengths, the time to encode and decode
+a ChatHistorial and the size of the encoded document:
+
+    legacy     pretty printed json document, parse_raw with full validation
+    validated  compact log records built with dict() and the json module,
+               parse_obj with full validation
+    fast       compact log records built with to_record() and the storage
+               codec (orjson when installed), trusted construction
+
+It also times FileSystemStorage.load_chat with and without trusted loads.
+Run from the repository root:
+
+    python -m benchmarks.serialization --messages 10,100,1000
+"""
+import argparse
+import json
+import sys
+import tempfile
+from dataclasses import asdict, dataclass
+from timeit import Timer
+from typing import Callable, List
+
+from chat_bot.models.historial import ChatHistorial
+from chat_bot.models.message import Message
+from chat_bot.storage.filesystem import FileSystemStorage
+from chat_bot.utils import serialization
+from chat_bot.utils.enums import RecordTypes, Roles
+from chat_bot.utils.handlers.file_handler import JsonHandler, JsonLinesHandler
+from chat_bot.utils.logger import logger
+
+
+@dataclass
+class CodecResult:
+    """
+    Measures of a serialization path for a conversation length
+    """
+
+    path: str
+    messages: int
+    encode_ms: float
+    decode_ms: float
+    bytes: int
+
+
+def build_chat(messages: int) -> ChatHistorial:
+    """ChatHistorial with messages alternating user and assistant turns"""
+    return ChatHistorial(
+        id="chat",
+        message_to_react_id="message",
+        reacted_to_profiling_step=True,
+        messages=[
+            Message(
+                role=Roles.USER.value if index % 2 == 0 else Roles.ASSISTANT.value,
+                content=f"mensaje numero {index} " * 8,
+                name="user" if index % 2 == 0 else None,
+                tokens=42,
+            )
+            for index in range(messages)
+        ],
+    )
+
+
+def best_ms(func: Callable[[], object], repeat: int) -> float:
+    """Best time of a call over repeat rounds, in milliseconds"""
+    timer = Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1000
+
+
+def records_of(chat: ChatHistorial, fast: bool) -> List[dict]:
+    """Log records of a chat, as FileSystemStorage writes them, through
+    Message.dict() instead of Message.to_record() when not fast"""
+    if fast:
+        # pylint: disable=protected-access
+        return FileSystemStorage._to_records(chat)
+    return [
+        {"type": RecordTypes.HEADER.value, **chat.dict(exclude={"messages", "summary"})}
+    ] + [
+        {"type": RecordTypes.MESSAGE.value, **message.dict()}
+        for message in chat.messages
+    ]
+
+
+def lines_of(records: List[dict], dumps: Callable[[dict], str]) -> str:
+    """Json lines document of records"""
+    return "".join(f"{dumps(record)}\n" for record in records)
+
+
+def from_lines(text: str, loads: Callable[[str], dict], trusted: bool) -> ChatHistorial:
+    """ChatHistorial of a json lines document"""
+    records = [loads(line) for line in text.split("\n") if line]
+    # pylint: disable=protected-access
+    return FileSystemStorage._from_records(records, trusted=trusted)
+
+
+def run_codecs(messages: int, repeat: int) -> List[CodecResult]:
+    """Encode and decode measures of every path for a conversation length"""
+    chat = build_chat(messages)
+    legacy = json.dumps(chat.dict(), indent=4)
+    validated = lines_of(records_of(chat, fast=False), json.dumps)
+    fast = lines_of(records_of(chat, fast=True), serialization.dumps)
+    assert ChatHistorial.parse_raw(legacy) == chat
+    assert from_lines(validated, json.loads, trusted=False) == chat
+    assert from_lines(fast, serialization.loads, trusted=True) == chat
+    return [
+        CodecResult(
+            path="legacy",
+            messages=messages,
+            encode_ms=best_ms(lambda: json.dumps(chat.dict(), indent=4), repeat),
+            decode_ms=best_ms(lambda: ChatHistorial.parse_raw(legacy), repeat),
+            bytes=len(legacy.encode()),
+        ),
+        CodecResult(
+            path="validated",
+            messages=messages,
+            encode_ms=best_ms(
+                lambda: lines_of(records_of(chat, fast=False), json.dumps), repeat
+            ),
+            decode_ms=best_ms(
+                lambda: from_lines(validated, json.loads, trusted=False), repeat
+            ),
+            bytes=len(validated.encode()),
+        ),
+        CodecResult(
+            path=f"fast ({serialization.CODEC})",
+            messages=messages,
+            encode_ms=best_ms(
+                lambda: lines_of(records_of(chat, fast=True), serialization.dumps),
+                repeat,
+            ),
+            decode_ms=best_ms(
+                lambda: from_lines(fast, serialization.loads, trusted=True), repeat
+            ),
+            bytes=len(fast.encode()),
+        ),
+    ]
+
+
+def run_storage(messages: int, repeat: int) -> List[CodecResult]:
+    """FileSystemStorage save and load measures, validated and trusted"""
+    chat = build_chat(messages)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="chat-bot-bench-") as root:
+        for trusted in (False, True):
+            storage = FileSystemStorage(
+                file_handler=JsonHandler(fsync=False),
+                log_handler=JsonLinesHandler(fsync=False),
+                root=root,
+                trusted_loads=trusted,
+            )
+            storage.create_chat("user", chat)
+            assert storage.load_chat("user", chat.id) == chat
+            results.append(
+                CodecResult(
+                    path=f"storage {'trusted' if trusted else 'validated'}",
+                    messages=messages,
+                    encode_ms=best_ms(
+                        lambda storage=storage: storage.rewrite_chat("user", chat),
+                        repeat,
+                    ),
+                    decode_ms=best_ms(
+                        lambda storage=storage: storage.load_chat("user", chat.id),
+                        repeat,
+                    ),
+                    bytes=storage._chat_path(  # pylint: disable=protected-access
+                        "user", chat.id
+                    )
+                    .stat()
+                    .st_size,
+                )
+            )
+    return results
+
+
+def print_table(results: List[CodecResult]) -> None:
+    """Print the results as an aligned table"""
+    rows = [list(asdict(results[0]).keys())] + [
+        [
+            f"{value:.3f}" if isinstance(value, float) else str(value)
+            for value in asdict(result).values()
+        ]
+        for result in results
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def parse_args() -> argparse.Namespace:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--messages",
+        type=lambda value: [int(item) for item in value.split(",")],
+        default=[10, 100, 1000],
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logger.remove()
+    logger.add(sink=sys.stderr, level="WARNING")
+    benchmark_results = []
+    for amount in arguments.messages:
+        benchmark_results.extend(run_codecs(amount, arguments.repeat))
+        benchmark_results.extend(run_storage(amount, arguments.repeat))
+    print_table(benchmark_results)
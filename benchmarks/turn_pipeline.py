@@ -0,0 +1,256 @@
+"""
+Benchmark of the chat turn pipeline of bot.py: chat, reaction and profile
+commands driven with fake Discord objects against a local fake OpenAI server.
+
+For every conversation length and concurrency level it runs that many
+conversations at once, each one going through the profiling flow and then
+the given amount of chat turns, and reports turns/sec, turn latency
+percentiles, bytes written to disk and memory. Run from the repository root:
+
+    python -m benchmarks.turn_pipeline --turns 10,100,1000 --concurrency 1,10
+
+The bot state is stored under a temporary directory, removed at the end.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from statistics import quantiles
+from time import monotonic
+from typing import Dict, List
+
+from benchmarks.fake_discord import (
+    FakeAuthor,
+    FakeChannel,
+    FakeEmoji,
+    FakeGuild,
+    FakeReactionPayload,
+    fake_context,
+)
+
+
+@dataclass
+class ScenarioResult:
+    """
+    Measures of a benchmark scenario
+    """
+
+    turns_per_conversation: int
+    concurrency: int
+    turns: int
+    seconds: float
+    turns_per_second: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    bytes_written: int
+    db_bytes: int
+    rss_mb: float
+    peak_traced_mb: float
+
+
+def percentiles(latencies: List[float]) -> Dict[int, float]:
+    """p50, p95 and p99 of the latencies, in milliseconds"""
+    if len(latencies) < 2:
+        value = latencies[0] * 1000 if latencies else 0.0
+        return {50: value, 95: value, 99: value}
+    cuts = quantiles(latencies, n=100, method="inclusive")
+    return {point: cuts[point - 1] * 1000 for point in (50, 95, 99)}
+
+
+def io_written() -> int:
+    """Bytes this process passed to write calls, 0 where /proc is not available"""
+    try:
+        with open("/proc/self/io", encoding="utf-8") as file:
+            for line in file:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def rss_mb() -> float:
+    """Resident memory of the process, peak where the current one is unknown"""
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def directory_size(path: Path) -> int:
+    """Bytes of every file under path"""
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+async def run_conversation(
+    bot, commands, prefix: str, index: int, turns: int, latencies: List[float]
+) -> None:
+    """Profiling flow and turns of a single conversation."""
+    user_id = int(f"{prefix}{index:06d}")
+    author = FakeAuthor(id=user_id, name=f"user{index}", display_name=f"User {index}")
+    channel = FakeChannel(id=user_id + 1)
+    guild = FakeGuild(id=1)
+    bot.fake_channels[channel.id] = channel
+
+    await commands["chat"](fake_context(bot, author, channel, "?chat hola", guild))
+    await commands["on_raw_reaction_add"](
+        FakeReactionPayload(
+            channel_id=channel.id, user_id=author.id, emoji=FakeEmoji("✅")
+        )
+    )
+    await commands["profile"](
+        fake_context(bot, author, channel, "?profile $profile un pirata", guild)
+    )
+    for turn in range(turns):
+        ctx = fake_context(
+            bot,
+            author,
+            channel,
+            f"?chat pregunta numero {turn} de {author.name}",
+            guild,
+        )
+        start = monotonic()
+        await commands["chat"](ctx)
+        latencies.append(monotonic() - start)
+
+
+async def run_scenario(
+    bot, commands, db_path: Path, turns: int, concurrency: int, trace: bool
+) -> ScenarioResult:
+    """Run concurrency conversations of turns chat turns each."""
+    latencies: List[float] = []
+    prefix = f"{turns}{concurrency}"
+    if trace:
+        tracemalloc.start()
+    written = io_written()
+    start = monotonic()
+    await asyncio.gather(
+        *[
+            run_conversation(bot, commands, prefix, index, turns, latencies)
+            for index in range(concurrency)
+        ]
+    )
+    seconds = monotonic() - start
+    if bot.group_commit_writer is not None:
+        bot.group_commit_writer.flush()
+    bot.usage_handler.writer.flush()
+    peak_traced = 0.0
+    if trace:
+        peak_traced = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    cuts = percentiles(latencies)
+    return ScenarioResult(
+        turns_per_conversation=turns,
+        concurrency=concurrency,
+        turns=len(latencies),
+        seconds=round(seconds, 3),
+        turns_per_second=round(len(latencies) / seconds, 1),
+        p50_ms=round(cuts[50], 2),
+        p95_ms=round(cuts[95], 2),
+        p99_ms=round(cuts[99], 2),
+        bytes_written=io_written() - written,
+        db_bytes=directory_size(db_path),
+        rss_mb=round(rss_mb(), 1),
+        peak_traced_mb=round(peak_traced, 1),
+    )
+
+
+async def main(args: argparse.Namespace) -> List[ScenarioResult]:
+    """Start the fake server and the bot resources and run every scenario."""
+    # Imported here, configs are read and db/ is placed on import
+    # pylint: disable=import-outside-toplevel
+    import openai
+    import chat_bot.bot.bot as bot_module
+    from chat_bot.api.fake_server import FakeOpenAIServer
+    from chat_bot.utils.logger import logger
+
+    # pylint: enable=import-outside-toplevel
+    logger.remove()
+    logger.add(sink=sys.stderr, level=args.log_level)
+
+    server = FakeOpenAIServer(port=args.port, latency=args.latency)
+    await server.start()
+    openai.api_base = server.api_base
+
+    bot = bot_module.bot
+    bot.fake_channels = {}
+    bot.get_channel = bot.fake_channels.get
+    commands = {
+        "chat": bot.get_command("chat").callback,
+        "profile": bot.get_command("profile").callback,
+        "on_raw_reaction_add": bot_module.on_raw_reaction_add,
+    }
+    await bot.setup_hook()
+    results = []
+    try:
+        for turns in args.turns:
+            for concurrency in args.concurrency:
+                result = await run_scenario(
+                    bot, commands, Path("db"), turns, concurrency, args.tracemalloc
+                )
+                results.append(result)
+                print(
+                    " ".join(f"{key}={value}" for key, value in asdict(result).items()),
+                    file=sys.stderr,
+                )
+    finally:
+        await bot.close()
+        await server.stop()
+    return results
+
+
+def print_table(results: List[ScenarioResult]) -> None:
+    """Print the results as an aligned table"""
+    rows = [list(asdict(results[0]).keys())] + [
+        [str(value) for value in asdict(result).values()] for result in results
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def parse_args() -> argparse.Namespace:
+    """Command line arguments"""
+
+    def int_list(value: str) -> List[int]:
+        return [int(item) for item in value.split(",")]
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int_list, default=[10, 100, 1000])
+    parser.add_argument("--concurrency", type=int_list, default=[1, 10])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--tracemalloc", action="store_true")
+    parser.add_argument("--json", type=Path, default=None)
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.json is not None:
+        arguments.json = arguments.json.resolve()
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("DISCORD_BOT_TOKEN", "benchmark")
+    os.environ["DISCORD_STREAM_RESPONSES"] = str(arguments.stream)
+    os.environ.setdefault("DISCORD_EDIT_INTERVAL", "0")
+    # The rate limits of the real API would dominate the measures
+    os.environ.setdefault("OPENAI_REQUESTS_PER_MINUTE", str(10**9))
+    os.environ.setdefault("OPENAI_TOKENS_PER_MINUTE", str(10**12))
+    with tempfile.TemporaryDirectory(prefix="chat-bot-bench-") as work_dir:
+        os.chdir(work_dir)
+        benchmark_results = asyncio.run(main(arguments))
+    print_table(benchmark_results)
+    if arguments.json is not None:
+        arguments.json.write_text(
+            json.dumps([asdict(result) for result in benchmark_results], indent=4)
+        )
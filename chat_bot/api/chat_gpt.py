@@ -1,83 +1,387 @@
 """
 Class to interact with openai API
 """
-from copy import deepcopy
+import asyncio
+from contextlib import contextmanager
+from time import monotonic, time
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Tuple
+from aiohttp import ClientSession
 import openai
 from openai.openai_object import OpenAIObject
 from openai.error import AuthenticationError
-from pydantic import ValidationError
 from chat_bot.utils.logger import logger
-from chat_bot.utils.enums import Engines, Roles
+from chat_bot.api.context import ContextBuilder
+from chat_bot.api.response_cache import ResponseCache
+from chat_bot.api.scheduler import RequestScheduler
+from chat_bot.api.tokens import count_tokens, message_tokens, payload_tokens
+from chat_bot.utils.enums import Engines, Roles, Limits, TokenCounts
+from chat_bot.utils.metrics import tracer
 from chat_bot.models.message import Message
 from chat_bot.models.user import User
-from chat_bot.models.response import ChatCompletionResponse
+from chat_bot.models.response import ChatCompletionResponse, Usage
+from chat_bot.models.usage import UsageRecord
+from chat_bot.usage.handler import UsageHandler
 from chat_bot.historial.handler import ChatHistorialHandler
+from chat_bot.retrieval.handler import RetrievalHandler, Turn
 from chat_bot.models.historial import ChatHistorial
 
+"""Stored historial (or None), new prompt and messages payload of a turn"""
+PreparedMessages = Tuple[ChatHistorial, Message, List[Dict[str, Any]]]
+
 
 class OpenAIApi:
     """
-    Core class to connect to OpenAI API
+    Core class to connect to OpenAI API, a single instance is meant to be shared
+    by every user of a model (see OpenAIClientRegistry).
     """
 
+    """Tokens already validated, mapped to the monotonic time of the validation"""
+    _validated_tokens: Dict[str, float] = {}
+
     def __init__(
         self,
         token: str,
-        user: User,
         model: str = Engines.GPT_3_5_TURBO.value,
-        chat_historial_handler: ChatHistorialHandler = ChatHistorialHandler(),
+        chat_historial_handler: ChatHistorialHandler = None,
+        request_semaphore: asyncio.Semaphore = None,
+        token_ttl: float = Limits.TOKEN_VALIDATION_TTL.value,
+        context_builder: ContextBuilder = None,
     ) -> None:
         self.api = openai
         self.api.api_key = token
-        self.user = user
+        self.token = token
         self.model = model
-        self.chat_historial_handler = chat_historial_handler
-        self._test_token()
+        self.chat_historial_handler = chat_historial_handler or ChatHistorialHandler()
+        self.request_semaphore = request_semaphore or asyncio.Semaphore(
+            Limits.MAX_CONCURRENT_REQUESTS.value
+        )
+        self.token_ttl = token_ttl
+        self.context_builder = context_builder or ContextBuilder(model=model)
+        """Optional HistorialSummarizer compacting long conversations"""
+        self.summarizer = None
+        """Optional ResponseCache shared by the clients of a registry"""
+        self.response_cache: ResponseCache = None
+        """Optional RequestScheduler keeping the calls under the rate limits"""
+        self.scheduler: RequestScheduler = None
+        """Optional UsageHandler recording the usage of every turn"""
+        self.usage_handler: UsageHandler = None
+        """Optional RetrievalHandler, only the relevant past turns are sent"""
+        self.retrieval: RetrievalHandler = None
+        self.session: ClientSession = None
         logger.info("OpenApi client created!")
 
+    def _token_is_fresh(self) -> bool:
+        validated_at = self._validated_tokens.get(self.token)
+        return validated_at is not None and monotonic() - validated_at < self.token_ttl
+
     def _test_token(self) -> bool:
-        status = False
-        prompt = "Just trying the token validity via an api call"
-        message = Message(role=Roles.USER.value, content=prompt, name=self.user.name)
+        """Check the token validity retrieving the model, which is not billed.
+        The result is cached for token_ttl seconds.
+
+        Raises:
+            a_e: Authentication error over API.
+
+        Returns:
+            bool: True if the token is valid.
+        """
+        if self._token_is_fresh():
+            return True
         try:
-            self.api.ChatCompletion.create(
-                model=self.model, messages=[message.dict()], max_tokens=5
-            )
-            status = True
+            self.api.Model.retrieve(self.model)
         except AuthenticationError as a_e:
             logger.error(a_e)
             raise a_e
-        return status
+        self._validated_tokens[self.token] = monotonic()
+        return True
+
+    async def _atest_token(self) -> bool:
+        """Async version of _test_token.
+
+        Raises:
+            a_e: Authentication error over API.
+
+        Returns:
+            bool: True if the token is valid.
+        """
+        if self._token_is_fresh():
+            return True
+        try:
+            with self._session_context():
+                await self.api.Model.aretrieve(self.model)
+        except AuthenticationError as a_e:
+            logger.error(a_e)
+            raise a_e
+        self._validated_tokens[self.token] = monotonic()
+        return True
+
+    @contextmanager
+    def _session_context(self):
+        """Make the openai library use the pooled aiohttp session, if any,
+        for the calls done inside the context of the current task."""
+        if self.session is None:
+            yield
+            return
+        context_token = self.api.aiosession.set(self.session)
+        try:
+            yield
+        finally:
+            self.api.aiosession.reset(context_token)
 
     def _consolidate_messages(
-        self, historial_messages: ChatHistorial, new_message: Message, chat_id: str
-    ) -> ChatHistorial:
-        """Add a new message at the end of the ChatHistorial
+        self,
+        historial_messages: ChatHistorial,
+        new_message: Message,
+        relevant: List[Turn] = None,
+    ) -> List[Dict[str, Any]]:
+        """Add a new message at the end of the ChatHistorial and keep the
+        messages that fit in the model context window. With retrieved turns
+        only the system messages and the recent tail of the ChatHistorial are
+        considered, plus the retrieved turns.
 
         Args:
             historial_messages (ChatHistorial): ChatHistorial loaded on pydantic model.
             new_message (Message): new Message to be added
-        Raises:
-            v_e: A validation error occurs.
+            relevant (List[Turn], optional): past turns relevant to the new
+                message, the whole ChatHistorial is considered if None.
         Returns:
-            ChatHistorial: ChatHistorial object updated, otherwise None.
+            List[Dict[str, Any]]: messages payload to be sent to the API.
         """
-        consolidated_messages = None
-        try:
-            if historial_messages:
-                historial_messages.messages.append(new_message)
-                consolidated_messages = deepcopy(historial_messages)
-            else:
-                consolidated_messages = ChatHistorial(
-                    id=chat_id, messages=[new_message]
+        messages = [new_message]
+        summary = None
+        if historial_messages:
+            messages = [*historial_messages.messages, new_message]
+            summary = historial_messages.summary
+            if relevant is not None:
+                messages = [
+                    *(
+                        message
+                        for message in historial_messages.messages
+                        if message.role == Roles.SYSTEM.value
+                    ),
+                    *self.retrieval.recent(historial_messages.messages),
+                    new_message,
+                ]
+        return self.context_builder.build(messages, summary=summary, relevant=relevant)
+
+    def build_messages(
+        self,
+        user: User,
+        historial_messages: ChatHistorial,
+        content: str,
+        role: str,
+        relevant: List[Turn] = None,
+    ) -> PreparedMessages:
+        """Build the prompt Message and the messages payload around it, trimmed
+        to the context window of the model.
+
+        Args:
+            user (User): user sending the message.
+            historial_messages (ChatHistorial): stored historial, or None.
+            content (str): message to be sent.
+            role (str): API compatible role.
+            relevant (List[Turn], optional): past turns relevant to the new
+                message, the whole ChatHistorial is considered if None.
+
+        Returns:
+            PreparedMessages: stored historial, new prompt and messages payload.
+        """
+        new_prompt = Message(role=role, content=content, name=user.name)
+        message_tokens(new_prompt, self.model)
+        return (
+            historial_messages,
+            new_prompt,
+            self._consolidate_messages(historial_messages, new_prompt, relevant),
+        )
+
+    def _prepare_messages(
+        self, user: User, chat_id: str, content: str, role: str, use_historial: bool
+    ) -> PreparedMessages:
+        """Build the prompt Message and the list of messages to be sent.
+
+        Args:
+            user (User): user sending the message.
+            chat_id (str): chat internal id.
+            content (str): message to be sent.
+            role (str): API compatible role.
+            use_historial (bool): flag to add chat historial.
+
+        Returns:
+            PreparedMessages: stored historial (or None), new prompt and the
+                messages payload to be sent.
+        """
+        historial_messages = None
+        relevant = None
+        if use_historial:
+            historial_messages: ChatHistorial = self.chat_historial_handler.load(
+                user.id, chat_id
+            )
+            if self.retrieval is not None and historial_messages:
+                relevant = self.retrieval.retrieve(
+                    user.id, chat_id, content, historial_messages.messages
+                )
+        return self.build_messages(user, historial_messages, content, role, relevant)
+
+    async def aload_context(
+        self, user: User, chat_id: str, content: str
+    ) -> Tuple[ChatHistorial, List[Turn] | None]:
+        """Load the historial of a chat, out of the event loop, and retrieve
+        the past turns relevant to a new message.
+
+        Args:
+            user (User): user sending the message.
+            chat_id (str): chat internal id.
+            content (str): message to be sent.
+
+        Returns:
+            Tuple[ChatHistorial, List[Turn] | None]: stored historial (or None)
+                and the relevant turns, None without retrieval.
+        """
+        with tracer.span("historial_load"):
+            historial_messages = await self.chat_historial_handler.aload(
+                user.id, chat_id
+            )
+        relevant = None
+        if self.retrieval is not None and historial_messages:
+            with tracer.span("retrieval"):
+                relevant = await self.retrieval.aretrieve(
+                    user.id, chat_id, content, historial_messages.messages
                 )
-        except ValidationError as v_e:
-            logger.error(v_e)
-            raise v_e
-        return consolidated_messages
+        return historial_messages, relevant
+
+    async def _aprepare_messages(
+        self, user: User, chat_id: str, content: str, role: str, use_historial: bool
+    ) -> PreparedMessages:
+        """Async version of _prepare_messages, the historial is loaded out of
+        the event loop."""
+        historial_messages = None
+        relevant = None
+        if use_historial:
+            historial_messages, relevant = await self.aload_context(
+                user, chat_id, content
+            )
+        with tracer.span("context_build"):
+            return self.build_messages(
+                user, historial_messages, content, role, relevant
+            )
+
+    def _process_response(
+        self,
+        response: OpenAIObject,
+        user: User,
+        historial_messages: ChatHistorial,
+        new_prompt: Message,
+        save: bool,
+    ) -> ChatCompletionResponse:
+        """Parse the API response and persist the new turn if required.
+
+        Args:
+            response (OpenAIObject): raw response from the API.
+            user (User): user that sent the prompt.
+            historial_messages (ChatHistorial): stored historial.
+            new_prompt (Message): prompt sent to the API.
+            save (bool): Flag to persistency logic.
+
+        Returns:
+            ChatCompletionResponse: ChatCompletionResponse parsed.
+        """
+        chat_response = ChatCompletionResponse.parse_obj(response.to_dict_recursive())
+        if save:
+            self._save_turn(
+                user,
+                historial_messages,
+                new_prompt,
+                chat_response.choices[0].message.content,
+            )
+        return chat_response
+
+    def _schedule_summary(self, user: User, chat_id: str) -> None:
+        """Let the summarizer, if any, compact the historial in background."""
+        if self.summarizer is not None:
+            self.summarizer.schedule(user.id, chat_id)
+
+    def _response_message(self, response_content: str) -> Message:
+        """Assistant Message with its tokens counted."""
+        new_response = Message(
+            role=Roles.ASSISTANT.value,
+            content=response_content,
+            name=None,
+        )
+        message_tokens(new_response, self.model)
+        return new_response
+
+    def _save_turn(
+        self,
+        user: User,
+        historial_messages: ChatHistorial,
+        new_prompt: Message,
+        response_content: str,
+    ) -> bool:
+        """Persist the prompt and the assistant response on the ChatHistorial.
+
+        Args:
+            user (User): user that sent the prompt.
+            historial_messages (ChatHistorial): stored historial.
+            new_prompt (Message): prompt sent to the API.
+            response_content (str): content answered by the API.
+
+        Returns:
+            bool: True if the update was sucessfull, otherwise False
+        """
+        return self.chat_historial_handler.update(
+            user.id,
+            historial_messages.id,
+            new_prompt,
+            self._response_message(response_content),
+        )
+
+    async def _asave_turn(
+        self,
+        user: User,
+        historial_messages: ChatHistorial,
+        new_prompt: Message,
+        response_content: str,
+    ) -> bool:
+        """Async version of _save_turn, the historial is written out of the
+        event loop."""
+        with tracer.span("persistence"):
+            return await self.chat_historial_handler.aupdate(
+                user.id,
+                historial_messages.id,
+                new_prompt=new_prompt,
+                new_response=self._response_message(response_content),
+            )
+
+    async def _arecord_usage(
+        self,
+        user: User,
+        chat_id: str,
+        guild_id: str | None,
+        usage: Usage,
+        latency: float,
+        cached: bool = False,
+    ) -> None:
+        """Let the usage handler, if any, count the usage of a turn. The
+        tokens of a response reused from the cache are not counted."""
+        if self.usage_handler is None:
+            return
+        await self.usage_handler.arecord(
+            UsageRecord(
+                timestamp=time(),
+                user_id=user.id,
+                chat_id=chat_id,
+                guild_id=guild_id,
+                model=self.model,
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+                total_tokens=usage.total_tokens,
+                latency=latency,
+                cached=cached,
+            )
+        )
 
     def send_chat_completion(
         self,
+        user: User,
         chat_id: str,
         content: str,
         role: str = Roles.USER.value,
@@ -88,6 +392,7 @@ class OpenAIApi:
         and persistency if the call is succesfull.
 
         Args:
+            user (User): user sending the message.
             chat_id (str): chat internal id.
             content (str): message to be sent.
             role (str, optional): API compatible role. Defaults to Roles.USER.value.
@@ -100,34 +405,303 @@ class OpenAIApi:
         Returns:
             ChatCompletionResponse | None: ChatCompetionResponse, otherwise None
         """
-        chat_response = None
-        historial_messages = None
-        new_prompt = Message(role=role, content=content, name=self.user.name)
+        historial_messages, new_prompt, consolidated_messages = self._prepare_messages(
+            user, chat_id, content, role, use_historial
+        )
+        self._test_token()
         try:
-            if use_historial:
-                historial_messages: ChatHistorial = self.chat_historial_handler.load(
-                    self.user.id, chat_id
-                )
-            consolidated_messages = self._consolidate_messages(
-                historial_messages, new_prompt, chat_id
-            )
             response: OpenAIObject = self.api.ChatCompletion.create(
                 model=self.model,
-                messages=consolidated_messages.dict(exclude_none=True)["messages"],
+                messages=consolidated_messages,
             )
-            chat_response = ChatCompletionResponse.parse_obj(
-                response.to_dict_recursive()
+        except AuthenticationError as a_e:
+            raise a_e
+        return self._process_response(
+            response, user, historial_messages, new_prompt, save
+        )
+
+    async def asend_chat_completion(
+        self,
+        user: User,
+        chat_id: str,
+        content: str,
+        role: str = Roles.USER.value,
+        save: bool = True,
+        use_historial: bool = True,
+        cache: bool = False,
+        temperature: float = None,
+        guild_id: str = None,
+        timeout: float = None,
+        prepared: PreparedMessages = None,
+    ) -> ChatCompletionResponse | None:
+        """Async version of send_chat_completion, the API call is awaited so
+        the event loop keeps serving other events while the completion is
+        in flight. The amount of simultaneous calls is capped by request_semaphore.
+
+        Args:
+            user (User): user sending the message.
+            chat_id (str): chat internal id.
+            content (str): message to be sent.
+            role (str, optional): API compatible role. Defaults to Roles.USER.value.
+            save (bool, optional): Flag to persistency logic. Defaults to True.
+            use_historial (bool, optional):flag to add chat historial. Defaults to True.
+            cache (bool, optional): reuse the response of identical requests,
+                                    only with temperature 0. Defaults to False.
+            temperature (float, optional): sampling temperature, API default if None.
+            guild_id (str, optional): guild of the chat, for usage accounting.
+            timeout (float, optional): seconds to wait for the API, no limit
+                                       if None. Defaults to None.
+            prepared (PreparedMessages, optional): messages already built for
+                this client by build_messages, prepared here if None.
+
+        Raises:
+            a_e: Authentication error over API.
+            asyncio.TimeoutError: the API didn't answer before the timeout.
+
+        Returns:
+            ChatCompletionResponse | None: ChatCompetionResponse, otherwise None
+        """
+        params = {} if temperature is None else {"temperature": temperature}
+        if prepared is None:
+            prepared = await self._aprepare_messages(
+                user, chat_id, content, role, use_historial
             )
-            new_response = Message(
-                role=Roles.ASSISTANT.value,
-                content=chat_response.choices[0].message.content,
-                name=None,
+        historial_messages, new_prompt, consolidated_messages = prepared
+        start = monotonic()
+        response, cached = await asyncio.wait_for(
+            self._acomplete(
+                consolidated_messages, cache=cache, queue_key=user.id, **params
+            ),
+            timeout,
+        )
+        chat_response = self._process_response(
+            response, user, historial_messages, new_prompt, save=False
+        )
+        await self._arecord_usage(
+            user, chat_id, guild_id, chat_response.usage, monotonic() - start, cached
+        )
+        if save:
+            await self._asave_turn(
+                user,
+                historial_messages,
+                new_prompt,
+                chat_response.choices[0].message.content,
             )
+            self._schedule_summary(user, chat_id)
+        return chat_response
+
+    async def acomplete(
+        self,
+        messages: List[Dict[str, Any]],
+        cache: bool = False,
+        queue_key: str = "",
+        **params: Any,
+    ) -> OpenAIObject:
+        """Raw async ChatCompletion call, capped by request_semaphore and
+        without any historial logic. When cache is set and the params are
+        deterministic the response is shared with identical requests, the
+        message author names are not sent so they don't split the cache.
+
+        Args:
+            messages (List[Dict[str, Any]]): messages payload.
+            cache (bool, optional): use the response cache. Defaults to False.
+            queue_key (str, optional): scheduler queue of the call, usually the
+                                       user id. Defaults to "".
+            **params (Any): extra ChatCompletion parameters.
+
+        Raises:
+            a_e: Authentication error over API.
+
+        Returns:
+            OpenAIObject: raw response from the API.
+        """
+        response, _ = await self._acomplete(messages, cache, queue_key, **params)
+        return response
+
+    async def _acomplete(
+        self,
+        messages: List[Dict[str, Any]],
+        cache: bool = False,
+        queue_key: str = "",
+        **params: Any,
+    ) -> Tuple[OpenAIObject, bool]:
+        """acomplete, also telling if the response was reused from the cache."""
+        if (
+            cache
+            and self.response_cache is not None
+            and ResponseCache.is_cacheable(params)
+        ):
+            messages = [
+                {key: value for key, value in message.items() if key != "name"}
+                for message in messages
+            ]
+            return await self.response_cache.get_or_fetch_reused(
+                ResponseCache.key(self.model, messages, params),
+                lambda: self._ascheduled(
+                    queue_key,
+                    messages,
+                    params,
+                    lambda: self._acreate(messages, **params),
+                ),
+            )
+        response = await self._ascheduled(
+            queue_key, messages, params, lambda: self._acreate(messages, **params)
+        )
+        return response, False
+
+    async def _ascheduled(
+        self,
+        queue_key: str,
+        messages: List[Dict[str, Any]],
+        params: Dict[str, Any],
+        call: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """Run an API call through the scheduler, if any. The tokens budget is
+        taken on the prompt plus the completion allowance and corrected with
+        the usage reported by the API. Streams are timed until they are open."""
+        if self.scheduler is None:
+            with tracer.span("api_call"):
+                return await call()
+        estimated_tokens = payload_tokens(messages, self.model) + params.get(
+            "max_tokens", TokenCounts.COMPLETION_RESERVE.value
+        )
+        with tracer.span("api_call"):
+            response = await self.scheduler.submit(queue_key, estimated_tokens, call)
+        if isinstance(response, OpenAIObject) and "usage" in response:
+            self.scheduler.report_usage(
+                estimated_tokens, response["usage"]["total_tokens"]
+            )
+        return response
+
+    async def _acreate(
+        self, messages: List[Dict[str, Any]], **params: Any
+    ) -> OpenAIObject:
+        await self._atest_token()
+        try:
+            async with self.request_semaphore:
+                with self._session_context():
+                    response: OpenAIObject = await self.api.ChatCompletion.acreate(
+                        model=self.model, messages=messages, **params
+                    )
         except AuthenticationError as a_e:
             raise a_e
+        return response
+
+    async def _aopen_stream(
+        self, messages: List[Dict[str, Any]], **params: Any
+    ) -> AsyncGenerator[OpenAIObject, None]:
+        """Start a streamed ChatCompletion. The request_semaphore slot is kept
+        until the caller releases it once the stream is consumed."""
+        await self.request_semaphore.acquire()
+        try:
+            with self._session_context():
+                return await self.api.ChatCompletion.acreate(
+                    model=self.model, messages=messages, stream=True, **params
+                )
+        except BaseException:
+            self.request_semaphore.release()
+            raise
+
+    async def astream_chat_completion(
+        self,
+        user: User,
+        chat_id: str,
+        content: str,
+        role: str = Roles.USER.value,
+        save: bool = True,
+        use_historial: bool = True,
+        cache: bool = False,
+        temperature: float = None,
+        guild_id: str = None,
+        timeout: float = None,
+        prepared: PreparedMessages = None,
+    ) -> AsyncGenerator[str, None]:
+        """Streaming version of asend_chat_completion, yields the content deltas
+        as soon as they arrive. Once the stream is finished the assembled
+        response is persisted on the ChatHistorial.
 
+        Args:
+            user (User): user sending the message.
+            chat_id (str): chat internal id.
+            content (str): message to be sent.
+            role (str, optional): API compatible role. Defaults to Roles.USER.value.
+            save (bool, optional): Flag to persistency logic. Defaults to True.
+            use_historial (bool, optional):flag to add chat historial. Defaults to True.
+            cache (bool, optional): reuse the response of identical requests,
+                                    only with temperature 0. The response is
+                                    then yielded at once. Defaults to False.
+            temperature (float, optional): sampling temperature, API default if None.
+            guild_id (str, optional): guild of the chat, for usage accounting.
+            timeout (float, optional): seconds to wait for the API, no limit
+                                       if None. Defaults to None.
+            prepared (PreparedMessages, optional): messages already built for
+                this client by build_messages, prepared here if None.
+
+        Raises:
+            a_e: Authentication error over API.
+            asyncio.TimeoutError: the stream didn't start before the timeout.
+
+        Yields:
+            str: content deltas of the response.
+        """
+        params = {} if temperature is None else {"temperature": temperature}
+        if prepared is None:
+            prepared = await self._aprepare_messages(
+                user, chat_id, content, role, use_historial
+            )
+        historial_messages, new_prompt, consolidated_messages = prepared
+        start = monotonic()
+        deltas = []
+        cached = False
+        if cache and ResponseCache.is_cacheable(params):
+            response, cached = await asyncio.wait_for(
+                self._acomplete(
+                    consolidated_messages, cache=True, queue_key=user.id, **params
+                ),
+                timeout,
+            )
+            deltas.append(response["choices"][0]["message"]["content"])
+            yield deltas[0]
+        else:
+            await self._atest_token()
+            try:
+                response = await asyncio.wait_for(
+                    self._ascheduled(
+                        user.id,
+                        consolidated_messages,
+                        params,
+                        lambda: self._aopen_stream(consolidated_messages, **params),
+                    ),
+                    timeout,
+                )
+                try:
+                    async for chunk in response:
+                        delta = chunk["choices"][0]["delta"].get("content")
+                        if delta:
+                            deltas.append(delta)
+                            yield delta
+                finally:
+                    self.request_semaphore.release()
+            except AuthenticationError as a_e:
+                raise a_e
+
+        """Streamed responses don't report usage, it is counted locally"""
+        prompt_tokens = payload_tokens(consolidated_messages, self.model)
+        completion_tokens = count_tokens("".join(deltas), self.model)
+        await self._arecord_usage(
+            user,
+            chat_id,
+            guild_id,
+            Usage(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            ),
+            monotonic() - start,
+            cached,
+        )
         if save:
-            self.chat_historial_handler.update(
-                self.user.id, historial_messages.id, new_prompt, new_response
+            await self._asave_turn(
+                user, historial_messages, new_prompt, "".join(deltas)
             )
-        return chat_response
+            self._schedule_summary(user, chat_id)
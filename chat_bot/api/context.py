@@ -0,0 +1,89 @@
+"""
+Context window builder for ChatCompletion requests
+"""
+from typing import Any, Dict, List, Sequence
+
+from chat_bot.api.tokens import message_tokens
+from chat_bot.models.message import Message
+from chat_bot.utils.enums import ContextWindows, Engines, Roles, TokenCounts
+
+
+class ContextBuilder:
+    """
+    Builds the list of messages sent to the API keeping it under a token
+    budget: system profile messages and the summary of the older turns are
+    always sent, then the most recent messages are added, from newest to
+    oldest, while they fit. Past turns retrieved from the long-term memory
+    fill the budget left, from the newest too, and go before the recent ones.
+    """
+
+    def __init__(
+        self,
+        model: str = Engines.GPT_3_5_TURBO.value,
+        context_window: int = None,
+        completion_reserve: int = TokenCounts.COMPLETION_RESERVE.value,
+    ) -> None:
+        self.model = model
+        if context_window is None:
+            context_window = ContextWindows[Engines(model).name].value
+        self.budget = context_window - completion_reserve - TokenCounts.PER_REPLY.value
+
+    def build(
+        self,
+        messages: List[Message],
+        summary: Message = None,
+        relevant: List[Sequence[Message]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Select the messages that fit in the budget.
+
+        Args:
+            messages (List[Message]): conversation, the last one is the new prompt.
+            summary (Message, optional): summary of the compacted turns.
+                                         Defaults to None.
+            relevant (List[Sequence[Message]], optional): retrieved past turns,
+                in conversation order, each one sent whole or not at all.
+                Defaults to None.
+
+        Returns:
+            List[Dict[str, Any]]: API payload for the selected messages,
+                                  in conversation order.
+        """
+        if not messages:
+            return []
+        *previous, new_message = messages
+        system_indexes = [
+            index
+            for index, message in enumerate(previous)
+            if message.role == Roles.SYSTEM.value
+        ]
+        remaining = self.budget - message_tokens(new_message, self.model)
+        remaining -= sum(
+            message_tokens(previous[index], self.model) for index in system_indexes
+        )
+        if summary is not None:
+            remaining -= message_tokens(summary, self.model)
+
+        selected = set(system_indexes)
+        for index in range(len(previous) - 1, -1, -1):
+            if index in selected:
+                continue
+            tokens = message_tokens(previous[index], self.model)
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            selected.add(index)
+
+        recalled = []
+        for turn in reversed(relevant or []):
+            tokens = sum(message_tokens(message, self.model) for message in turn)
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            recalled[:0] = [message.to_api() for message in turn]
+
+        payload = [previous[index].to_api() for index in sorted(selected)]
+        if summary is not None:
+            payload.insert(len(system_indexes), summary.to_api())
+        position = len(system_indexes) + (summary is not None)
+        payload[position:position] = recalled
+        return payload + [new_message.to_api()]
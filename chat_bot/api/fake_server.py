@@ -0,0 +1,167 @@
+"""
+Local stand-in for the OpenAI API, answers ChatCompletion requests (plain
+and streamed) echoing the last message after a configurable latency. Point
+openai.api_base to FakeOpenAIServer.api_base to use it, or run it with:
+
+    python -m chat_bot.api.fake_server --port 8765 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+from time import time
+from typing import Dict, List
+
+from aiohttp import web
+
+from chat_bot.utils.logger import logger
+
+
+class FakeOpenAIServer:
+    """
+    Minimal aiohttp server mimicking the ChatCompletion and Model endpoints
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        latency: float = 0.0,
+        chunk_latency: float = 0.0,
+        rate_limited: int = 0,
+        retry_after: float = 0.0,
+        model_latencies: Dict[str, float] = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        """Amount of upcoming requests answered with a 429"""
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+        """Latency of the models answering slower or faster than latency"""
+        self.model_latencies = model_latencies or {}
+        self.requests: List[dict] = []
+        self._runner: web.AppRunner = None
+
+    @property
+    def api_base(self) -> str:
+        """Base url to be set on openai.api_base"""
+        return f"http://{self.host}:{self.port}/v1"
+
+    @staticmethod
+    def reply_for(body: dict) -> str:
+        """Content answered for a request body"""
+        return f"echo: {body['messages'][-1]['content']}"
+
+    @staticmethod
+    def _usage(body: dict, reply: str) -> dict:
+        prompt_tokens = sum(
+            len(message["content"]) // 4 + 4 for message in body["messages"]
+        )
+        completion_tokens = len(reply) // 4 + 1
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    async def _chat_completion(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if self.rate_limited > 0:
+            self.rate_limited -= 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self.requests.append(body)
+        await asyncio.sleep(self.model_latencies.get(body["model"], self.latency))
+        reply = self.reply_for(body)
+        if not body.get("stream"):
+            return web.json_response(
+                {
+                    "id": f"chatcmpl-{len(self.requests)}",
+                    "object": "chat.completion",
+                    "created": int(time()),
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": reply},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": self._usage(body, reply),
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in reply.split(" "):
+            chunk = {
+                "id": f"chatcmpl-{len(self.requests)}",
+                "object": "chat.completion.chunk",
+                "created": int(time()),
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": f"{word} "},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(self.chunk_latency)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    @staticmethod
+    async def _model(request: web.Request) -> web.Response:
+        return web.json_response(
+            {"id": request.match_info["model"], "object": "model", "owned_by": "fake"}
+        )
+
+    async def start(self) -> None:
+        """Start serving on host:port"""
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat_completion)
+        app.router.add_get("/v1/models/{model}", self._model)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Fake OpenAI server listening on {self.api_base}")
+
+    async def stop(self) -> None:
+        """Stop serving"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve_forever(server: FakeOpenAIServer) -> None:
+    await server.start()
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--chunk-latency", type=float, default=0.0)
+    parser.add_argument("--rate-limited", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(
+        _serve_forever(
+            FakeOpenAIServer(
+                args.host,
+                args.port,
+                args.latency,
+                args.chunk_latency,
+                args.rate_limited,
+                args.retry_after,
+            )
+        )
+    )
@@ -0,0 +1,121 @@
+"""
+Process-wide registry of OpenAI clients
+"""
+import asyncio
+from typing import Dict
+from aiohttp import ClientSession
+from chat_bot.api.chat_gpt import OpenAIApi
+from chat_bot.api.response_cache import ResponseCache
+from chat_bot.api.scheduler import RequestScheduler
+from chat_bot.api.summarizer import HistorialSummarizer
+from chat_bot.historial.handler import ChatHistorialHandler
+from chat_bot.retrieval.handler import RetrievalHandler
+from chat_bot.usage.handler import UsageHandler
+from chat_bot.utils.enums import Engines, Limits, Summarization
+from chat_bot.utils.locks import ConversationLockManager
+from chat_bot.utils.logger import logger
+
+
+class OpenAIClientRegistry:
+    """
+    Keeps one long-lived OpenAIApi per model, all of them sharing the same
+    aiohttp session and the same concurrency cap.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        chat_historial_handler: ChatHistorialHandler = None,
+        conversation_locks: ConversationLockManager = None,
+        max_concurrent_requests: int = Limits.MAX_CONCURRENT_REQUESTS.value,
+        token_ttl: float = Limits.TOKEN_VALIDATION_TTL.value,
+        summarization: bool = False,
+        summarization_threshold: int = Summarization.THRESHOLD.value,
+        summarization_keep_recent: int = Summarization.KEEP_RECENT.value,
+        response_cache: ResponseCache = None,
+        scheduler: RequestScheduler = None,
+        usage_handler: UsageHandler = None,
+        retrieval: RetrievalHandler = None,
+    ) -> None:
+        self.token = token
+        self.chat_historial_handler = chat_historial_handler or ChatHistorialHandler()
+        self.conversation_locks = conversation_locks
+        self.request_semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self.token_ttl = token_ttl
+        self.summarization = summarization
+        self.summarization_threshold = summarization_threshold
+        self.summarization_keep_recent = summarization_keep_recent
+        self.response_cache = response_cache
+        self.scheduler = scheduler
+        self.usage_handler = usage_handler
+        self.retrieval = retrieval
+        self.session: ClientSession = None
+        self._clients: Dict[str, OpenAIApi] = {}
+
+    def get(self, model: str = Engines.GPT_3_5_TURBO.value) -> OpenAIApi:
+        """Return the client for a model, creating it on first use.
+
+        Args:
+            model (str, optional): OpenAI model. Defaults to Engines.GPT_3_5_TURBO.value.
+
+        Returns:
+            OpenAIApi: shared client for the model.
+        """
+        client = self._clients.get(model)
+        if client is None:
+            client = OpenAIApi(
+                token=self.token,
+                model=model,
+                chat_historial_handler=self.chat_historial_handler,
+                request_semaphore=self.request_semaphore,
+                token_ttl=self.token_ttl,
+            )
+            client.session = self.session
+            client.response_cache = self.response_cache
+            client.scheduler = self.scheduler
+            client.usage_handler = self.usage_handler
+            client.retrieval = self.retrieval
+            if self.summarization:
+                client.summarizer = HistorialSummarizer(
+                    client,
+                    self.chat_historial_handler,
+                    conversation_locks=self.conversation_locks,
+                    threshold=self.summarization_threshold,
+                    keep_recent=self.summarization_keep_recent,
+                )
+            self._clients[model] = client
+        return client
+
+    async def start(self, model: str = Engines.GPT_3_5_TURBO.value) -> None:
+        """Open the pooled HTTP session and validate the token once.
+
+        Args:
+            model (str, optional): model used to validate the token.
+                                   Defaults to Engines.GPT_3_5_TURBO.value.
+        """
+        if self.session is None:
+            self.session = ClientSession()
+            for client in self._clients.values():
+                client.session = self.session
+        await self.get(model)._atest_token()
+        logger.info("OpenAI client registry started!")
+
+    async def close(self) -> None:
+        """Cancel the background summaries, wait for the turns being
+        remembered, stop the scheduler and close the pooled HTTP session."""
+        await asyncio.gather(
+            *(
+                client.summarizer.close()
+                for client in self._clients.values()
+                if client.summarizer is not None
+            )
+        )
+        if self.retrieval is not None:
+            await self.retrieval.close()
+        if self.scheduler is not None:
+            await self.scheduler.close()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+            for client in self._clients.values():
+                client.session = None
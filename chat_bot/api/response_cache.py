@@ -0,0 +1,130 @@
+"""
+Response cache and request coalescing for identical ChatCompletion calls
+"""
+import asyncio
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from openai.openai_object import OpenAIObject
+
+from chat_bot.utils.cache import LRUCache
+
+
+@dataclass
+class ResponseCacheStats:
+    """
+    Counters of a ResponseCache, on top of the ones of its LRUCache
+    """
+
+    hits: int = 0
+    coalesced: int = 0
+    upstream_calls: int = 0
+    in_flight: int = 0
+
+
+class ResponseCache:
+    """
+    Reuses the response of a ChatCompletion call for identical requests. Only
+    deterministic requests, sent with temperature 0, are cacheable. Identical
+    requests arriving while the first one is in flight wait for it instead of
+    calling the API again.
+    """
+
+    def __init__(self, cache: LRUCache) -> None:
+        self.cache = cache
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._stats = ResponseCacheStats()
+
+    @staticmethod
+    def is_cacheable(params: Dict[str, Any]) -> bool:
+        """Check if the sampling params make the response deterministic.
+
+        Args:
+            params (Dict[str, Any]): ChatCompletion parameters.
+
+        Returns:
+            bool: True if the response can be reused.
+        """
+        return params.get("temperature") == 0 and params.get("n", 1) == 1
+
+    @staticmethod
+    def key(model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+        """Hash of everything that determines the response.
+
+        Args:
+            model (str): OpenAI model.
+            messages (List[Dict[str, Any]]): messages payload.
+            params (Dict[str, Any]): ChatCompletion parameters.
+
+        Returns:
+            str: cache key.
+        """
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get_or_fetch(
+        self, key: str, fetch: Callable[[], Awaitable[OpenAIObject]]
+    ) -> OpenAIObject:
+        """Return the cached response for key, otherwise call fetch once for
+        every concurrent caller of the same key and cache its result.
+        Failures are not cached and are raised to every waiting caller.
+
+        Args:
+            key (str): cache key.
+            fetch (Callable[[], Awaitable[OpenAIObject]]): upstream call.
+
+        Returns:
+            OpenAIObject: response.
+        """
+        response, _ = await self.get_or_fetch_reused(key, fetch)
+        return response
+
+    async def get_or_fetch_reused(
+        self, key: str, fetch: Callable[[], Awaitable[OpenAIObject]]
+    ) -> Tuple[OpenAIObject, bool]:
+        """get_or_fetch, also telling if the response was reused.
+
+        Returns:
+            Tuple[OpenAIObject, bool]: response, and True if it was cached or
+                fetched for another caller, so this one wasn't billed for it.
+        """
+        response = self.cache.get(key)
+        if response is not None:
+            self._stats.hits += 1
+            return response, True
+        task = self._in_flight.get(key)
+        reused = task is not None
+        if reused:
+            self._stats.coalesced += 1
+        else:
+            """The call runs on its own task, a cancelled caller doesn't
+            cancel it for the others"""
+            self._stats.upstream_calls += 1
+            task = asyncio.create_task(fetch())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._settle(key, done))
+        return await asyncio.shield(task), reused
+
+    def _settle(self, key: str, task: asyncio.Task) -> None:
+        del self._in_flight[key]
+        if not task.cancelled() and task.exception() is None:
+            self.cache.put(key, task.result())
+
+    def stats(self) -> ResponseCacheStats:
+        """Snapshot of the counters.
+
+        Returns:
+            ResponseCacheStats: counters.
+        """
+        return ResponseCacheStats(
+            hits=self._stats.hits,
+            coalesced=self._stats.coalesced,
+            upstream_calls=self._stats.upstream_calls,
+            in_flight=len(self._in_flight),
+        )
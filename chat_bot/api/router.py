@@ -0,0 +1,462 @@
+"""
+Model router, picks the OpenAI model of each request and keeps the request
+under the deadline of its guild.
+
+The candidates of a request are the models of the guild policy whose context
+window holds the payload their client would send: the conversation as the
+ContextBuilder trims it, with the summary and the retrieved turns, so a long
+conversation still goes to a cheap model while its context fits. The
+conversation is loaded and retrieved from once, and the payloads built for the
+decision are the ones sent. The candidates keep the order of the policy,
+except that the models whose recent latency would miss the deadline go last.
+The first candidate gets the deadline minus the time kept for the next one.
+The fallbacks are then tried from the cheapest while there is time left. When
+no candidate answers on time DeadlineExceededError is raised, for the caller
+to send a canned reply.
+
+Every decision is counted on the metrics and, when a writer is given,
+appended to a json lines log per day under db/routing to tune the policies.
+"""
+import asyncio
+from collections import deque
+from threading import Lock
+from time import monotonic, time
+from typing import AsyncGenerator, Deque, Dict, List, Tuple
+
+from chat_bot.api.chat_gpt import PreparedMessages
+from chat_bot.api.registry import OpenAIClientRegistry
+from chat_bot.api.tokens import payload_tokens
+from chat_bot.models.response import ChatCompletionResponse
+from chat_bot.models.routing import RoutingAttempt, RoutingDecision, RoutingPolicy
+from chat_bot.models.user import User
+from chat_bot.usage.handler import usage_day
+from chat_bot.utils.enums import (
+    ContextWindows,
+    Directories,
+    Engines,
+    Extensions,
+    ModelCosts,
+    Roles,
+    Routing,
+    TokenCounts,
+)
+from chat_bot.utils.handlers.file_handler import GroupCommitWriter, JsonLinesHandler
+from chat_bot.utils.handlers.path_handler import PathHandler
+from chat_bot.utils.logger import logger
+from chat_bot.utils.metrics import metrics_registry, tracer
+
+routing_decisions_total = metrics_registry.counter(
+    "chat_bot_routing_decisions_total", "Routed requests, by final model and outcome"
+)
+model_latency_seconds = metrics_registry.histogram(
+    "chat_bot_model_latency_seconds",
+    "Seconds until the first content of a response, by model",
+)
+
+
+class DeadlineExceededError(asyncio.TimeoutError):
+    """No model answered before the deadline of the request"""
+
+
+class LatencyTracker:
+    """
+    Rolling window of the latencies observed per model. Old observations are
+    forgotten, so a model that was slow gets tried again as primary.
+    """
+
+    def __init__(
+        self,
+        window: int = Routing.LATENCY_WINDOW.value,
+        quantile: float = Routing.LATENCY_QUANTILE.value,
+        max_age: float = Routing.LATENCY_MAX_AGE.value,
+    ) -> None:
+        self.window = window
+        self.quantile = quantile
+        self.max_age = max_age
+        self._latencies: Dict[str, Deque[Tuple[float, float]]] = {}
+        self._lock = Lock()
+
+    def observe(self, model: str, latency: float) -> None:
+        """Record a latency of a model.
+
+        Args:
+            model (str): OpenAI model.
+            latency (float): seconds until the first content of a response,
+                             infinite for a timeout.
+        """
+        with self._lock:
+            latencies = self._latencies.get(model)
+            if latencies is None:
+                latencies = self._latencies[model] = deque(maxlen=self.window)
+            latencies.append((monotonic(), latency))
+
+    def estimate(self, model: str) -> float | None:
+        """Expected latency of a model, the quantile of its recent latencies.
+
+        Args:
+            model (str): OpenAI model.
+
+        Returns:
+            float | None: seconds, None if there are no recent observations.
+        """
+        oldest = monotonic() - self.max_age
+        with self._lock:
+            latencies = sorted(
+                latency
+                for observed, latency in self._latencies.get(model, ())
+                if observed >= oldest
+            )
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.quantile))]
+
+
+class ModelRouter:
+    """
+    Routes the chat turns of the bot to the clients of an OpenAIClientRegistry
+    """
+
+    def __init__(
+        self,
+        registry: OpenAIClientRegistry,
+        default_policy: RoutingPolicy = None,
+        policies: Dict[str, RoutingPolicy] = None,
+        latency_tracker: LatencyTracker = None,
+        fallback_share: float = Routing.FALLBACK_SHARE.value,
+        writer: GroupCommitWriter = None,
+        path_handler: PathHandler = None,
+        root: str = Directories.CWD.value,
+        partition: str = None,
+    ) -> None:
+        """
+        Args:
+            registry (OpenAIClientRegistry): clients of the models.
+            default_policy (RoutingPolicy, optional): policy of the guilds
+                without one, and of direct messages. RoutingPolicy() if None.
+            policies (Dict[str, RoutingPolicy], optional): policies by guild id.
+            latency_tracker (LatencyTracker, optional): observed latencies,
+                a new one if None.
+            fallback_share (float, optional): share of the deadline kept for the
+                next candidate while its latency is unknown.
+                Defaults to Routing.FALLBACK_SHARE.value.
+            writer (GroupCommitWriter, optional): writer of the decisions log,
+                the decisions are only counted on the metrics if None.
+            path_handler (PathHandler, optional): path utilities.
+            root (str, optional): directory holding db/. Defaults to Directories.CWD.value.
+            partition (str, optional): subdirectory of db/routing, for processes
+                routing side by side. Defaults to None.
+        """
+        self.registry = registry
+        self.default_policy = default_policy or RoutingPolicy()
+        self.policies = policies or {}
+        self.latency_tracker = latency_tracker or LatencyTracker()
+        self.fallback_share = fallback_share
+        self.log_handler = None if writer is None else JsonLinesHandler(writer=writer)
+        self.path_handler = path_handler or PathHandler()
+        self.path_components = [root, Directories.DB.value, Directories.ROUTING.value]
+        if partition is not None:
+            self.path_components.append(partition)
+        self._directory_created = False
+
+    def policy(self, guild_id: str | None) -> RoutingPolicy:
+        """Policy of a guild, the default one if it has none."""
+        return self.policies.get(guild_id, self.default_policy)
+
+    def candidates(
+        self, policy: RoutingPolicy, prompt_tokens: Dict[str, int]
+    ) -> List[str]:
+        """Models to try for a prompt, in order.
+
+        Args:
+            policy (RoutingPolicy): policy of the request.
+            prompt_tokens (Dict[str, int]): tokens of the payload built for
+                each model of the policy.
+
+        Returns:
+            List[str]: the primary model followed by the fallbacks.
+        """
+        """Payloads are trimmed to the window, only the system messages, the
+        summary and the new prompt can overflow it. If none fits all do"""
+        fitting = [
+            model
+            for model in policy.models
+            if prompt_tokens[model] + TokenCounts.COMPLETION_RESERVE.value
+            <= ContextWindows[Engines(model).name].value
+        ] or list(policy.models)
+        estimates = {model: self.latency_tracker.estimate(model) for model in fitting}
+        late = {
+            model
+            for model, estimate in estimates.items()
+            if estimate is not None and estimate > policy.deadline
+        }
+        primary = next((model for model in fitting if model not in late), fitting[0])
+        fallbacks = sorted(
+            (model for model in fitting if model != primary),
+            key=lambda model: (
+                model in late,
+                ModelCosts[Engines(model).name].value,
+                estimates[model] or 0.0,
+            ),
+        )
+        return [primary, *fallbacks]
+
+    def _reserve(self, deadline: float, model: str) -> float:
+        """Seconds kept for a fallback model, never more than its share."""
+        estimate = self.latency_tracker.estimate(model)
+        if estimate is None:
+            return deadline * self.fallback_share
+        return min(estimate, deadline * self.fallback_share)
+
+    def _timeout(
+        self, decision: RoutingDecision, index: int, elapsed: float
+    ) -> float | None:
+        """Seconds given to a candidate, None to skip it since it would miss
+        the deadline of the request."""
+        remaining = decision.deadline - elapsed
+        model = decision.candidates[index]
+        if index == len(decision.candidates) - 1:
+            return remaining if remaining > 0 else None
+        timeout = remaining - self._reserve(
+            decision.deadline, decision.candidates[index + 1]
+        )
+        estimate = self.latency_tracker.estimate(model)
+        if timeout <= 0 or (estimate is not None and estimate > timeout):
+            return None
+        return timeout
+
+    async def _aprepare(
+        self, policy: RoutingPolicy, user: User, chat_id: str, content: str, role: str
+    ) -> Dict[str, PreparedMessages]:
+        """Messages the client of each model of a policy sends, the
+        conversation is loaded and retrieved from once."""
+        chat_historial, relevant = await self.registry.get(
+            policy.models[0]
+        ).aload_context(user, chat_id, content)
+        with tracer.span("context_build"):
+            return {
+                model: self.registry.get(model).build_messages(
+                    user, chat_historial, content, role, relevant
+                )
+                for model in policy.models
+            }
+
+    async def _adecide(
+        self, user: User, chat_id: str, content: str, role: str, guild_id: str | None
+    ) -> Tuple[RoutingDecision, Dict[str, PreparedMessages]]:
+        policy = self.policy(guild_id)
+        prepared = await self._aprepare(policy, user, chat_id, content, role)
+        prompt_tokens = {
+            model: payload_tokens(messages, model)
+            for model, (_, _, messages) in prepared.items()
+        }
+        candidates = self.candidates(policy, prompt_tokens)
+        decision = RoutingDecision(
+            timestamp=time(),
+            user_id=user.id,
+            chat_id=chat_id,
+            guild_id=guild_id,
+            prompt_tokens=prompt_tokens[candidates[0]],
+            deadline=policy.deadline,
+            candidates=candidates,
+        )
+        return decision, prepared
+
+    def _attempt(
+        self,
+        decision: RoutingDecision,
+        model: str,
+        outcome: str,
+        started: float = None,
+        timeout: float = None,
+    ) -> None:
+        """Add an attempt to the decision and feed its latency to the tracker."""
+        latency = 0.0 if started is None else monotonic() - started
+        decision.attempts.append(
+            RoutingAttempt(
+                model=model, outcome=outcome, latency=latency, timeout=timeout
+            )
+        )
+        if outcome == "answered":
+            decision.model = model
+            self.latency_tracker.observe(model, latency)
+            model_latency_seconds.observe(latency, model=model)
+        elif outcome == "timeout":
+            self.latency_tracker.observe(model, float("inf"))
+
+    def _record(self, decision: RoutingDecision, started: float) -> None:
+        """Count the decision and append it to the log of its day."""
+        decision.latency = monotonic() - started
+        if decision.model is None:
+            outcome = (
+                "error"
+                if decision.attempts and decision.attempts[-1].outcome == "error"
+                else "deadline_exceeded"
+            )
+        elif decision.model == decision.candidates[0]:
+            outcome = "answered"
+        else:
+            outcome = "fallback"
+        routing_decisions_total.inc(model=decision.model or "none", outcome=outcome)
+        tracer.log(
+            f"routed to {decision.model} ({outcome}) after "
+            f"{[(attempt.model, attempt.outcome) for attempt in decision.attempts]}"
+        )
+        if self.log_handler is None:
+            return
+        try:
+            if not self._directory_created:
+                self.path_handler.create_directory(
+                    self.path_handler.compose_path(self.path_components)
+                )
+                self._directory_created = True
+            day = usage_day(decision.timestamp)
+            self.log_handler.append(
+                [decision.dict()],
+                self.path_handler.compose_path(
+                    [
+                        *self.path_components,
+                        f"{day.isoformat()}{Extensions.DOT_JSONL.value}",
+                    ]
+                ),
+            )
+        except OSError as o_e:
+            """A lost decision must not fail the turn"""
+            logger.error(o_e)
+
+    async def asend_chat_completion(
+        self,
+        user: User,
+        chat_id: str,
+        content: str,
+        role: str = Roles.USER.value,
+        cache: bool = False,
+        temperature: float = None,
+        guild_id: str = None,
+    ) -> ChatCompletionResponse:
+        """Send a chat turn to the routed models until one answers before the
+        deadline, see OpenAIApi.asend_chat_completion.
+
+        Args:
+            user (User): user sending the message.
+            chat_id (str): chat internal id.
+            content (str): message to be sent.
+            role (str, optional): API compatible role. Defaults to Roles.USER.value.
+            cache (bool, optional): reuse the response of identical requests,
+                                    only with temperature 0. Defaults to False.
+            temperature (float, optional): sampling temperature, API default if None.
+            guild_id (str, optional): guild of the chat, picks the policy.
+
+        Raises:
+            DeadlineExceededError: no model answered before the deadline.
+
+        Returns:
+            ChatCompletionResponse: response of the model that answered.
+        """
+        decision, prepared = await self._adecide(user, chat_id, content, role, guild_id)
+        started = monotonic()
+        try:
+            for index, model in enumerate(decision.candidates):
+                timeout = self._timeout(decision, index, monotonic() - started)
+                if timeout is None:
+                    self._attempt(decision, model, "skipped")
+                    continue
+                attempt_started = monotonic()
+                try:
+                    response = await self.registry.get(model).asend_chat_completion(
+                        user=user,
+                        chat_id=chat_id,
+                        content=content,
+                        role=role,
+                        cache=cache,
+                        temperature=temperature,
+                        guild_id=guild_id,
+                        timeout=timeout,
+                        prepared=prepared[model],
+                    )
+                except asyncio.TimeoutError:
+                    self._attempt(decision, model, "timeout", attempt_started, timeout)
+                    continue
+                except Exception as e:
+                    self._attempt(decision, model, "error", attempt_started, timeout)
+                    raise e
+                self._attempt(decision, model, "answered", attempt_started, timeout)
+                return response
+            raise DeadlineExceededError(
+                f"No model answered in {decision.deadline:.1f}s"
+            )
+        finally:
+            self._record(decision, started)
+
+    async def astream_chat_completion(
+        self,
+        user: User,
+        chat_id: str,
+        content: str,
+        role: str = Roles.USER.value,
+        cache: bool = False,
+        temperature: float = None,
+        guild_id: str = None,
+    ) -> AsyncGenerator[str, None]:
+        """Streaming version of asend_chat_completion, the deadline applies to
+        the first delta of the response.
+
+        Args:
+            user (User): user sending the message.
+            chat_id (str): chat internal id.
+            content (str): message to be sent.
+            role (str, optional): API compatible role. Defaults to Roles.USER.value.
+            cache (bool, optional): reuse the response of identical requests,
+                                    only with temperature 0. Defaults to False.
+            temperature (float, optional): sampling temperature, API default if None.
+            guild_id (str, optional): guild of the chat, picks the policy.
+
+        Raises:
+            DeadlineExceededError: no model started answering before the deadline.
+
+        Yields:
+            str: content deltas of the response.
+        """
+        decision, prepared = await self._adecide(user, chat_id, content, role, guild_id)
+        started = monotonic()
+        stream = None
+        try:
+            for index, model in enumerate(decision.candidates):
+                timeout = self._timeout(decision, index, monotonic() - started)
+                if timeout is None:
+                    self._attempt(decision, model, "skipped")
+                    continue
+                attempt_started = monotonic()
+                stream = self.registry.get(model).astream_chat_completion(
+                    user=user,
+                    chat_id=chat_id,
+                    content=content,
+                    role=role,
+                    cache=cache,
+                    temperature=temperature,
+                    guild_id=guild_id,
+                    prepared=prepared[model],
+                )
+                try:
+                    first = await asyncio.wait_for(anext(stream, None), timeout)
+                except asyncio.TimeoutError:
+                    self._attempt(decision, model, "timeout", attempt_started, timeout)
+                    await stream.aclose()
+                    continue
+                except Exception as e:
+                    self._attempt(decision, model, "error", attempt_started, timeout)
+                    raise e
+                self._attempt(decision, model, "answered", attempt_started, timeout)
+                break
+            else:
+                raise DeadlineExceededError(
+                    f"No model answered in {decision.deadline:.1f}s"
+                )
+        finally:
+            self._record(decision, started)
+        try:
+            if first is not None:
+                yield first
+                async for delta in stream:
+                    yield delta
+        finally:
+            await stream.aclose()
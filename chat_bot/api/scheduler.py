@@ -0,0 +1,270 @@
+"""
+Rate limit aware scheduling of OpenAI API calls
+"""
+import asyncio
+import random
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from time import monotonic
+from typing import Awaitable, Callable, Deque, Tuple, TypeVar
+
+from openai.error import (
+    APIConnectionError,
+    APIError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+    TryAgain,
+)
+
+from chat_bot.utils.enums import RateLimits
+from chat_bot.utils.logger import logger
+
+T = TypeVar("T")
+
+RETRYABLE_ERRORS = (
+    RateLimitError,
+    Timeout,
+    TryAgain,
+    APIConnectionError,
+    ServiceUnavailableError,
+)
+
+
+@dataclass
+class SchedulerStats:
+    """
+    Counters of a RequestScheduler
+    """
+
+    queued: int = 0
+    max_queued: int = 0
+    dispatched: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    retries: int = 0
+    failures: int = 0
+
+
+class TokenBucket:
+    """
+    Budget refilled continuously up to its per minute capacity. It can go
+    negative when the real usage is reported over the estimation.
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self._updated = monotonic()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount: int) -> float:
+        """Seconds until amount is available, requests over the capacity
+        only wait for a full bucket."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(missing / self.rate, 0.0)
+
+    def consume(self, amount: int) -> None:
+        """Take amount from the budget, negative amounts give it back."""
+        self._refill()
+        self.level -= amount
+
+
+def retry_after(error: Exception) -> float:
+    """Seconds asked by the API through the Retry-After header, if any."""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def is_retryable(error: Exception) -> bool:
+    """Check if a failed call may succeed when repeated."""
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, APIError) and (error.http_status or 0) >= 500
+
+
+class RequestScheduler:
+    """
+    Sits in front of the OpenAI client. Keeps the calls under the requests
+    and tokens per minute budgets, dispatching the waiting ones round robin
+    between queue keys (users) so a single chatty user can't starve the
+    others, and retries the failed calls with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = RateLimits.REQUESTS_PER_MINUTE.value,
+        tokens_per_minute: int = RateLimits.TOKENS_PER_MINUTE.value,
+        max_retries: int = RateLimits.MAX_RETRIES.value,
+        backoff_base: float = RateLimits.BACKOFF_BASE.value,
+        backoff_max: float = RateLimits.BACKOFF_MAX.value,
+    ) -> None:
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queues: OrderedDict[
+            str, Deque[Tuple[asyncio.Future, int]]
+        ] = OrderedDict()
+        self._pending = asyncio.Event()
+        self._dispatcher: asyncio.Task = None
+        self._stats = SchedulerStats()
+
+    def queue_length(self, key: str = None) -> int:
+        """Calls waiting for budget.
+
+        Args:
+            key (str, optional): only the calls of this queue. Defaults to None.
+
+        Returns:
+            int: amount of waiting calls.
+        """
+        if key is not None:
+            return len(self._queues.get(key, ()))
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> SchedulerStats:
+        """Snapshot of the scheduler counters.
+
+        Returns:
+            SchedulerStats: counters.
+        """
+        return SchedulerStats(
+            queued=self.queue_length(),
+            max_queued=self._stats.max_queued,
+            dispatched=self._stats.dispatched,
+            total_wait=self._stats.total_wait,
+            max_wait=self._stats.max_wait,
+            retries=self._stats.retries,
+            failures=self._stats.failures,
+        )
+
+    def _next(self) -> Tuple[asyncio.Future, int]:
+        """Head of the next queue in round robin order, the queue goes last."""
+        key, queue = next(iter(self._queues.items()))
+        item = queue.popleft()
+        if queue:
+            self._queues.move_to_end(key)
+        else:
+            del self._queues[key]
+        return item
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._queues:
+                self._pending.clear()
+                await self._pending.wait()
+                continue
+            queue = next(iter(self._queues.values()))
+            future, tokens = queue[0]
+            if future.done():
+                self._next()
+                continue
+            delay = max(self.requests.delay(1), self.tokens.delay(tokens))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self._next()
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            future.set_result(None)
+
+    async def acquire(self, key: str, tokens: int) -> float:
+        """Wait the turn of a call on the queue of key.
+
+        Args:
+            key (str): queue key.
+            tokens (int): estimated tokens of the call.
+
+        Returns:
+            float: seconds waited.
+        """
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        start = monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append((future, tokens))
+        self._stats.max_queued = max(self._stats.max_queued, self.queue_length())
+        self._pending.set()
+        await future
+        wait = monotonic() - start
+        self._stats.dispatched += 1
+        self._stats.total_wait += wait
+        self._stats.max_wait = max(self._stats.max_wait, wait)
+        return wait
+
+    def report_usage(self, estimated_tokens: int, used_tokens: int) -> None:
+        """Correct the tokens budget with the real usage of a call.
+
+        Args:
+            estimated_tokens (int): tokens taken when the call was dispatched.
+            used_tokens (int): tokens reported by the API.
+        """
+        self.tokens.consume(used_tokens - estimated_tokens)
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """Seconds to wait before a retry, full jitter over an exponential
+        delay, never under the Retry-After asked by the API.
+
+        Args:
+            attempt (int): number of the failed attempt, starting on 0.
+            error (Exception): error of the failed attempt.
+
+        Returns:
+            float: seconds to wait.
+        """
+        delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+        return max(random.uniform(0, delay), retry_after(error))
+
+    async def submit(
+        self, key: str, tokens: int, call: Callable[[], Awaitable[T]]
+    ) -> T:
+        """Run a call when the budgets allow it, retrying it on rate limits,
+        timeouts and server errors.
+
+        Args:
+            key (str): queue key, calls of different keys are served round robin.
+            tokens (int): estimated tokens of the call.
+            call (Callable[[], Awaitable[T]]): API call.
+
+        Raises:
+            e: last error once the retries are exhausted, or a non retryable one.
+
+        Returns:
+            T: result of the call.
+        """
+        attempt = 0
+        while True:
+            await self.acquire(key, tokens)
+            try:
+                return await call()
+            except Exception as e:  # pylint: disable=broad-except
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self._stats.failures += 1
+                    logger.error(e)
+                    raise e
+                delay = self.backoff(attempt, e)
+                self._stats.retries += 1
+                logger.warning(f"Retrying in {delay:.2f}s after: {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def close(self) -> None:
+        """Stop the dispatcher."""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
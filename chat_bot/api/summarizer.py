@@ -0,0 +1,274 @@
+"""
+Rolling summarization of long ChatHistorial
+"""
+import asyncio
+from time import monotonic
+from typing import Dict, List, Set, Tuple
+
+from chat_bot.api.tokens import count_tokens, message_tokens, truncate_tokens
+from chat_bot.historial.handler import ChatHistorialHandler
+from chat_bot.models.historial import ChatHistorial
+from chat_bot.models.message import Message
+from chat_bot.models.response import ChatCompletionResponse
+from chat_bot.utils.enums import (
+    ContextWindows,
+    Engines,
+    Prompts,
+    Roles,
+    Summarization,
+    TokenCounts,
+)
+from chat_bot.utils.locks import ConversationLockManager
+from chat_bot.utils.logger import logger
+
+
+class HistorialSummarizer:
+    """
+    Once the non system messages of a conversation go over a token threshold,
+    summarizes the oldest ones into a single system message stored on the
+    ChatHistorial. Summaries run as background tasks, out of the request path.
+
+    Each summary request holds as many of the oldest messages as fit in the
+    window of the model, a longer conversation is summarized in chunks. A
+    conversation whose summary failed isn't tried again until a delay,
+    doubled on every failure, passes.
+    """
+
+    def __init__(
+        self,
+        client,
+        chat_historial_handler: ChatHistorialHandler,
+        conversation_locks: ConversationLockManager = None,
+        threshold: int = Summarization.THRESHOLD.value,
+        keep_recent: int = Summarization.KEEP_RECENT.value,
+        max_chunks: int = Summarization.MAX_CHUNKS.value,
+        retry_delay: float = Summarization.RETRY_DELAY.value,
+        max_retry_delay: float = Summarization.MAX_RETRY_DELAY.value,
+    ) -> None:
+        """
+        Args:
+            client (OpenAIApi): client used to request the summaries.
+            chat_historial_handler (ChatHistorialHandler): handler of the historial.
+            conversation_locks (ConversationLockManager, optional): locks taken
+                while the historial is compacted. Defaults to None.
+            threshold (int, optional): tokens that trigger a summary.
+                                       Defaults to Summarization.THRESHOLD.value.
+            keep_recent (int, optional): tokens of recent messages left as they are.
+                                         Defaults to Summarization.KEEP_RECENT.value.
+            max_chunks (int, optional): summary requests of a single summary.
+                Defaults to Summarization.MAX_CHUNKS.value.
+            retry_delay (float, optional): seconds before the first retry of
+                a failed summary. Defaults to Summarization.RETRY_DELAY.value.
+            max_retry_delay (float, optional): max seconds between retries.
+                Defaults to Summarization.MAX_RETRY_DELAY.value.
+        """
+        self.client = client
+        self.chat_historial_handler = chat_historial_handler
+        self.conversation_locks = conversation_locks
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self.max_chunks = max_chunks
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        """Failures in a row and monotonic time of the next try, by conversation"""
+        self._failures: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        self._running: Set[Tuple[str, str]] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _conversation_tokens(self, chat_historial: ChatHistorial) -> int:
+        return sum(
+            message_tokens(message, self.client.model)
+            for message in chat_historial.messages
+            if message.role != Roles.SYSTEM.value
+        )
+
+    def _transcript_budget(self, chat_historial: ChatHistorial) -> int:
+        """Tokens of messages a summary request has room for."""
+        budget = (
+            ContextWindows[Engines(self.client.model).name].value
+            - TokenCounts.COMPLETION_RESERVE.value
+            - TokenCounts.PER_REPLY.value
+            - 2 * TokenCounts.PER_MESSAGE.value
+            - count_tokens(Prompts.SUMMARIZE.value, self.client.model)
+        )
+        if chat_historial.summary is not None:
+            budget -= message_tokens(chat_historial.summary, self.client.model)
+        return budget
+
+    def _select_oldest(
+        self, chat_historial: ChatHistorial, budget: int
+    ) -> List[Message]:
+        """Oldest non system messages that leave keep_recent tokens untouched,
+        as many as fit in budget tokens and at least one."""
+        conversation = [
+            message
+            for message in chat_historial.messages
+            if message.role != Roles.SYSTEM.value
+        ]
+        recent_tokens = 0
+        split = len(conversation)
+        while split > 0:
+            tokens = message_tokens(conversation[split - 1], self.client.model)
+            if recent_tokens + tokens > self.keep_recent:
+                break
+            recent_tokens += tokens
+            split -= 1
+        oldest = []
+        for message in conversation[:split]:
+            budget -= message_tokens(message, self.client.model)
+            if budget < 0 and oldest:
+                break
+            oldest.append(message)
+        return oldest
+
+    def needs_summary(self, chat_historial: ChatHistorial) -> bool:
+        """Check if a ChatHistorial went over the threshold.
+
+        Args:
+            chat_historial (ChatHistorial): ChatHistorial to check.
+
+        Returns:
+            bool: True if it should be summarized, otherwise False.
+        """
+        return (
+            chat_historial is not None
+            and self._conversation_tokens(chat_historial) > self.threshold
+        )
+
+    def schedule(self, user_id: str, chat_id: str) -> asyncio.Task | None:
+        """Start a background summary of the conversation if there is not one
+        already running for it. The task ends right away if the conversation
+        doesn't need a summary.
+
+        Args:
+            user_id (str): user id.
+            chat_id (str): chat id.
+
+        Returns:
+            asyncio.Task | None: the summary task if one was started.
+        """
+        key = (user_id, chat_id)
+        if key in self._running:
+            return None
+        failures = self._failures.get(key)
+        if failures is not None and monotonic() < failures[1]:
+            return None
+        self._running.add(key)
+        task = asyncio.create_task(self.summarize(user_id, chat_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda _: self._running.discard(key))
+        return task
+
+    async def close(self) -> None:
+        """Cancel the running summaries. A compaction already handed to the
+        executor still completes, the rest is summarized again later."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _compact(
+        self, user_id: str, chat_id: str, summary: Message, summarized_messages: int
+    ) -> bool:
+        """Compact the historial, waiting for the running turn if any."""
+        if self.conversation_locks is None:
+            return await self.chat_historial_handler.acompact(
+                user_id, chat_id, summary, summarized_messages
+            )
+        async with self.conversation_locks.acquire(user_id, chat_id):
+            return await self.chat_historial_handler.acompact(
+                user_id, chat_id, summary, summarized_messages
+            )
+
+    def _back_off(self, key: Tuple[str, str]) -> None:
+        """Delay the next summary of a conversation after a failure."""
+        failures = self._failures.get(key, (0, 0.0))[0] + 1
+        delay = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+        self._failures[key] = (failures, monotonic() + delay)
+        logger.warning(f"Summary of chat {key[1]} retried in {delay:.0f}s")
+
+    def _transcript(self, oldest: List[Message], budget: int) -> Tuple[str, int]:
+        """Lines of the oldest messages that fit in budget tokens, counted as
+        _select_oldest does, and the amount of messages they hold. A first
+        message over the budget is cut to fit, it could never be sent whole."""
+        lines = []
+        for message in oldest:
+            tokens = message_tokens(message, self.client.model)
+            content = message.content
+            if tokens > budget:
+                if lines:
+                    break
+                content = truncate_tokens(
+                    content,
+                    budget - tokens + count_tokens(content, self.client.model),
+                    self.client.model,
+                )
+            budget -= tokens
+            lines.append(f"{message.name or message.role}: {content}")
+        return "\n".join(lines), len(lines)
+
+    async def _asummary(
+        self, chat_historial: ChatHistorial, oldest: List[Message], budget: int
+    ) -> Tuple[Message, int]:
+        """Summary of the oldest messages and of the previous summary, if any,
+        and the amount of messages it covers."""
+        transcript, summarized_messages = self._transcript(oldest, budget)
+        if chat_historial.summary is not None:
+            transcript = f"{chat_historial.summary.content}\n{transcript}"
+        response = await self.client.acomplete(
+            [
+                {"role": Roles.SYSTEM.value, "content": Prompts.SUMMARIZE.value},
+                {"role": Roles.USER.value, "content": transcript},
+            ]
+        )
+        chat_response = ChatCompletionResponse.parse_obj(response.to_dict_recursive())
+        summary = Message(
+            role=Roles.SYSTEM.value,
+            content=f"{Prompts.SUMMARY_PREFIX.value}"
+            f"{chat_response.choices[0].message.content}",
+        )
+        message_tokens(summary, self.client.model)
+        return summary, summarized_messages
+
+    async def summarize(self, user_id: str, chat_id: str) -> bool:
+        """Summarize the oldest turns of a conversation and compact it, in up
+        to max_chunks summary requests.
+
+        Args:
+            user_id (str): user id.
+            chat_id (str): chat id.
+
+        Returns:
+            bool: True if the ChatHistorial was compacted, otherwise False.
+        """
+        key = (user_id, chat_id)
+        is_compacted = False
+        try:
+            for _ in range(self.max_chunks):
+                chat_historial = await self.chat_historial_handler.aload(
+                    user_id, chat_id
+                )
+                if not self.needs_summary(chat_historial):
+                    break
+                budget = self._transcript_budget(chat_historial)
+                oldest = self._select_oldest(chat_historial, budget)
+                if not oldest:
+                    break
+                summary, summarized_messages = await self._asummary(
+                    chat_historial, oldest, budget
+                )
+                if not await self._compact(
+                    user_id, chat_id, summary, summarized_messages
+                ):
+                    self._back_off(key)
+                    return is_compacted
+                is_compacted = True
+                logger.info(
+                    f"Summarized {summarized_messages} messages of chat {chat_id}"
+                )
+            self._failures.pop(key, None)
+        except Exception as e:  # pylint: disable=broad-except
+            """A failed summary must not break the conversation, retried later"""
+            logger.error(e)
+            self._back_off(key)
+        return is_compacted
@@ -0,0 +1,104 @@
+"""
+Token counting for ChatCompletion messages
+"""
+from math import ceil
+from typing import Any, Dict, List
+
+from chat_bot.models.message import Message
+from chat_bot.utils.enums import Engines, TokenCounts, TokenEstimates
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+
+_encodings = {}
+
+
+def _encoding(model: str):
+    encoding = _encodings.get(model)
+    if encoding is None:
+        encoding = _encodings[model] = tiktoken.encoding_for_model(model)
+    return encoding
+
+
+def count_tokens(text: str, model: str = Engines.GPT_3_5_TURBO.value) -> int:
+    """Count the tokens of a text. Uses tiktoken when it is installed,
+    otherwise an estimation based on the text length.
+
+    Args:
+        text (str): text to count.
+        model (str, optional): model whose tokenizer is used.
+                               Defaults to Engines.GPT_3_5_TURBO.value.
+
+    Returns:
+        int: amount of tokens.
+    """
+    if tiktoken is None:
+        return ceil(len(text) / TokenEstimates.CHARS_PER_TOKEN.value)
+    return len(_encoding(model).encode(text))
+
+
+def truncate_tokens(
+    text: str, tokens: int, model: str = Engines.GPT_3_5_TURBO.value
+) -> str:
+    """Cut a text to its first tokens, counted as count_tokens does.
+
+    Args:
+        text (str): text to cut.
+        tokens (int): max tokens of the cut text.
+        model (str, optional): model whose tokenizer is used.
+                               Defaults to Engines.GPT_3_5_TURBO.value.
+
+    Returns:
+        str: the text, cut if it has more tokens.
+    """
+    if tokens <= 0:
+        return ""
+    if tiktoken is None:
+        return text[: tokens * TokenEstimates.CHARS_PER_TOKEN.value]
+    encoding = _encoding(model)
+    return encoding.decode(encoding.encode(text)[:tokens])
+
+
+def message_tokens(message: Message, model: str = Engines.GPT_3_5_TURBO.value) -> int:
+    """Tokens used by a message on a ChatCompletion request. The count is
+    stored on the message so it is computed only once.
+
+    Args:
+        message (Message): message to count.
+        model (str, optional): model whose tokenizer is used.
+                               Defaults to Engines.GPT_3_5_TURBO.value.
+
+    Returns:
+        int: amount of tokens, including the per message overhead.
+    """
+    if message.tokens is None:
+        message.tokens = TokenCounts.PER_MESSAGE.value + count_tokens(
+            message.content, model
+        )
+        if message.name:
+            message.tokens += count_tokens(message.name, model)
+    return message.tokens
+
+
+def payload_tokens(
+    messages: List[Dict[str, Any]], model: str = Engines.GPT_3_5_TURBO.value
+) -> int:
+    """Tokens used by a messages payload already converted to dicts.
+
+    Args:
+        messages (List[Dict[str, Any]]): messages payload.
+        model (str, optional): model whose tokenizer is used.
+                               Defaults to Engines.GPT_3_5_TURBO.value.
+
+    Returns:
+        int: amount of tokens, including the reply priming.
+    """
+    return TokenCounts.PER_REPLY.value + sum(
+        TokenCounts.PER_MESSAGE.value
+        + count_tokens(message["content"], model)
+        + (count_tokens(message["name"], model) if message.get("name") else 0)
+        for message in messages
+    )
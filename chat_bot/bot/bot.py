@@ -1,26 +1,386 @@
 """Main bot module"""
+import asyncio
+from datetime import datetime, timedelta
 from discord import Intents, RawReactionActionEvent
 from discord.ext import commands
 from discord.ext.commands.context import Context
+from openai.error import OpenAIError
 from chat_bot.models.message import Message
 
+from chat_bot.models.routing import RoutingPolicy
 from chat_bot.models.user import User
-from chat_bot.historial.handler import ChatHistorialHandler
+from chat_bot.historial.handler import ChatHistorialHandler, historial_size
 from chat_bot.user.handler import UserHandler
-from chat_bot.api.chat_gpt import OpenAIApi
-from chat_bot.utils.enums import Roles
-from chat_bot.utils.configs import OPENAI_SETTINGS
-
-
-"""Logger must be imported despite is an unused import"""
-from chat_bot.bot.utils.logger import logger  # pylint: disable=C0413,W0611
-from chat_bot.bot.constants.enums import DefaultMessages, Prefix
+from chat_bot.usage.handler import UsageHandler, usage_day
+from chat_bot.search.handler import SearchHandler
+from chat_bot.retrieval.embeddings import create_embedder
+from chat_bot.retrieval.handler import RetrievalHandler, memory_size
+from chat_bot.api.registry import OpenAIClientRegistry
+from chat_bot.api.router import DeadlineExceededError, ModelRouter
+from chat_bot.api.response_cache import ResponseCache
+from chat_bot.api.scheduler import RequestScheduler
+from chat_bot.api.tokens import message_tokens
+from chat_bot.utils.enums import Roles, UsageScopes
+from chat_bot.utils.cache import LRUCache
+from chat_bot.utils.locks import ConversationLockManager
+from chat_bot.utils.executor import BlockingIOExecutor, LoopLagMonitor
+from chat_bot.utils.metrics import MetricsServer, metrics_registry, tracer
+from chat_bot.storage.base import StorageBackend
+from chat_bot.storage.factory import create_storage
+from chat_bot.storage.index import ExistenceIndex
+from chat_bot.utils.handlers.file_handler import (
+    GroupCommitWriter,
+    JsonHandler,
+    JsonLinesHandler,
+)
+from chat_bot.utils.configs import (
+    METRICS_SETTINGS,
+    OPENAI_SETTINGS,
+    STORAGE_SETTINGS,
+)
+from chat_bot.bot.utils.configs import DISCORD_SETTINGS
+from chat_bot.bot.utils.streaming import edit_with_stream, split_content
+from chat_bot.utils.logger import logger
+from chat_bot.bot.constants.enums import (
+    DefaultMessages,
+    Prefix,
+    SearchReport,
+    UsageReport,
+)
 
 """This can be narrowed when all the features will be defined"""
 intents = Intents.default()
 intents.message_content = True
 
-bot = commands.Bot(command_prefix=Prefix.QUESTION_MARK.value, intents=intents)
+
+class ChatBot(commands.Bot):
+    """Bot holding the long-lived resources shared by every command"""
+
+    def __init__(
+        self,
+        openai_registry: OpenAIClientRegistry,
+        model_router: ModelRouter,
+        chat_handler: ChatHistorialHandler,
+        user_handler: UserHandler,
+        conversation_locks: ConversationLockManager,
+        storage: StorageBackend = None,
+        group_commit_writer: GroupCommitWriter = None,
+        io_executor: BlockingIOExecutor = None,
+        loop_lag_monitor: LoopLagMonitor = None,
+        usage_handler: UsageHandler = None,
+        metrics_server: MetricsServer = None,
+        existence_index: ExistenceIndex = None,
+        search_handler: SearchHandler = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.search_handler = search_handler
+        self.existence_index = existence_index
+        self._index_build: asyncio.Task = None
+        self.metrics_server = metrics_server
+        self.usage_handler = usage_handler
+        self.storage = storage
+        self.io_executor = io_executor
+        self.loop_lag_monitor = loop_lag_monitor
+        self.openai_registry = openai_registry
+        self.model_router = model_router
+        self.chat_handler = chat_handler
+        self.user_handler = user_handler
+        self.conversation_locks = conversation_locks
+        self.group_commit_writer = group_commit_writer
+
+    async def setup_hook(self) -> None:
+        if self.loop_lag_monitor is not None:
+            self.loop_lag_monitor.start()
+        if self.group_commit_writer is not None:
+            self.group_commit_writer.start()
+        if self.usage_handler is not None:
+            self.usage_handler.start()
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+        if self.existence_index is not None and self.storage is not None:
+            """Built in background, exists checks go to storage meanwhile"""
+            run = (
+                asyncio.to_thread if self.io_executor is None else self.io_executor.run
+            )
+            self._index_build = asyncio.create_task(
+                run(self.existence_index.build, self.storage)
+            )
+        await self.openai_registry.start()
+
+    async def close(self) -> None:
+        """Disconnect first so no new turn starts, then stop the background
+        work, let the executor finish its writes, flush the writers and close
+        the storage last."""
+        await super().close()
+        await self.openai_registry.close()
+        if self._index_build is not None:
+            await asyncio.gather(self._index_build, return_exceptions=True)
+        if self.io_executor is not None:
+            self.io_executor.shutdown()
+        if self.group_commit_writer is not None:
+            self.group_commit_writer.stop()
+        if self.usage_handler is not None:
+            self.usage_handler.stop()
+        if self.storage is not None:
+            self.storage.close()
+        if self.search_handler is not None:
+            self.search_handler.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        if self.loop_lag_monitor is not None:
+            await self.loop_lag_monitor.stop()
+
+
+tracer.sample_rate = METRICS_SETTINGS.METRICS_TRACE_SAMPLE_RATE
+turns_total = metrics_registry.counter(
+    "chat_bot_turns_total", "Chat turns sent to the API, by outcome"
+)
+
+
+class ShardedChatBot(ChatBot, commands.AutoShardedBot):
+    """ChatBot connected to the shards given by the launcher"""
+
+
+"""Handlers are shared so their caches serve every command"""
+conversation_locks = ConversationLockManager()
+io_executor = BlockingIOExecutor(max_workers=STORAGE_SETTINGS.STORAGE_IO_WORKERS)
+group_commit_writer = None
+if STORAGE_SETTINGS.STORAGE_GROUP_COMMIT_INTERVAL > 0:
+    group_commit_writer = GroupCommitWriter(
+        interval=STORAGE_SETTINGS.STORAGE_GROUP_COMMIT_INTERVAL,
+        sync_directory=STORAGE_SETTINGS.STORAGE_SYNC_DIRECTORY,
+    )
+json_handler = JsonHandler(
+    fsync=STORAGE_SETTINGS.STORAGE_FSYNC,
+    sync_directory=STORAGE_SETTINGS.STORAGE_SYNC_DIRECTORY,
+)
+json_lines_handler = JsonLinesHandler(
+    fsync=STORAGE_SETTINGS.STORAGE_FSYNC,
+    sync_directory=STORAGE_SETTINGS.STORAGE_SYNC_DIRECTORY,
+    writer=group_commit_writer,
+)
+storage = create_storage(
+    backend=STORAGE_SETTINGS.STORAGE_BACKEND,
+    file_handler=json_handler,
+    log_handler=json_lines_handler,
+    sqlite_path=STORAGE_SETTINGS.STORAGE_SQLITE_PATH,
+    trusted_loads=STORAGE_SETTINGS.STORAGE_TRUSTED_LOADS,
+    shard_levels=STORAGE_SETTINGS.STORAGE_SHARD_LEVELS,
+)
+"""Sharded workers share db/, the users created by the others are unknown"""
+existence_index = (
+    ExistenceIndex(
+        authoritative=DISCORD_SETTINGS.DISCORD_WORKERS == 1,
+        workers=STORAGE_SETTINGS.STORAGE_SCAN_WORKERS,
+    )
+    if STORAGE_SETTINGS.STORAGE_EXISTENCE_INDEX
+    else None
+)
+search_handler = (
+    SearchHandler(database=STORAGE_SETTINGS.STORAGE_SEARCH_PATH, executor=io_executor)
+    if STORAGE_SETTINGS.STORAGE_SEARCH_ENABLED
+    else None
+)
+retrieval_handler = (
+    RetrievalHandler(
+        embedder=create_embedder(
+            OPENAI_SETTINGS.OPENAI_RETRIEVAL_EMBEDDER,
+            dimension=OPENAI_SETTINGS.OPENAI_RETRIEVAL_DIMENSION,
+        ),
+        top_k=OPENAI_SETTINGS.OPENAI_RETRIEVAL_TOP_K,
+        recent_messages=OPENAI_SETTINGS.OPENAI_RETRIEVAL_RECENT_MESSAGES,
+        min_score=OPENAI_SETTINGS.OPENAI_RETRIEVAL_MIN_SCORE,
+        cache=LRUCache(
+            max_items=OPENAI_SETTINGS.OPENAI_RETRIEVAL_CACHE_MAX_ITEMS,
+            size_of=memory_size,
+        ),
+        executor=io_executor,
+        shard_levels=STORAGE_SETTINGS.STORAGE_SHARD_LEVELS,
+    )
+    if OPENAI_SETTINGS.OPENAI_RETRIEVAL_ENABLED
+    else None
+)
+shared_chat_handler = ChatHistorialHandler(
+    storage=storage,
+    cache=LRUCache(
+        max_items=STORAGE_SETTINGS.CHAT_CACHE_MAX_ITEMS,
+        max_size=STORAGE_SETTINGS.CHAT_CACHE_MAX_SIZE,
+        size_of=historial_size,
+    ),
+    executor=io_executor,
+    compact_cache=STORAGE_SETTINGS.CHAT_CACHE_COMPACT,
+    index=existence_index,
+    search=search_handler,
+    retrieval=retrieval_handler,
+)
+shared_user_handler = UserHandler(
+    storage=storage,
+    cache=LRUCache(max_items=STORAGE_SETTINGS.USER_CACHE_MAX_ITEMS),
+    executor=io_executor,
+    index=existence_index,
+)
+"""Sharded workers record usage and routing apart, each one owns the guilds
+of its shards"""
+worker_partition = (
+    f"worker-{DISCORD_SETTINGS.DISCORD_WORKER_INDEX}"
+    if DISCORD_SETTINGS.DISCORD_WORKERS > 1
+    else None
+)
+usage_handler = UsageHandler(
+    writer=GroupCommitWriter(
+        interval=STORAGE_SETTINGS.STORAGE_USAGE_FLUSH_INTERVAL, sync_directory=False
+    ),
+    executor=io_executor,
+    partition=worker_partition,
+)
+
+openai_registry = OpenAIClientRegistry(
+    token=OPENAI_SETTINGS.OPENAI_API_KEY,
+    chat_historial_handler=shared_chat_handler,
+    conversation_locks=conversation_locks,
+    max_concurrent_requests=OPENAI_SETTINGS.OPENAI_MAX_CONCURRENT_REQUESTS,
+    token_ttl=OPENAI_SETTINGS.OPENAI_TOKEN_VALIDATION_TTL,
+    summarization=OPENAI_SETTINGS.OPENAI_SUMMARIZATION_ENABLED,
+    summarization_threshold=OPENAI_SETTINGS.OPENAI_SUMMARIZATION_THRESHOLD,
+    summarization_keep_recent=OPENAI_SETTINGS.OPENAI_SUMMARIZATION_KEEP_RECENT,
+    response_cache=ResponseCache(
+        LRUCache(
+            max_items=OPENAI_SETTINGS.OPENAI_RESPONSE_CACHE_MAX_ITEMS,
+            ttl=OPENAI_SETTINGS.OPENAI_RESPONSE_CACHE_TTL,
+        )
+    ),
+    scheduler=RequestScheduler(
+        requests_per_minute=OPENAI_SETTINGS.OPENAI_REQUESTS_PER_MINUTE,
+        tokens_per_minute=OPENAI_SETTINGS.OPENAI_TOKENS_PER_MINUTE,
+        max_retries=OPENAI_SETTINGS.OPENAI_MAX_RETRIES,
+        backoff_base=OPENAI_SETTINGS.OPENAI_BACKOFF_BASE,
+        backoff_max=OPENAI_SETTINGS.OPENAI_BACKOFF_MAX,
+    ),
+    usage_handler=usage_handler,
+    retrieval=retrieval_handler,
+)
+model_router = ModelRouter(
+    openai_registry,
+    default_policy=RoutingPolicy(
+        models=OPENAI_SETTINGS.OPENAI_ROUTING_MODELS,
+        deadline=OPENAI_SETTINGS.OPENAI_ROUTING_DEADLINE,
+    ),
+    policies=OPENAI_SETTINGS.OPENAI_ROUTING_POLICIES,
+    writer=usage_handler.writer if OPENAI_SETTINGS.OPENAI_ROUTING_LOG_ENABLED else None,
+    partition=worker_partition,
+)
+
+"""Workers started by the launcher run a subset of the shards"""
+bot_class = ShardedChatBot if DISCORD_SETTINGS.DISCORD_SHARD_COUNT else ChatBot
+bot = bot_class(
+    openai_registry=openai_registry,
+    model_router=model_router,
+    chat_handler=shared_chat_handler,
+    user_handler=shared_user_handler,
+    conversation_locks=conversation_locks,
+    storage=storage,
+    group_commit_writer=group_commit_writer,
+    io_executor=io_executor,
+    usage_handler=usage_handler,
+    existence_index=existence_index,
+    search_handler=search_handler,
+    loop_lag_monitor=LoopLagMonitor(
+        interval=STORAGE_SETTINGS.STORAGE_LOOP_LAG_INTERVAL,
+        stall_threshold=STORAGE_SETTINGS.STORAGE_LOOP_STALL_THRESHOLD,
+    ),
+    metrics_server=MetricsServer(
+        registry=metrics_registry,
+        host=METRICS_SETTINGS.METRICS_HOST,
+        port=METRICS_SETTINGS.METRICS_PORT,
+    )
+    if METRICS_SETTINGS.METRICS_ENABLED
+    else None,
+    command_prefix=Prefix.QUESTION_MARK.value,
+    intents=intents,
+    **(
+        {
+            "shard_count": DISCORD_SETTINGS.DISCORD_SHARD_COUNT,
+            "shard_ids": DISCORD_SETTINGS.DISCORD_SHARD_IDS,
+        }
+        if DISCORD_SETTINGS.DISCORD_SHARD_COUNT
+        else {}
+    ),
+)
+
+"""Stats kept by the shared resources, read when the metrics are scraped"""
+for cache_name, cache in (
+    ("chat", shared_chat_handler.cache),
+    ("user", shared_user_handler.cache),
+    ("response", bot.openai_registry.response_cache.cache),
+):
+    for stat in ("hits", "misses", "evictions"):
+        metrics_registry.counter(
+            f"chat_bot_{cache_name}_cache_{stat}_total",
+            f"{stat.capitalize()} of the {cache_name} cache",
+            collect=lambda cache=cache, stat=stat: getattr(cache.stats(), stat),
+        )
+    metrics_registry.gauge(
+        f"chat_bot_{cache_name}_cache_items",
+        f"Items held by the {cache_name} cache",
+        collect=cache.__len__,
+    )
+metrics_registry.gauge(
+    "chat_bot_scheduler_queued",
+    "API calls waiting for rate limit budget",
+    collect=bot.openai_registry.scheduler.queue_length,
+)
+metrics_registry.counter(
+    "chat_bot_scheduler_retries_total",
+    "API calls retried",
+    collect=lambda: bot.openai_registry.scheduler.stats().retries,
+)
+metrics_registry.counter(
+    "chat_bot_scheduler_failures_total",
+    "API calls failed once the retries were exhausted",
+    collect=lambda: bot.openai_registry.scheduler.stats().failures,
+)
+if existence_index is not None:
+    metrics_registry.gauge(
+        "chat_bot_index_users",
+        "Users known by the existence index",
+        existence_index.users,
+    )
+    metrics_registry.gauge(
+        "chat_bot_index_chats",
+        "Chats known by the existence index",
+        existence_index.chats,
+    )
+metrics_registry.gauge(
+    "chat_bot_conversation_lock_waiting",
+    "Turns waiting for the previous turn of their conversation",
+    collect=lambda: conversation_locks.stats().waiting,
+)
+metrics_registry.gauge(
+    "chat_bot_conversation_lock_max_queue_depth",
+    "Max turns seen waiting behind the running turn of a conversation",
+    collect=lambda: conversation_locks.stats().max_queue_depth,
+)
+metrics_registry.gauge(
+    "chat_bot_conversation_locks_active",
+    "Conversations with a turn running or waiting",
+    collect=lambda: conversation_locks.stats().active_conversations,
+)
+metrics_registry.counter(
+    "chat_bot_conversation_lock_contended_total",
+    "Turns that found the previous turn of their conversation running",
+    collect=lambda: conversation_locks.stats().contended,
+)
+metrics_registry.gauge(
+    "chat_bot_io_executor_running",
+    "Blocking calls running on the I/O executor",
+    collect=lambda: io_executor.stats().running,
+)
+metrics_registry.gauge(
+    "chat_bot_event_loop_max_lag_seconds",
+    "Max event loop lag observed",
+    collect=lambda: bot.loop_lag_monitor.stats().max_lag,
+)
 
 
 @bot.command()
@@ -34,55 +394,121 @@ async def chat(ctx: Context):
     message_content: str = ctx.message.content.split("$profile")[-1][1:]
     channel_id: str = str(ctx.channel.id)
 
-    """Check if the current user exists, otherwise creates one o db"""
-    user_handler = UserHandler()
-    if not user_handler.exists(str(author_id)):
-        new_user = User(
-            id=author_id,
-            display_name=display_name,
-            name=name,
-            discriminator=discriminator,
-        )
-        user_handler.create(user=new_user)
+    with tracer.trace("chat"):
+        """Turns of the same conversation are run one at a time"""
+        async with ctx.bot.conversation_locks.acquire(author_id, channel_id):
+            """Check if the current user exists, otherwise creates one o db"""
+            user_handler: UserHandler = ctx.bot.user_handler
+            with tracer.span("user_lookup"):
+                if not await user_handler.aexists(str(author_id)):
+                    new_user = User(
+                        id=author_id,
+                        display_name=display_name,
+                        name=name,
+                        discriminator=discriminator,
+                    )
+                    await user_handler.acreate(user=new_user)
 
-    """Check if an historial on this channel exists, otherwise creates one o db"""
-    chat_handler = ChatHistorialHandler()
-    if not chat_handler.exists(user_id=str(author_id), chat_id=str(channel_id)):
-        chat_handler.create(
-            user_id=str(author_id), channel_id=str(channel_id), message_id=message_id
-        )
+            """Check if an historial on this channel exists, otherwise creates one o db"""
+            chat_handler: ChatHistorialHandler = ctx.bot.chat_handler
+            with tracer.span("historial_load"):
+                chat_exists = await chat_handler.aexists(
+                    user_id=str(author_id), chat_id=str(channel_id)
+                )
+            if not chat_exists:
+                await chat_handler.acreate(
+                    user_id=str(author_id),
+                    channel_id=str(channel_id),
+                    message_id=message_id,
+                )
 
-        """Sent message to start system profiling step"""
-        await ctx.send(DefaultMessages.NO_PROFILING_SET.value.format(author_name=name))
+                """Sent message to start system profiling step"""
+                await ctx.send(
+                    DefaultMessages.NO_PROFILING_SET.value.format(author_name=name)
+                )
 
-    else:
-        """Check if ChatHistorial is empty and if reaction is positive to add system profiling"""
-        chat_historial = chat_handler.load(
-            user_id=str(author_id), chat_id=str(channel_id)
-        )
-        if (
-            not chat_historial.reacted_to_profiling_step
-            and len(chat_historial.messages) == 0
-        ):
-            await ctx.send(DefaultMessages.REACT_TO_MESSAGE_OTHERWISE_BLOCK.value)
-
-        elif chat_historial.reacted_to_profiling_step:
-            thinking_emoji = ":thinking:"
-            response_message = await ctx.message.channel.send(thinking_emoji)
-
-            """Make API Call"""
-            user = UserHandler().load(user_id=author_id)
-            openai_client = OpenAIApi(token=OPENAI_SETTINGS.OPENAI_API_KEY, user=user)
-            api_response = openai_client.send_chat_completion(
-                chat_id=channel_id, content=message_content, role=Roles.USER.value
-            )
+            else:
+                """Check if ChatHistorial is empty and if reaction is positive to add system profiling"""
+                with tracer.span("historial_load"):
+                    chat_historial = await chat_handler.aload(
+                        user_id=str(author_id), chat_id=str(channel_id)
+                    )
+                if (
+                    not chat_historial.reacted_to_profiling_step
+                    and len(chat_historial.messages) == 0
+                ):
+                    await ctx.send(
+                        DefaultMessages.REACT_TO_MESSAGE_OTHERWISE_BLOCK.value
+                    )
 
-            """On Response Delete emoji and replace with API Response"""
-            message_content = response_message.content
-            message_with_api_response = message_content.replace(
-                thinking_emoji, api_response.choices[0].message.content
-            )
-            await response_message.edit(content=message_with_api_response)
+                elif chat_historial.reacted_to_profiling_step:
+                    thinking_emoji = ":thinking:"
+                    response_message = await ctx.message.channel.send(thinking_emoji)
+
+                    """Make API Call"""
+                    with tracer.span("user_lookup"):
+                        user = await user_handler.aload(user_id=author_id)
+                    """The router picks the model and keeps the turn under the deadline"""
+                    router: ModelRouter = ctx.bot.model_router
+                    """Opted-in channels get deterministic, cacheable responses"""
+                    cache = (
+                        channel_id in DISCORD_SETTINGS.DISCORD_RESPONSE_CACHE_CHANNELS
+                    )
+                    temperature = 0 if cache else None
+                    guild_id = str(ctx.guild.id) if ctx.guild else None
+                    try:
+                        if DISCORD_SETTINGS.DISCORD_STREAM_RESPONSES:
+                            """Stream the response editing the placeholder as deltas arrive"""
+                            await edit_with_stream(
+                                response_message,
+                                router.astream_chat_completion(
+                                    user=user,
+                                    chat_id=channel_id,
+                                    content=message_content,
+                                    role=Roles.USER.value,
+                                    cache=cache,
+                                    temperature=temperature,
+                                    guild_id=guild_id,
+                                ),
+                                interval=DISCORD_SETTINGS.DISCORD_EDIT_INTERVAL,
+                            )
+                        else:
+                            api_response = await router.asend_chat_completion(
+                                user=user,
+                                chat_id=channel_id,
+                                content=message_content,
+                                role=Roles.USER.value,
+                                cache=cache,
+                                temperature=temperature,
+                                guild_id=guild_id,
+                            )
+
+                            """On Response Delete emoji and replace with API Response"""
+                            message_content = response_message.content
+                            api_content = api_response.choices[0].message.content
+                            if not api_content.strip():
+                                """Discord rejects blank messages"""
+                                api_content = DefaultMessages.EMPTY_RESPONSE.value
+                            message_with_api_response = message_content.replace(
+                                thinking_emoji, api_content
+                            )
+                            with tracer.span("discord_edit"):
+                                await response_message.edit(
+                                    content=message_with_api_response
+                                )
+                        turns_total.inc(outcome="answered")
+                    except DeadlineExceededError:
+                        """No model answered in time, reply with a canned message"""
+                        turns_total.inc(outcome="deadline_exceeded")
+                        await response_message.edit(
+                            content=DefaultMessages.DEADLINE_EXCEEDED.value
+                        )
+                    except OpenAIError:
+                        """Retries are exhausted, don't leave the placeholder hanging"""
+                        turns_total.inc(outcome="api_unavailable")
+                        await response_message.edit(
+                            content=DefaultMessages.API_UNAVAILABLE.value
+                        )
 
 
 @bot.event
@@ -91,39 +517,42 @@ async def on_raw_reaction_add(payload: RawReactionActionEvent):
     channel_id = str(payload.channel_id)
     user_id = str(payload.user_id)
     emoji = payload.emoji
-    chat_handler = ChatHistorialHandler()
+    chat_handler = bot.chat_handler
     channel = bot.get_channel(payload.channel_id)
-    if chat_handler.exists(user_id=user_id, chat_id=channel_id):
-        chat_historial = chat_handler.load(user_id=user_id, chat_id=channel_id)
-
-        """If reaction is positive, set flag to True and send instruction to send profile
-        Otherwise set flag and send feedback message to redirect to use $chat message"""
-        if (
-            emoji.name == "✅"
-            and not chat_historial.is_reaction_positive
-            and not chat_historial.reacted_to_profiling_step
-        ):
-            if chat_handler.update(
-                user_id=user_id,
-                chat_id=channel_id,
-                is_reaction_positive=True,
-                reacted_to_profiling_step=True,
-            ):
-                await channel.send(
-                    "Perfecto envia un mensaje con el comando $profile e indica el perfil que quieres que tenga"
-                )
-                await channel.send("por ejemplo puedo ser un ...")
-            else:
-                await channel.send("Oops Error!, Contacta a los admins del server")
-        elif emoji.name == "❌" and not chat_historial.reacted_to_profiling_step:
-            if chat_handler.update(
-                user_id=user_id, chat_id=channel_id, reacted_to_profiling_step=True
+    async with bot.conversation_locks.acquire(user_id, channel_id):
+        if await chat_handler.aexists(user_id=user_id, chat_id=channel_id):
+            chat_historial = await chat_handler.aload(
+                user_id=user_id, chat_id=channel_id
+            )
+
+            """If reaction is positive, set flag to True and send instruction to send profile
+            Otherwise set flag and send feedback message to redirect to use $chat message"""
+            if (
+                emoji.name == "✅"
+                and not chat_historial.is_reaction_positive
+                and not chat_historial.reacted_to_profiling_step
             ):
-                await channel.send(
-                    "Perfecto no se seteara un perfil. De ahora en adelante podemos seguir conversando usando el comando $chat"
-                )
-            else:
-                await channel.send("Oops Error!, Contacta a los admins del server")
+                if await chat_handler.aupdate(
+                    user_id=user_id,
+                    chat_id=channel_id,
+                    is_reaction_positive=True,
+                    reacted_to_profiling_step=True,
+                ):
+                    await channel.send(
+                        "Perfecto envia un mensaje con el comando $profile e indica el perfil que quieres que tenga"
+                    )
+                    await channel.send("por ejemplo puedo ser un ...")
+                else:
+                    await channel.send("Oops Error!, Contacta a los admins del server")
+            elif emoji.name == "❌" and not chat_historial.reacted_to_profiling_step:
+                if await chat_handler.aupdate(
+                    user_id=user_id, chat_id=channel_id, reacted_to_profiling_step=True
+                ):
+                    await channel.send(
+                        "Perfecto no se seteara un perfil. De ahora en adelante podemos seguir conversando usando el comando $chat"
+                    )
+                else:
+                    await channel.send("Oops Error!, Contacta a los admins del server")
 
 
 @bot.command()
@@ -134,24 +563,112 @@ async def profile(ctx: Context):
     message_content: str = ctx.message.content.split("$profile")[-1][1:]
     channel_id: str = str(ctx.channel.id)
 
-    chat_handler = ChatHistorialHandler()
-    if chat_handler.exists(user_id=str(author_id), chat_id=str(channel_id)):
-        chat_historial = chat_handler.load(user_id=author_id, chat_id=channel_id)
-        if (
-            chat_historial.is_reaction_positive
-            and chat_historial.reacted_to_profiling_step
-        ):
-            system_role_msg = Message(role=Roles.SYSTEM.value, content=message_content)
-            chat_handler.update(
-                user_id=author_id,
-                chat_id=channel_id,
-                new_prompt=system_role_msg,
-                system_profile_set=True,
+    async with ctx.bot.conversation_locks.acquire(author_id, channel_id):
+        chat_handler: ChatHistorialHandler = ctx.bot.chat_handler
+        if await chat_handler.aexists(user_id=str(author_id), chat_id=str(channel_id)):
+            chat_historial = await chat_handler.aload(
+                user_id=author_id, chat_id=channel_id
             )
-            await ctx.send(f"Ok {name} de ahora actuare como un:  {message_content}")
-            await ctx.send(
-                "Ya puedes seguir conversando conmigo a traves del comando $chat"
+            if (
+                chat_historial.is_reaction_positive
+                and chat_historial.reacted_to_profiling_step
+            ):
+                system_role_msg = Message(
+                    role=Roles.SYSTEM.value, content=message_content
+                )
+                message_tokens(system_role_msg)
+                await chat_handler.aupdate(
+                    user_id=author_id,
+                    chat_id=channel_id,
+                    new_prompt=system_role_msg,
+                    system_profile_set=True,
+                )
+                await ctx.send(
+                    f"Ok {name} de ahora actuare como un:  {message_content}"
+                )
+                await ctx.send(
+                    "Ya puedes seguir conversando conmigo a traves del comando $chat"
+                )
+
+        else:
+            await ctx.send("Oops Error!, Contacta a los admins del server")
+
+
+@bot.command()
+async def usage(ctx: Context, scope: str = UsageScopes.USER.value):
+    """Command to show the token usage of the author, the channel or the guild"""
+    scope_ids = {
+        UsageScopes.USER.value: str(ctx.author.id),
+        UsageScopes.CHANNEL.value: str(ctx.channel.id),
+    }
+    if ctx.guild:
+        scope_ids[UsageScopes.GUILD.value] = str(ctx.guild.id)
+    if scope not in scope_ids:
+        await ctx.send(
+            DefaultMessages.USAGE_INVALID_SCOPE.value.format(
+                scopes=", ".join(scope_ids)
             )
+        )
+        return
+
+    usage_handler: UsageHandler = ctx.bot.usage_handler
+    today = usage_day(ctx.message.created_at.timestamp())
+    days = UsageReport.DAYS.value
+    today_usage = await usage_handler.aquery(
+        UsageScopes(scope), scope_ids[scope], today
+    )
+    period_usage = await usage_handler.aquery(
+        UsageScopes(scope),
+        scope_ids[scope],
+        today - timedelta(days=days - 1),
+        today,
+    )
+    await ctx.send(
+        DefaultMessages.USAGE_REPORT.value.format(
+            scope=scope, today=today_usage, period=period_usage, days=days
+        )
+    )
+
 
-    else:
-        await ctx.send("Oops Error!, Contacta a los admins del server")
+@bot.command()
+async def search(ctx: Context, *, query: str = ""):
+    """Command to search the past messages between the author and the bot"""
+    search_handler: SearchHandler = ctx.bot.search_handler
+    if search_handler is None:
+        await ctx.send(DefaultMessages.SEARCH_DISABLED.value)
+        return
+    if not query.strip():
+        await ctx.send(DefaultMessages.SEARCH_USAGE.value)
+        return
+
+    """Only the messages of the author are searched. Every channel only on a
+    direct message, elsewhere others would read the private conversations"""
+    chat_id = None if ctx.guild is None else str(ctx.channel.id)
+    results = await search_handler.asearch(str(ctx.author.id), query, chat_id=chat_id)
+    scope = [] if chat_id is None else [DefaultMessages.SEARCH_CHANNEL_ONLY.value]
+    if not results:
+        await ctx.send(
+            "\n".join(
+                [DefaultMessages.SEARCH_NO_RESULTS.value.format(query=query), *scope]
+            )
+        )
+        return
+    lines = [DefaultMessages.SEARCH_RESULTS.value.format(query=query)]
+    for position, result in enumerate(results, start=1):
+        lines.append(
+            DefaultMessages.SEARCH_RESULT.value.format(
+                position=position,
+                chat_id=result.chat_id,
+                author=DefaultMessages.SEARCH_AUTHOR_USER.value
+                if result.role == Roles.USER.value
+                else DefaultMessages.SEARCH_AUTHOR_ASSISTANT.value,
+                when=datetime.fromtimestamp(result.timestamp).strftime(
+                    SearchReport.DATE_FORMAT.value
+                )
+                if result.timestamp is not None
+                else DefaultMessages.SEARCH_UNKNOWN_DATE.value,
+                snippet=result.snippet.replace("\n", " "),
+            )
+        )
+    for chunk in split_content("\n".join([*lines, *scope])):
+        await ctx.send(chunk)
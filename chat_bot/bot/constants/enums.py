@@ -1,13 +1,78 @@
 """Enums for Discord Bot"""
-from enum import Enum
+from enum import Enum, unique
 
 
 class DefaultMessages(Enum):
     "Default Message for Discord Bot"
     NO_PROFILING_SET = "Hola {author_name} !, creo que es primera vez que hablamos por este chat!, Quieres que tome algun perfil en especifico?, reacciona con  ✅  para darme un perfil, sino, reacciona  ❌  para continuar conversando ..."
     REACT_TO_MESSAGE_OTHERWISE_BLOCK = "Por favor reacciona a este mensaje con  ✅  o con  ❌ para poder continuar con nuestra conversacion."
+    USAGE_REPORT = "Uso de {scope} hoy: {today.total_tokens} tokens en {today.turns} turnos (latencia media {today.mean_latency:.2f}s). Ultimos {days} dias: {period.total_tokens} tokens en {period.turns} turnos."
+    USAGE_INVALID_SCOPE = "Puedes consultar el uso de: {scopes}"
+    API_UNAVAILABLE = "Lo siento, no pude obtener una respuesta en este momento. Intenta de nuevo en unos minutos."
+    DEADLINE_EXCEEDED = "Lo siento, estoy tardando demasiado en responder. Intenta de nuevo en un momento."
+    EMPTY_RESPONSE = "No tengo una respuesta para eso, intenta decirlo de otra forma."
+    SEARCH_USAGE = "Indica que buscar, por ejemplo: ?search receta de pan"
+    SEARCH_NO_RESULTS = "No encontre mensajes nuestros sobre: {query}"
+    SEARCH_DISABLED = "La busqueda no esta habilitada en este servidor."
+    SEARCH_RESULTS = "Esto encontre sobre {query}:"
+    SEARCH_RESULT = "{position}. <#{chat_id}> {author}, {when}: {snippet}"
+    SEARCH_AUTHOR_USER = "tu"
+    SEARCH_AUTHOR_ASSISTANT = "yo"
+    SEARCH_UNKNOWN_DATE = "fecha desconocida"
+    SEARCH_CHANNEL_ONLY = (
+        "Busque solo en este canal, escribeme por mensaje directo para buscar "
+        "en todas nuestras conversaciones."
+    )
 
 
 class Prefix(Enum):
     "Prefixes for bot"
     QUESTION_MARK = "?"
+
+
+class DiscordLimits(Enum):
+    "Discord API limits"
+    MESSAGE_LENGTH = 2000
+    """Seconds between edits of the same message, Discord allows 5 edits per 5s"""
+    EDIT_INTERVAL = 1.0
+
+
+class UsageReport(Enum):
+    "Usage command settings"
+    DAYS = 30
+
+
+class SearchReport(Enum):
+    "Search command settings"
+    DATE_FORMAT = "%d/%m/%Y"
+
+
+@unique
+class Sharding(Enum):
+    "Sharded deployment settings"
+    WORKERS = 1
+    """Exit code of a worker that can't start as configured, EX_CONFIG"""
+    EXIT_CONFIGURATION = 78
+    """Inserted before the extension of the log files of a worker"""
+    WORKER_LOG_SUFFIX = ".worker-{worker}"
+
+
+@unique
+class Supervision(Enum):
+    "Restart policy of the launcher for dead workers"
+    """Seconds before restarting a dead worker, doubled on every restart"""
+    RESTART_DELAY = 1.0
+    MAX_RESTART_DELAY = 60.0
+    """Seconds between checks of the workers"""
+    INTERVAL = 0.5
+    """Failed restarts in a row before a worker is given up"""
+    MAX_RESTARTS = 10
+
+
+class DiscordLogging(Enum):
+    "Defaults of the discord.py logging set by configure_discord_logging"
+    LEVEL = "DEBUG"
+    FILE = "discord.log"
+    MAX_BYTES = 32 * 1024 * 1024  # 32 MiB
+    BACKUP_COUNT = 5  # Rotate through 5 files
+    DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
@@ -0,0 +1,339 @@
+"""
+Sharded multi-process launcher.
+
+Runs the bot on several worker processes, each one connected to its own
+subset of the Discord shards. Discord sends every event of a guild to the
+same shard, and direct messages to shard 0, so a conversation (a user on a
+channel) is always served by the same worker: the ChatHistorialHandler cache
+of each worker only holds the conversations it owns and stays coherent
+without any coordination between processes.
+
+    python -m chat_bot.bot.launcher --workers 4 --shards 16
+
+Each worker exports its metrics on METRICS_PORT plus its index, logs to its
+own LOG_FILE and DISCORD_LOG_FILE, named with its index, and records usage
+on its own partition, so the usage reports of a worker cover the guilds of
+its shards.
+
+A worker that exits cleanly, or can't start because of its configuration or
+its Discord login, is not restarted. Neither is one that failed
+Supervision.MAX_RESTARTS times in a row. The launcher exits once no worker is
+left running.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Dict, List
+
+from discord import Client
+
+from chat_bot.bot.constants.enums import DiscordLogging, Sharding, Supervision
+from chat_bot.utils.configs import LOGGING_SETTINGS
+from chat_bot.utils.enums import Observability
+from chat_bot.utils.logger import configure_logging, logger
+
+
+def shard_for_guild(guild_id: int | None, shard_count: int) -> int:
+    """Shard receiving the events of a guild, as computed by Discord.
+
+    Args:
+        guild_id (int | None): guild id, None for direct messages.
+        shard_count (int): total amount of shards.
+
+    Returns:
+        int: shard id.
+    """
+    if guild_id is None:
+        return 0
+    return (int(guild_id) >> 22) % shard_count
+
+
+def shards_for_worker(worker: int, workers: int, shard_count: int) -> List[int]:
+    """Shards run by a worker, spread round robin between the workers.
+
+    Args:
+        worker (int): worker index.
+        workers (int): amount of workers.
+        shard_count (int): total amount of shards.
+
+    Returns:
+        List[int]: shard ids of the worker.
+    """
+    return [shard for shard in range(shard_count) if shard % workers == worker]
+
+
+def worker_for_guild(guild_id: int | None, workers: int, shard_count: int) -> int:
+    """Worker owning the conversations of a guild.
+
+    Args:
+        guild_id (int | None): guild id, None for direct messages.
+        workers (int): amount of workers.
+        shard_count (int): total amount of shards.
+
+    Returns:
+        int: worker index.
+    """
+    return shard_for_guild(guild_id, shard_count) % workers
+
+
+def worker_log_file(log_file: str, worker: int) -> str:
+    """Log file of a worker, files rotated by several processes get corrupted.
+
+    Args:
+        log_file (str): log file of the deployment, none if empty.
+        worker (int): worker index.
+
+    Returns:
+        str: the file with the worker index before its extension.
+    """
+    if not log_file:
+        return log_file
+    path = Path(log_file)
+    suffix = Sharding.WORKER_LOG_SUFFIX.value.format(worker=worker)
+    return str(path.with_name(f"{path.stem}{suffix}{path.suffix}"))
+
+
+def worker_environment(worker: int, workers: int, shard_count: int) -> Dict[str, str]:
+    """Env vars configuring the bot of a worker.
+
+    Args:
+        worker (int): worker index.
+        workers (int): amount of workers.
+        shard_count (int): total amount of shards.
+
+    Returns:
+        Dict[str, str]: env vars to set before importing the bot.
+    """
+    environment = {
+        "DISCORD_SHARD_COUNT": str(shard_count),
+        "DISCORD_SHARD_IDS": str(shards_for_worker(worker, workers, shard_count)),
+        "DISCORD_WORKERS": str(workers),
+        "DISCORD_WORKER_INDEX": str(worker),
+        "METRICS_PORT": str(
+            int(os.environ.get("METRICS_PORT", Observability.PORT.value)) + worker
+        ),
+        "LOG_FILE": worker_log_file(LOGGING_SETTINGS.LOG_FILE, worker),
+        "DISCORD_LOG_FILE": worker_log_file(
+            os.environ.get("DISCORD_LOG_FILE", DiscordLogging.FILE.value), worker
+        ),
+    }
+    return environment
+
+
+async def _serve(bot: Client, token: str) -> None:
+    """Run the bot until it is closed. SIGTERM closes it like a logout, so the
+    writes it buffers are flushed before the process exits."""
+    loop = asyncio.get_running_loop()
+    closing: List[asyncio.Future] = []
+    loop.add_signal_handler(
+        signal.SIGTERM, lambda: closing.append(asyncio.ensure_future(bot.close()))
+    )
+    async with bot:
+        await bot.start(token)
+    """start returns once the connection is closed, before the close is over"""
+    await asyncio.gather(*closing)
+
+
+def run_bot(bot: Client, token: str) -> None:
+    """Run the bot like Client.run, closing it on SIGTERM as well.
+
+    Args:
+        bot (Client): bot to run.
+        token (str): Discord bot token.
+    """
+    try:
+        asyncio.run(_serve(bot, token))
+    except KeyboardInterrupt:
+        return
+
+
+def run_worker() -> None:
+    """Entry point of a worker process, started with the env vars of the
+    worker already set since the settings are read on import. Exits with
+    Sharding.EXIT_CONFIGURATION when a restart wouldn't help."""
+    # pylint: disable=import-outside-toplevel
+    from discord import LoginFailure, PrivilegedIntentsRequired
+    from pydantic import ValidationError
+
+    try:
+        from chat_bot.bot.utils.configs import DISCORD_SETTINGS
+        from chat_bot.bot.utils.logger import configure_bot_logging
+
+        configure_bot_logging()
+        from chat_bot.bot.bot import bot
+
+        logger.info(f"Worker running shards {DISCORD_SETTINGS.DISCORD_SHARD_IDS}")
+        run_bot(bot, DISCORD_SETTINGS.DISCORD_BOT_TOKEN)
+    except (ValidationError, LoginFailure, PrivilegedIntentsRequired) as c_e:
+        logger.error(c_e)
+        sys.exit(Sharding.EXIT_CONFIGURATION.value)
+    # pylint: enable=import-outside-toplevel
+
+
+class Launcher:
+    """
+    Starts a process per worker and restarts the ones that exit unexpectedly,
+    waiting longer between restarts of a worker that keeps failing, up to
+    max_restarts in a row.
+    """
+
+    def __init__(
+        self,
+        workers: int = Sharding.WORKERS.value,
+        shard_count: int = None,
+        restart_delay: float = Supervision.RESTART_DELAY.value,
+        max_restart_delay: float = Supervision.MAX_RESTART_DELAY.value,
+        max_restarts: int = Supervision.MAX_RESTARTS.value,
+    ) -> None:
+        self.workers = workers
+        self.shard_count = shard_count or workers
+        if self.shard_count < workers:
+            raise ValueError("shard count must be at least the amount of workers")
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.max_restarts = max_restarts
+        """spawn, the workers must not inherit the state of the launcher"""
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._started_at: Dict[int, float] = {}
+        self._delays: Dict[int, float] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._restarts: Dict[int, int] = {}
+        """Exit codes of the workers that won't be restarted"""
+        self._finished: Dict[int, int] = {}
+        self._stopping = False
+
+    def _start(self, worker: int) -> None:
+        """Spawned processes inherit the env vars of the launcher as they are
+        when started, the ones of the worker are set meanwhile."""
+        environment = worker_environment(worker, self.workers, self.shard_count)
+        previous = {name: os.environ.get(name) for name in environment}
+        os.environ.update(environment)
+        try:
+            process = self._context.Process(
+                target=run_worker, name=f"chat-bot-worker-{worker}"
+            )
+            process.start()
+        finally:
+            for name, value in previous.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        self._processes[worker] = process
+        self._started_at[worker] = monotonic()
+        logger.info(f"Worker {worker} started with pid {process.pid}")
+
+    def _give_up(self, worker: int, exitcode: int) -> bool:
+        """Check if a dead worker must stay down, and record it if so."""
+        if exitcode == 0:
+            logger.info(f"Worker {worker} finished")
+        elif exitcode == Sharding.EXIT_CONFIGURATION.value:
+            logger.error(
+                f"Worker {worker} can't start as configured, not restarting it"
+            )
+        elif self._restarts.get(worker, 0) >= self.max_restarts:
+            logger.error(
+                f"Worker {worker} exited with code {exitcode} after "
+                f"{self.max_restarts} restarts in a row, not restarting it"
+            )
+        else:
+            return False
+        self._finished[worker] = exitcode
+        return True
+
+    def _check(self, worker: int) -> None:
+        """Schedule the restart of a dead worker, and do it when due."""
+        if worker in self._finished:
+            return
+        process = self._processes[worker]
+        now = monotonic()
+        if process.is_alive():
+            """A worker that stays up is not failing anymore"""
+            if now - self._started_at[worker] > self.max_restart_delay:
+                self._delays.pop(worker, None)
+                self._restarts.pop(worker, None)
+            return
+        if worker not in self._restart_at:
+            if self._give_up(worker, process.exitcode):
+                return
+            self._restarts[worker] = self._restarts.get(worker, 0) + 1
+            delay = self._delays.get(worker, self.restart_delay)
+            self._delays[worker] = min(delay * 2, self.max_restart_delay)
+            self._restart_at[worker] = now + delay
+            logger.warning(
+                f"Worker {worker} exited with code {process.exitcode}, "
+                f"restarting in {delay:.1f}s"
+            )
+        elif now >= self._restart_at[worker]:
+            del self._restart_at[worker]
+            self._start(worker)
+
+    def stop(self, *_) -> None:
+        """Terminate every worker, also used as signal handler."""
+        self._stopping = True
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    def run(self) -> int:
+        """Start the workers and supervise them until stopped or none is left.
+
+        Returns:
+            int: exit code of the launcher, the one of the last worker given
+                 up with an error, otherwise 0.
+        """
+        logger.info(f"Launching {self.workers} workers for {self.shard_count} shards")
+        signal.signal(signal.SIGTERM, self.stop)
+        for worker in range(self.workers):
+            self._start(worker)
+        try:
+            while not self._stopping and len(self._finished) < self.workers:
+                for worker in range(self.workers):
+                    self._check(worker)
+                sleep(Supervision.INTERVAL.value)
+        except KeyboardInterrupt:
+            self.stop()
+        for process in self._processes.values():
+            process.join()
+        return next((code for code in reversed(self._finished.values()) if code), 0)
+
+
+def parse_args() -> argparse.Namespace:
+    """Command line arguments, the env vars are the defaults"""
+    parser = argparse.ArgumentParser(description="Run the bot on sharded workers")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("DISCORD_WORKERS", Sharding.WORKERS.value)),
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=int(os.environ["DISCORD_SHARD_COUNT"])
+        if os.environ.get("DISCORD_SHARD_COUNT")
+        else None,
+        help="total amount of shards, the amount of workers if not set",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    configure_logging(
+        level=LOGGING_SETTINGS.LOG_LEVEL,
+        log_file=LOGGING_SETTINGS.LOG_FILE,
+        diagnose=LOGGING_SETTINGS.LOG_DIAGNOSE,
+    )
+    try:
+        sys.exit(
+            Launcher(workers=arguments.workers, shard_count=arguments.shards).run()
+        )
+    except ValueError as v_e:
+        logger.error(v_e)
+        sys.exit(2)
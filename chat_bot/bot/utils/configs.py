@@ -1,13 +1,28 @@
 """
 Env vars mapping
 """
+from typing import List, Optional, Set
 from pydantic import BaseSettings
 
+from chat_bot.bot.constants.enums import DiscordLimits, DiscordLogging, Sharding
+
 
 class DiscordSettings(BaseSettings):
     """en var mapping"""
 
     DISCORD_BOT_TOKEN: str
+    DISCORD_STREAM_RESPONSES: bool = True
+    DISCORD_EDIT_INTERVAL: float = DiscordLimits.EDIT_INTERVAL.value
+    """Channels answered with temperature 0 and cached responses, as a json list"""
+    DISCORD_RESPONSE_CACHE_CHANNELS: Set[str] = set()
+    """Shards of the process, all of them if None. Set by the launcher"""
+    DISCORD_SHARD_COUNT: Optional[int] = None
+    DISCORD_SHARD_IDS: Optional[List[int]] = None
+    DISCORD_WORKERS: int = Sharding.WORKERS.value
+    DISCORD_WORKER_INDEX: int = 0
+    DISCORD_LOG_LEVEL: str = DiscordLogging.LEVEL.value
+    """File receiving the discord.py logs, none if empty"""
+    DISCORD_LOG_FILE: str = DiscordLogging.FILE.value
 
 
 DISCORD_SETTINGS = DiscordSettings()
@@ -1,26 +1,13 @@
 """Discord bot logger configs"""
-from logging import Formatter, StreamHandler, getLogger, DEBUG
+from logging import Formatter, StreamHandler, getLogger
 from logging.handlers import RotatingFileHandler
-from chat_bot.utils.logger import logger
 
-dt_fmt = "%Y-%m-%d %H:%M:%S"
-formatter = Formatter("[{asctime}] [{levelname}] {name}: {message}", dt_fmt, style="{")
+from chat_bot.bot.constants.enums import DiscordLogging
+from chat_bot.bot.utils.configs import DISCORD_SETTINGS
+from chat_bot.utils.configs import LOGGING_SETTINGS
+from chat_bot.utils.logger import configure_logging, logger
 
 discord_logger = getLogger("discord")
-discord_logger.setLevel(DEBUG)
-
-discord_file_handler = RotatingFileHandler(
-    filename="discord.log",
-    encoding="utf-8",
-    maxBytes=32 * 1024 * 1024,  # 32 MiB
-    backupCount=5,  # Rotate through 5 files
-)
-discord_file_handler.setFormatter(formatter)
-discord_logger.addHandler(discord_file_handler)
-
-discord_stdout_handler = StreamHandler()
-discord_stdout_handler.setFormatter(formatter)
-discord_logger.addHandler(discord_stdout_handler)
 
 
 class DiscordLoggerSink:
@@ -37,9 +24,71 @@ class DiscordLoggerSink:
 
 
 discord_logger_sink = DiscordLoggerSink()
-logger.add(
-    discord_logger_sink,
-    colorize=True,
-    backtrace=True,
-    diagnose=True,
-)
+"""Id of the loguru sink forwarding to discord_logger, once configured"""
+_sink_ids = []
+
+
+def configure_discord_logging(
+    level: str = DiscordLogging.LEVEL.value,
+    log_file: str = DiscordLogging.FILE.value,
+) -> None:
+    """Send the discord.py logs to stderr and, if given, to a rotating file,
+    and forward the loguru logs to them. Replaces the handlers of a previous call.
+
+    Args:
+        level (str, optional): level of the discord logger.
+                               Defaults to DiscordLogging.LEVEL.value.
+        log_file (str, optional): file of the rotating handler, none if empty.
+                                  Defaults to DiscordLogging.FILE.value.
+    """
+    formatter = Formatter(
+        "[{asctime}] [{levelname}] {name}: {message}",
+        DiscordLogging.DATE_FORMAT.value,
+        style="{",
+    )
+    for handler in list(discord_logger.handlers):
+        discord_logger.removeHandler(handler)
+        handler.close()
+    discord_logger.setLevel(level)
+
+    if log_file:
+        discord_file_handler = RotatingFileHandler(
+            filename=log_file,
+            encoding="utf-8",
+            maxBytes=DiscordLogging.MAX_BYTES.value,
+            backupCount=DiscordLogging.BACKUP_COUNT.value,
+        )
+        discord_file_handler.setFormatter(formatter)
+        discord_logger.addHandler(discord_file_handler)
+
+    discord_stdout_handler = StreamHandler()
+    discord_stdout_handler.setFormatter(formatter)
+    discord_logger.addHandler(discord_stdout_handler)
+
+    while _sink_ids:
+        try:
+            logger.remove(_sink_ids.pop())
+        except ValueError:
+            """Already removed by configure_logging"""
+    _sink_ids.append(
+        logger.add(
+            discord_logger_sink,
+            colorize=True,
+            backtrace=True,
+            diagnose=LOGGING_SETTINGS.LOG_DIAGNOSE,
+        )
+    )
+
+
+def configure_bot_logging() -> None:
+    """Logging of a bot process, as set by the env vars. Called on start, before
+    importing the bot."""
+    configure_logging(
+        level=LOGGING_SETTINGS.LOG_LEVEL,
+        log_file=LOGGING_SETTINGS.LOG_FILE,
+        diagnose=LOGGING_SETTINGS.LOG_DIAGNOSE,
+    )
+    configure_discord_logging(
+        level=DISCORD_SETTINGS.DISCORD_LOG_LEVEL,
+        log_file=DISCORD_SETTINGS.DISCORD_LOG_FILE,
+    )
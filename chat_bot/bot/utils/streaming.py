@@ -0,0 +1,71 @@
+"""Helpers to show streamed API responses on Discord"""
+from time import monotonic
+from typing import AsyncIterator, List
+from discord import Message as DiscordMessage
+from chat_bot.bot.constants.enums import DefaultMessages, DiscordLimits
+from chat_bot.utils.metrics import tracer
+
+
+def split_content(
+    content: str, max_length: int = DiscordLimits.MESSAGE_LENGTH.value
+) -> List[str]:
+    """Split a text in chunks that fit in a Discord message.
+
+    Args:
+        content (str): text to split.
+        max_length (int, optional): max chunk length.
+                                    Defaults to DiscordLimits.MESSAGE_LENGTH.value.
+
+    Returns:
+        List[str]: chunks of text, at least one.
+    """
+    return [
+        content[index : index + max_length]
+        for index in range(0, max(len(content), 1), max_length)
+    ]
+
+
+async def edit_with_stream(
+    message: DiscordMessage,
+    deltas: AsyncIterator[str],
+    interval: float = DiscordLimits.EDIT_INTERVAL.value,
+    empty_content: str = DefaultMessages.EMPTY_RESPONSE.value,
+) -> str:
+    """Progressively edit a message with the deltas of a streamed response.
+    Deltas arriving between two edits are coalesced so the message is edited
+    at most once per interval. Text beyond the Discord length limit is sent
+    as follow-up messages once the stream is finished. Discord rejects blank
+    messages, a blank response is shown as empty_content.
+
+    Args:
+        message (DiscordMessage): placeholder message to edit.
+        deltas (AsyncIterator[str]): content deltas.
+        interval (float, optional): min seconds between edits.
+                                    Defaults to DiscordLimits.EDIT_INTERVAL.value.
+        empty_content (str, optional): content shown for a blank response.
+            Defaults to DefaultMessages.EMPTY_RESPONSE.value.
+
+    Returns:
+        str: full assembled content.
+    """
+    content = ""
+    shown = message.content
+    last_edit = monotonic()
+    async for delta in deltas:
+        content += delta
+        preview = content[: DiscordLimits.MESSAGE_LENGTH.value]
+        if preview != shown and preview.strip() and monotonic() - last_edit >= interval:
+            with tracer.span("discord_edit"):
+                await message.edit(content=preview)
+            shown = preview
+            last_edit = monotonic()
+
+    chunks = [chunk for chunk in split_content(content) if chunk.strip()]
+    if not chunks:
+        chunks = [empty_content]
+    with tracer.span("discord_edit"):
+        if chunks[0] != shown:
+            await message.edit(content=chunks[0])
+        for chunk in chunks[1:]:
+            await message.channel.send(chunk)
+    return content
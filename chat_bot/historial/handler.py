@@ -1,63 +1,121 @@
 """
 History handler class to load and save chat historial
 """
-from pathlib import Path
+import asyncio
+from copy import copy
+from sys import getsizeof
+from typing import Any, Callable, Dict, List, TypeVar
 from pydantic import ValidationError
+from chat_bot.models.compact import CompactHistorial, CompactMessage
 from chat_bot.models.historial import ChatHistorial
 from chat_bot.models.message import Message
-from chat_bot.utils.handlers.file_handler import JsonHandler
-from chat_bot.utils.handlers.path_handler import PathHandler
-from chat_bot.utils.enums import Directories, Extensions
+from chat_bot.retrieval.handler import RetrievalHandler
+from chat_bot.search.handler import SearchHandler
+from chat_bot.storage.base import StorageBackend
+from chat_bot.storage.filesystem import FileSystemStorage
+from chat_bot.storage.index import ExistenceIndex
+from chat_bot.utils.cache import LRUCache
+from chat_bot.utils.executor import BlockingIOExecutor
+from chat_bot.utils.enums import Roles
 from chat_bot.utils.logger import logger
 
+T = TypeVar("T")
+
+
+def historial_size(chat_historial: ChatHistorial | CompactHistorial) -> int:
+    """Rough estimation of the memory used by a ChatHistorial.
+
+    Args:
+        chat_historial (ChatHistorial | CompactHistorial): ChatHistorial to measure.
+
+    Returns:
+        int: estimated size in bytes.
+    """
+    return getsizeof(chat_historial) + sum(
+        getsizeof(message) + getsizeof(message.content)
+        for message in chat_historial.messages
+    )
+
 
 class ChatHistorialHandler:
     """
-    Class to load and update Chat Historial
+    Class to load and update Chat Historial. When a cache is given loaded
+    ChatHistorial are kept in memory and every write goes through to storage.
+    With compact_cache set they are kept as CompactHistorial, which load returns in
+    place of the ChatHistorial. When an index is given exists is answered
+    from memory. When a search handler is given the appended messages are
+    indexed for search, and with a retrieval handler every turn is remembered.
+    The a-prefixed methods run the storage calls on an executor,
+    to be awaited from the event loop.
     """
 
     def __init__(
         self,
-        file_handler: JsonHandler = JsonHandler(),
-        path_handler: PathHandler = PathHandler(),
+        storage: StorageBackend = None,
+        cache: LRUCache = None,
+        executor: BlockingIOExecutor = None,
+        compact_cache: bool = False,
+        index: ExistenceIndex = None,
+        search: SearchHandler = None,
+        retrieval: RetrievalHandler = None,
     ) -> None:
-        self.file_handler = file_handler
-        self.path_handler = path_handler
-        self.path_components = [
-            Directories.CWD.value,
-            Directories.DB.value,
-            Directories.CHATS.value,
-        ]
-
-    def load(self, user_id: str, chat_id: str) -> ChatHistorial:
+        self.storage = storage or FileSystemStorage()
+        self.cache = cache
+        self.executor = executor
+        self.compact_cache = compact_cache
+        self.index = index
+        self.search = search
+        self.retrieval = retrieval
+
+    def _known(self, user_id: str, chat_id: str) -> bool | None:
+        """Existence of a chat answered from memory, None if unknown."""
+        if self.cache is not None and (user_id, chat_id) in self.cache:
+            return True
+        if self.index is not None:
+            return self.index.chat_exists(user_id, chat_id)
+        return None
+
+    def _cache_put(
+        self, user_id: str, chat_id: str, chat_historial: ChatHistorial
+    ) -> ChatHistorial | CompactHistorial:
+        """Cache a ChatHistorial, compacted if required, and return the cached one."""
+        if self.compact_cache:
+            chat_historial = CompactHistorial.from_historial(chat_historial)
+        self.cache.put((user_id, chat_id), chat_historial)
+        return chat_historial
+
+    async def _run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if self.executor is None:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return await self.executor.run(func, *args, **kwargs)
+
+    def load(self, user_id: str, chat_id: str) -> ChatHistorial | CompactHistorial:
         """
-        Load an historial chat for an specific user
+        Load an historial chat for an specific user, a CompactHistorial if
+        it is cached compact
 
         Args:
             user_id (str): user_id
             chat_id (str): chat_id related to the user_id
 
         Raises:
-            v_e: File loaded don't comply with the allowed structure.
+            v_e: Stored chat don't comply with the allowed structure.
 
         Returns:
-            ChatHistorial: ChatHistorial Model populated.
+            ChatHistorial | CompactHistorial: ChatHistorial Model populated.
         """
         chat_historial = None
+        if self.cache is not None:
+            chat_historial = self.cache.get((user_id, chat_id))
+            if chat_historial is not None:
+                return chat_historial
         try:
-            historial_user_chat_path = self.path_handler.compose_path(
-                [
-                    *self.path_components,
-                    user_id,
-                    f"{chat_id}{Extensions.DOT_JSON.value}",
-                ]
-            )
-            chat_historial = ChatHistorial.parse_file(historial_user_chat_path)
+            chat_historial = self.storage.load_chat(user_id, chat_id)
+            if self.cache is not None and chat_historial is not None:
+                chat_historial = self._cache_put(user_id, chat_id, chat_historial)
         except ValidationError as v_e:
             logger.error(v_e)
             raise v_e
-        except FileNotFoundError as f_e:
-            logger.warning(f_e)
         return chat_historial
 
     def update(
@@ -69,8 +127,10 @@ class ChatHistorialHandler:
         reacted_to_profiling_step: bool = False,
         is_reaction_positive: bool = False,
         system_profile_set: bool = False,
+        remember: bool = True,
     ) -> bool:
-        """Update existing ChatHistorial with a new prompt  and or update flags
+        """Update existing ChatHistorial with a new prompt  and or update flags.
+        Only the changes are written, previous messages are not rewritten.
 
         Args:
             user_id (str): user id.
@@ -80,38 +140,36 @@ class ChatHistorialHandler:
             reacted_to_profiling_step (bool): Flag to be updated.
              is_reaction_positive (bool): Flag to be updated.
             system_profile_set (bool): Flag to be updated.
+            remember (bool, optional): add the turn to the retrieval handler,
+                                       if any. Defaults to True.
 
         Raises:
             v_e: Pydantic Validation error.
-            f_e: File not found.
+            f_e: Chat not found.
             o_e: OS Error over directory/file operations.
 
         Returns:
             bool: True if the update was sucessfull, otherwise False
         """
         is_saved = False
-        historial_user_chat_path = None
         try:
-            current_historial: ChatHistorial = self.load(user_id, chat_id)
-            if reacted_to_profiling_step:
-                current_historial.reacted_to_profiling_step = True
-            if is_reaction_positive:
-                current_historial.is_reaction_positive = True
-            if system_profile_set:
-                current_historial.system_profile_set = True
-            if new_prompt:
-                current_historial.messages.append(new_prompt)
-            if new_response:
-                current_historial.messages.append(new_response)
-            historial_user_chat_path = self.path_handler.compose_path(
-                [
-                    *self.path_components,
-                    user_id,
-                    f"{chat_id}{Extensions.DOT_JSON.value}",
-                ]
-            )
-            self.file_handler.save(current_historial.dict(), historial_user_chat_path)
-            is_saved = True
+            flags = {
+                name: True
+                for name, value in {
+                    "reacted_to_profiling_step": reacted_to_profiling_step,
+                    "is_reaction_positive": is_reaction_positive,
+                    "system_profile_set": system_profile_set,
+                }.items()
+                if value
+            }
+            messages = [message for message in (new_prompt, new_response) if message]
+            is_saved = self.storage.append_chat(user_id, chat_id, flags, messages)
+            if is_saved and self.cache is not None:
+                self._update_cached(user_id, chat_id, flags, messages)
+            if is_saved and self.search is not None:
+                self.search.add(user_id, chat_id, messages)
+            if remember and self._remembers(is_saved, new_prompt, new_response):
+                self.retrieval.add_turn(user_id, chat_id, new_prompt, new_response)
 
         except ValidationError as v_e:
             logger.error(v_e)
@@ -124,8 +182,88 @@ class ChatHistorialHandler:
             raise o_e
         return is_saved
 
+    def compact(
+        self, user_id: str, chat_id: str, summary: Message, summarized_messages: int
+    ) -> bool:
+        """Replace the oldest non system messages by a summary. The ChatHistorial
+        is rewritten once with the remaining messages.
+
+        Args:
+            user_id (str): user id.
+            chat_id (str): chat id.
+            summary (Message): summary of the replaced messages, and of the
+                               previous summary if any.
+            summarized_messages (int): amount of oldest non system messages
+                                       covered by the summary.
+
+        Raises:
+            v_e: Pydantic Validation error.
+            o_e: OS Error over directory/file operations.
+
+        Returns:
+            bool: True if the ChatHistorial was compacted, otherwise False
+        """
+        is_saved = False
+        try:
+            chat_historial = self.load(user_id, chat_id)
+            if chat_historial is None:
+                return is_saved
+            kept_messages = []
+            for message in chat_historial.messages:
+                if message.role != Roles.SYSTEM.value and summarized_messages > 0:
+                    summarized_messages -= 1
+                else:
+                    kept_messages.append(message)
+            """A copy, the cached ChatHistorial must match the disk if the
+            rewrite fails"""
+            if isinstance(chat_historial, CompactHistorial):
+                compacted = copy(chat_historial)
+                compacted.messages = kept_messages
+                compacted.summary = CompactMessage.from_message(summary)
+                is_saved = self.storage.rewrite_chat(user_id, compacted.to_historial())
+            else:
+                compacted = chat_historial.copy(
+                    update={"messages": kept_messages, "summary": summary}
+                )
+                is_saved = self.storage.rewrite_chat(user_id, compacted)
+            if is_saved and self.cache is not None:
+                self._cache_put(user_id, chat_id, compacted)
+        except ValidationError as v_e:
+            logger.error(v_e)
+            raise v_e
+        except OSError as o_e:
+            logger.error(o_e)
+            raise o_e
+        return is_saved
+
+    def _remembers(
+        self, is_saved: bool, new_prompt: Message | None, new_response: Message | None
+    ) -> bool:
+        """Check if a saved update is a turn for the retrieval handler."""
+        return bool(
+            is_saved and self.retrieval is not None and new_prompt and new_response
+        )
+
+    def _update_cached(
+        self,
+        user_id: str,
+        chat_id: str,
+        flags: Dict[str, bool],
+        messages: List[Message],
+    ) -> None:
+        """Apply an already persisted update to the cached ChatHistorial, if any."""
+        chat_historial: ChatHistorial = self.cache.get((user_id, chat_id))
+        if chat_historial is None:
+            return
+        for name, value in flags.items():
+            setattr(chat_historial, name, value)
+        if isinstance(chat_historial, CompactHistorial):
+            messages = [CompactMessage.from_message(message) for message in messages]
+        chat_historial.messages.extend(messages)
+        self.cache.put((user_id, chat_id), chat_historial)
+
     def exists(self, user_id: str, chat_id: str) -> bool:
-        """Check if an specific chat file exists.
+        """Check if an specific chat exists.
 
         Args:
             user_id (str): user_id
@@ -133,17 +271,15 @@ class ChatHistorialHandler:
         Returns:
             bool: True, otherwise False
         """
-        chat_path = self.path_handler.compose_path(
-            [
-                *self.path_components,
-                user_id,
-            ]
-        )
-        return self.path_handler.file_exists(
-            chat_path, f"{chat_id}{Extensions.DOT_JSON.value}"
-        )
+        known = self._known(user_id, chat_id)
+        if known is not None:
+            return known
+        exists = self.storage.chat_exists(user_id, chat_id)
+        if exists and self.index is not None:
+            self.index.add_chat(user_id, chat_id)
+        return exists
 
-    def create(self, user_id: str, channel_id: str, message_id: str) -> Path:
+    def create(self, user_id: str, channel_id: str, message_id: str) -> bool:
         """Creates a new ChatHistorial
 
         Args:
@@ -156,32 +292,65 @@ class ChatHistorialHandler:
             o_e: OS Error over directory/file operations.
 
         Returns:
-            Path: the Path object with the file full path.
+            bool: True if the ChatHistorial was created, otherwise False
         """
+        is_saved = False
         try:
             chat_id = channel_id
             new_chat_historial = ChatHistorial(
                 id=chat_id, message_to_react_id=message_id
             )
-            parent_dir = self.path_handler.compose_path(
-                [
-                    *self.path_components,
-                    user_id,
-                ]
-            )
-            self.path_handler.create_directory(parent_dir)
-            new_chat_historial_path = self.path_handler.compose_path(
-                [
-                    *self.path_components,
-                    user_id,
-                    f"{chat_id}{Extensions.DOT_JSON.value}",
-                ]
-            )
-            self.file_handler.save(new_chat_historial.dict(), new_chat_historial_path)
+            is_saved = self.storage.create_chat(user_id, new_chat_historial)
+            if is_saved and self.cache is not None:
+                self._cache_put(user_id, chat_id, new_chat_historial)
+            if is_saved and self.index is not None:
+                self.index.add_chat(user_id, chat_id)
         except ValidationError as v_e:
             logger.error(v_e)
             raise v_e
         except OSError as o_e:
             logger.error(o_e)
             raise o_e
-        return new_chat_historial_path
+        return is_saved
+
+    async def aload(
+        self, user_id: str, chat_id: str
+    ) -> ChatHistorial | CompactHistorial:
+        """Async version of load, cache hits are served without the executor."""
+        if self.cache is not None:
+            chat_historial = self.cache.get((user_id, chat_id))
+            if chat_historial is not None:
+                return chat_historial
+        return await self._run(self.load, user_id, chat_id)
+
+    async def aupdate(self, user_id: str, chat_id: str, **kwargs: Any) -> bool:
+        """Async version of update. The turn is added to the retrieval handler
+        in background, the conversation lock isn't held meanwhile."""
+        is_saved = await self._run(
+            self.update, user_id, chat_id, remember=False, **kwargs
+        )
+        new_prompt = kwargs.get("new_prompt")
+        new_response = kwargs.get("new_response")
+        if self._remembers(is_saved, new_prompt, new_response):
+            self.retrieval.schedule_turn(user_id, chat_id, new_prompt, new_response)
+        return is_saved
+
+    async def acompact(
+        self, user_id: str, chat_id: str, summary: Message, summarized_messages: int
+    ) -> bool:
+        """Async version of compact."""
+        return await self._run(
+            self.compact, user_id, chat_id, summary, summarized_messages
+        )
+
+    async def aexists(self, user_id: str, chat_id: str) -> bool:
+        """Async version of exists, cache and index hits are served without
+        the executor."""
+        known = self._known(user_id, chat_id)
+        if known is not None:
+            return known
+        return await self._run(self.exists, user_id, chat_id)
+
+    async def acreate(self, user_id: str, channel_id: str, message_id: str) -> bool:
+        """Async version of create."""
+        return await self._run(self.create, user_id, channel_id, message_id)
@@ -0,0 +1,27 @@
+"""
+Migrate every ChatHistorial stored on the legacy json format to the
+append-only log format, and cut the incomplete last line an interrupted
+append left on any log. Run from the directory holding db/ with the bot
+stopped:
+
+    python -m chat_bot.historial.migrate
+
+The layout of db/ is read from STORAGE_SHARD_LEVELS.
+"""
+import os
+
+from chat_bot.storage.filesystem import FileSystemStorage
+from chat_bot.utils.enums import Layout
+from chat_bot.utils.logger import logger
+
+
+if __name__ == "__main__":
+    storage = FileSystemStorage(
+        shard_levels=int(
+            os.environ.get("STORAGE_SHARD_LEVELS", Layout.SHARD_LEVELS.value)
+        )
+    )
+    migrated_chats = storage.migrate_all()
+    logger.info(f"{migrated_chats} ChatHistorial migrated")
+    repaired_chats = storage.repair_all()
+    logger.info(f"{repaired_chats} ChatHistorial repaired")
@@ -0,0 +1,167 @@
+"""
+Compact in-memory representation of ChatHistorial, for cached conversations
+"""
+from sys import intern
+from typing import Any, Dict, List, Optional
+
+from chat_bot.models.historial import ChatHistorial
+from chat_bot.models.message import Message
+from chat_bot.utils.enums import Roles
+
+"""Role values shared by every CompactMessage"""
+_ROLES = {role.value: intern(role.value) for role in Roles}
+
+
+class CompactMessage:
+    """
+    Slotted stand-in of Message: no per instance dict nor pydantic state, and
+    the role and name strings are interned so each value is held only once.
+    Exposes the attributes and methods of Message read by the bot.
+    """
+
+    __slots__ = ("role", "content", "name", "tokens")
+
+    def __init__(
+        self, role: str, content: str, name: str = None, tokens: int = None
+    ) -> None:
+        role = role.value if isinstance(role, Roles) else role
+        self.role = _ROLES.get(role) or intern(role)
+        self.content = content
+        self.name = intern(name) if name is not None else None
+        self.tokens = tokens
+
+    @classmethod
+    def from_message(cls, message: "Message | CompactMessage") -> "CompactMessage":
+        """CompactMessage of a Message, returned as is if already compact."""
+        if isinstance(message, CompactMessage):
+            return message
+        return cls(message.role, message.content, message.name, message.tokens)
+
+    def to_message(self) -> Message:
+        """Message of the CompactMessage, built without validation."""
+        return Message.from_trusted(self.to_record())
+
+    def to_api(self) -> Dict[str, Any]:
+        """Payload accepted by the ChatCompletion API for this message, built
+        on demand.
+
+        Returns:
+            Dict[str, Any]: role, content and name if set.
+        """
+        payload = {"role": self.role, "content": self.content}
+        if self.name is not None:
+            payload["name"] = self.name
+        return payload
+
+    def to_record(self) -> Dict[str, Any]:
+        """Fields of the message as stored.
+
+        Returns:
+            Dict[str, Any]: role, content, name and tokens.
+        """
+        return {
+            "role": self.role,
+            "content": self.content,
+            "name": self.name,
+            "tokens": self.tokens,
+        }
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (CompactMessage, Message)):
+            return self.to_record() == other.to_record()
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return (
+            f"CompactMessage(role={self.role!r}, content={self.content!r}, "
+            f"name={self.name!r}, tokens={self.tokens!r})"
+        )
+
+
+class CompactHistorial:
+    """
+    Slotted stand-in of ChatHistorial holding CompactMessage, kept by the
+    ChatHistorialHandler cache. Exposes the attributes of ChatHistorial read
+    and updated by the bot.
+    """
+
+    __slots__ = (
+        "id",
+        "message_to_react_id",
+        "system_profile_set",
+        "is_reaction_positive",
+        "reacted_to_profiling_step",
+        "messages",
+        "summary",
+    )
+
+    def __init__(
+        self,
+        id: str,  # pylint: disable=redefined-builtin
+        message_to_react_id: str,
+        system_profile_set: bool = False,
+        is_reaction_positive: bool = False,
+        reacted_to_profiling_step: bool = False,
+        messages: List[CompactMessage] = None,
+        summary: Optional[CompactMessage] = None,
+    ) -> None:
+        self.id = id
+        self.message_to_react_id = message_to_react_id
+        self.system_profile_set = system_profile_set
+        self.is_reaction_positive = is_reaction_positive
+        self.reacted_to_profiling_step = reacted_to_profiling_step
+        self.messages = messages if messages is not None else []
+        self.summary = summary
+
+    @classmethod
+    def from_historial(
+        cls, chat_historial: "ChatHistorial | CompactHistorial"
+    ) -> "CompactHistorial":
+        """CompactHistorial of a ChatHistorial, returned as is if already compact."""
+        if isinstance(chat_historial, CompactHistorial):
+            return chat_historial
+        return cls(
+            id=chat_historial.id,
+            message_to_react_id=chat_historial.message_to_react_id,
+            system_profile_set=chat_historial.system_profile_set,
+            is_reaction_positive=chat_historial.is_reaction_positive,
+            reacted_to_profiling_step=chat_historial.reacted_to_profiling_step,
+            messages=[
+                CompactMessage.from_message(message)
+                for message in chat_historial.messages
+            ],
+            summary=CompactMessage.from_message(chat_historial.summary)
+            if chat_historial.summary is not None
+            else None,
+        )
+
+    def to_historial(self) -> ChatHistorial:
+        """ChatHistorial of the CompactHistorial, built without validation."""
+        return ChatHistorial.from_trusted(
+            {
+                "id": self.id,
+                "message_to_react_id": self.message_to_react_id,
+                "system_profile_set": self.system_profile_set,
+                "is_reaction_positive": self.is_reaction_positive,
+                "reacted_to_profiling_step": self.reacted_to_profiling_step,
+                "messages": [message.to_record() for message in self.messages],
+                "summary": self.summary.to_record()
+                if self.summary is not None
+                else None,
+            }
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, ChatHistorial):
+            other = CompactHistorial.from_historial(other)
+        if not isinstance(other, CompactHistorial):
+            return NotImplemented
+        return all(
+            getattr(self, field) == getattr(other, field) for field in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"CompactHistorial(id={self.id!r}, messages={len(self.messages)}, "
+            f"summary={self.summary is not None})"
+        )
@@ -2,7 +2,7 @@
 Chat Historial model
 """
 
-from typing import List
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel  # pylint: disable=no-name-in-module
 
@@ -20,6 +20,7 @@ class ChatHistorial(BaseModel):
     is_reaction_positive: bool = False
     reacted_to_profiling_step: bool = False
     messages: List[Message] = []
+    summary: Optional[Message] = None
 
     class Config:
         """Configs"""
@@ -31,4 +32,25 @@ class ChatHistorial(BaseModel):
             "is_reaction_positive": {"include": True},
             "reacted_to_profiling_step": {"include": True},
             "message_to_react_id": {"include": True},
+            "summary": {"include": True},
         }
+
+    @classmethod
+    def from_trusted(cls, data: Dict[str, Any]) -> "ChatHistorial":
+        """Build a ChatHistorial from data the bot stored itself, without
+        validating it again. Loading a long conversation this way skips the
+        validation of every message.
+
+        Args:
+            data (Dict[str, Any]): fields of a ChatHistorial as stored by dict().
+
+        Returns:
+            ChatHistorial: ChatHistorial Model populated.
+        """
+        fields = dict(data)
+        fields["messages"] = [
+            Message.from_trusted(message) for message in fields.get("messages", [])
+        ]
+        if fields.get("summary") is not None:
+            fields["summary"] = Message.from_trusted(fields["summary"])
+        return cls.construct(**fields)
@@ -1,7 +1,7 @@
 """
 Message model for OpenAI API calls
 """
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from pydantic import BaseModel  # pylint: disable=no-name-in-module
 
@@ -16,6 +16,7 @@ class Message(BaseModel):
     role: Roles
     content: str
     name: Optional[str] = None
+    tokens: Optional[int] = None
 
     class Config:
         """Configs"""
@@ -25,4 +26,41 @@ class Message(BaseModel):
             "role": {"include": True},
             "content": {"include": True},
             "name": {"include": True},
+            "tokens": {"include": True},
         }
+
+    @classmethod
+    def from_trusted(cls, data: Dict[str, Any]) -> "Message":
+        """Build a Message from data the bot stored itself, without validating
+        it again.
+
+        Args:
+            data (Dict[str, Any]): fields of a Message as stored by dict().
+
+        Returns:
+            Message: Message populated.
+        """
+        return cls.construct(**data)
+
+    def to_record(self) -> Dict[str, Any]:
+        """Fields of the Message as stored, same result as dict() for this
+        flat model without walking the pydantic fields.
+
+        Returns:
+            Dict[str, Any]: role, content, name and tokens.
+        """
+        role = self.role.value if isinstance(self.role, Roles) else self.role
+        return {
+            "role": role,
+            "content": self.content,
+            "name": self.name,
+            "tokens": self.tokens,
+        }
+
+    def to_api(self) -> Dict[str, Any]:
+        """Payload accepted by the ChatCompletion API for this message.
+
+        Returns:
+            Dict[str, Any]: role, content and name if set.
+        """
+        return self.dict(include={"role", "content", "name"}, exclude_none=True)
@@ -0,0 +1,57 @@
+"""
+Routing models for the choice of the OpenAI model of each request
+"""
+from typing import List, Optional
+
+from pydantic import BaseModel, validator  # pylint: disable=no-name-in-module
+
+from chat_bot.utils.enums import Engines, Routing
+
+
+class RoutingPolicy(BaseModel):
+    """
+    Models a guild may use, from the preferred one, and the seconds its
+    users wait for the first content of a response
+    """
+
+    models: List[str] = [Engines.GPT_3_5_TURBO.value]
+    deadline: float = Routing.DEADLINE.value
+
+    @validator("models")
+    def known_models(cls, models: List[str]) -> List[str]:
+        """At least one model, all of them in Engines"""
+        if not models:
+            raise ValueError("a routing policy needs at least one model")
+        for model in models:
+            Engines(model)
+        return models
+
+
+class RoutingAttempt(BaseModel):
+    """
+    Call to a model made, or skipped, while routing a request
+    """
+
+    model: str
+    """answered, timeout, error or skipped"""
+    outcome: str
+    latency: float = 0.0
+    timeout: Optional[float] = None
+
+
+class RoutingDecision(BaseModel):
+    """
+    Models chosen for a request and the outcome of the calls made
+    """
+
+    timestamp: float
+    user_id: str
+    chat_id: str
+    guild_id: Optional[str] = None
+    prompt_tokens: int
+    deadline: float
+    candidates: List[str]
+    """Model that answered, None if none did before the deadline"""
+    model: Optional[str] = None
+    attempts: List[RoutingAttempt] = []
+    latency: float = 0.0
@@ -0,0 +1,21 @@
+"""
+Search models for the conversation history
+"""
+from typing import Optional
+
+from pydantic import BaseModel  # pylint: disable=no-name-in-module
+
+
+class SearchResult(BaseModel):
+    """
+    A message matching a search, best ranked first
+    """
+
+    user_id: str
+    chat_id: str
+    role: str
+    snippet: str
+    """Unix time the message was indexed, None if indexed by a rebuild"""
+    timestamp: Optional[float] = None
+    """bm25 of the message, lower is better"""
+    score: float
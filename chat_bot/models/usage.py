@@ -0,0 +1,65 @@
+"""
+Usage models for OpenAI API calls
+"""
+from typing import Optional
+
+from pydantic import BaseModel  # pylint: disable=no-name-in-module
+
+
+class UsageRecord(BaseModel):
+    """
+    Tokens and latency of a single turn
+    """
+
+    timestamp: float
+    user_id: str
+    chat_id: str
+    guild_id: Optional[str] = None
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    latency: float
+    """Served from the response cache, its tokens weren't billed again"""
+    cached: bool = False
+
+
+class UsageTotals(BaseModel):
+    """
+    Aggregated usage of a user, channel or guild
+    """
+
+    turns: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    total_latency: float = 0.0
+    cached_turns: int = 0
+
+    @property
+    def mean_latency(self) -> float:
+        """Mean latency of the turns, in seconds"""
+        return self.total_latency / self.turns if self.turns else 0.0
+
+    def add(self, other: "UsageTotals | UsageRecord") -> None:
+        """Accumulate a record or other totals. The tokens of a cached record
+        are not added, only its turn.
+
+        Args:
+            other (UsageTotals | UsageRecord): usage to add.
+        """
+        if isinstance(other, UsageTotals):
+            self.turns += other.turns
+            self.cached_turns += other.cached_turns
+        else:
+            self.turns += 1
+            if other.cached:
+                self.cached_turns += 1
+                self.total_latency += other.latency
+                return
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.total_tokens += other.total_tokens
+        self.total_latency += (
+            other.total_latency if isinstance(other, UsageTotals) else other.latency
+        )
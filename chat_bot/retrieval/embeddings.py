@@ -0,0 +1,140 @@
+"""
+Embedders turning texts into vectors for the retrieval memory
+"""
+import hashlib
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import Counter
+from math import log, sqrt
+from typing import List
+
+import openai
+
+from chat_bot.utils.enums import Embedders, Retrieval
+from chat_bot.utils.logger import logger
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(vector: List[float]) -> List[float]:
+    """Scale a vector to unit length, so dot products are cosine similarities.
+
+    Args:
+        vector (List[float]): vector to scale.
+
+    Returns:
+        List[float]: unit vector, the same vector if it is all zeros.
+    """
+    norm = sqrt(sum(value * value for value in vector))
+    if norm == 0:
+        return vector
+    return [value / norm for value in vector]
+
+
+class Embedder(ABC):
+    """
+    Turns texts into unit vectors of a fixed dimension. The name identifies
+    the vector space, vectors of embedders with another name aren't comparable.
+    """
+
+    name: str
+    dimension: int
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Vectors of a batch of texts, in the same order."""
+
+
+class HashingEmbedder(Embedder):
+    """
+    Local embedder without any model nor vocabulary: the words and the word
+    pairs of a text, lowercased, without accents and without the shortest
+    words, are hashed into the dimensions of the vector with a sign, weighted
+    by 1 + log of their count.
+    Texts sharing words get close vectors.
+    """
+
+    def __init__(self, dimension: int = Retrieval.HASHING_DIMENSION.value) -> None:
+        self.dimension = dimension
+        self.name = f"{Embedders.HASHING.value}-{dimension}"
+
+    @staticmethod
+    def _features(text: str) -> Counter:
+        text = unicodedata.normalize("NFKD", text.lower())
+        text = "".join(char for char in text if not unicodedata.combining(char))
+        words = [
+            word
+            for word in _WORD.findall(text)
+            if len(word) >= Retrieval.MIN_WORD_LENGTH.value
+        ]
+        return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimension
+        for feature, count in self._features(text).items():
+            digest = int.from_bytes(
+                hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little"
+            )
+            """The sign bit keeps colliding features from adding up"""
+            sign = 1.0 if digest >> 63 else -1.0
+            vector[digest % self.dimension] += sign * (1.0 + log(count))
+        return normalize(vector)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+
+class OpenAIEmbedder(Embedder):
+    """
+    Embeddings API of OpenAI, one request per batch of texts. Uses the api
+    key set on the openai module.
+    """
+
+    def __init__(
+        self,
+        model: str = Retrieval.EMBEDDING_MODEL.value,
+        dimension: int = Retrieval.EMBEDDING_DIMENSION.value,
+    ) -> None:
+        self.model = model
+        self.dimension = dimension
+        self.name = f"{Embedders.OPENAI.value}-{model}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Vectors of a batch of texts, in the same order.
+
+        Raises:
+            o_e: OpenAI API error.
+        """
+        try:
+            response = openai.Embedding.create(model=self.model, input=texts)
+        except openai.error.OpenAIError as o_e:
+            logger.error(o_e)
+            raise o_e
+        data = sorted(response["data"], key=lambda item: item["index"])
+        return [normalize(list(item["embedding"])) for item in data]
+
+
+def create_embedder(
+    embedder: Embedders = Embedders.HASHING,
+    dimension: int = Retrieval.HASHING_DIMENSION.value,
+) -> Embedder:
+    """Build the configured embedder.
+
+    Args:
+        embedder (Embedders, optional): embedder to build.
+                                        Defaults to Embedders.HASHING.
+        dimension (int, optional): dimensions of the hashing embedder.
+                                   Defaults to Retrieval.HASHING_DIMENSION.value.
+
+    Raises:
+        ValueError: Unknown embedder.
+
+    Returns:
+        Embedder: the embedder.
+    """
+    if embedder == Embedders.HASHING:
+        return HashingEmbedder(dimension=dimension)
+    if embedder == Embedders.OPENAI:
+        return OpenAIEmbedder()
+    raise ValueError(f"Unknown embedder: {embedder}")
@@ -0,0 +1,449 @@
+"""
+Retrieval handler class, the long-term memory of the conversations
+
+Every turn of a conversation, a user prompt and the assistant response, is
+embedded once and kept beside the ChatHistorial log: its messages appended
+to <chat_id>.turns, a json lines log, and its vector to <chat_id>.vectors,
+little endian float32 after a header naming the embedder. Loaded
+conversations are cached as a VectorIndex plus their turns.
+
+For a new message the turns most similar to it, and a bit less to the
+previous user message, are retrieved, so the prompt carries the relevant
+past turns plus the recent tail instead of the whole conversation. Turns
+replaced by a summary on the ChatHistorial are still retrieved.
+
+Conversations stored before the memory existed are embedded from their
+ChatHistorial the first time they are retrieved from.
+"""
+import asyncio
+import os
+import struct
+import tempfile
+from hashlib import sha256
+from pathlib import Path
+from sys import getsizeof
+from threading import Lock
+from typing import Any, Callable, Dict, List, Tuple, TypeVar
+
+from openai.error import OpenAIError
+
+from chat_bot.models.compact import CompactMessage
+from chat_bot.models.message import Message
+from chat_bot.retrieval.embeddings import Embedder, HashingEmbedder
+from chat_bot.retrieval.index import VectorIndex
+from chat_bot.utils.cache import LRUCache
+from chat_bot.utils.enums import (
+    CacheLimits,
+    Directories,
+    Encodings,
+    Extensions,
+    Layout,
+    Retrieval,
+    Roles,
+)
+from chat_bot.utils.executor import BlockingIOExecutor
+from chat_bot.utils.handlers.file_handler import JsonLinesHandler
+from chat_bot.utils.handlers.path_handler import PathHandler
+from chat_bot.utils.logger import logger
+from chat_bot.utils.metrics import metrics_registry
+from chat_bot.utils.serialization import loads
+
+T = TypeVar("T")
+
+Turn = Tuple[CompactMessage, CompactMessage]
+
+HEADER_SIZE = struct.calcsize(Retrieval.HEADER_FORMAT.value)
+
+"""Loads of different conversations run in parallel, of the same one once"""
+_LOCK_STRIPES = 64
+
+retrieval_seconds = metrics_registry.histogram(
+    "chat_bot_retrieval_seconds", "Seconds spent retrieving past turns"
+)
+
+
+class ConversationMemory:
+    """
+    Turns of a conversation and their vectors, in the same order
+    """
+
+    __slots__ = ("turns", "index", "persisted")
+
+    def __init__(
+        self, turns: List[Turn], index: VectorIndex, persisted: bool = True
+    ) -> None:
+        self.turns = turns
+        self.index = index
+        """False until the files of the conversation are written"""
+        self.persisted = persisted
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+
+def memory_size(memory: ConversationMemory) -> int:
+    """Rough estimation of the memory used by a ConversationMemory.
+
+    Args:
+        memory (ConversationMemory): memory to measure.
+
+    Returns:
+        int: estimated size in bytes.
+    """
+    return (
+        getsizeof(memory.turns)
+        + 4 * memory.index.dimension * len(memory.index)
+        + sum(getsizeof(message.content) for turn in memory.turns for message in turn)
+    )
+
+
+class RetrievalHandler:
+    """
+    Class to remember the turns of the conversations and retrieve the ones
+    relevant to a new message. The a-prefixed methods run on an executor,
+    to be awaited from the event loop.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder = None,
+        top_k: int = Retrieval.TOP_K.value,
+        recent_messages: int = Retrieval.RECENT_MESSAGES.value,
+        min_score: float = Retrieval.MIN_SCORE.value,
+        context_weight: float = Retrieval.CONTEXT_WEIGHT.value,
+        cache: LRUCache = None,
+        executor: BlockingIOExecutor = None,
+        root: str = Directories.CWD.value,
+        shard_levels: int = Layout.SHARD_LEVELS.value,
+        path_handler: PathHandler = None,
+    ) -> None:
+        """
+        Args:
+            embedder (Embedder, optional): embedder of the turns, a
+                                           HashingEmbedder if None.
+            top_k (int, optional): past turns retrieved.
+                                   Defaults to Retrieval.TOP_K.value.
+            recent_messages (int, optional): latest non system messages always
+                sent. Defaults to Retrieval.RECENT_MESSAGES.value.
+            min_score (float, optional): similarity needed to be retrieved.
+                                         Defaults to Retrieval.MIN_SCORE.value.
+            context_weight (float, optional): weight of the previous user message.
+                                              Defaults to Retrieval.CONTEXT_WEIGHT.value.
+            cache (LRUCache, optional): cache of the loaded conversations.
+            executor (BlockingIOExecutor, optional): executor of the async methods.
+            root (str, optional): directory holding db/. Defaults to Directories.CWD.value.
+            shard_levels (int, optional): hash prefix directories of db/chats.
+                                          Defaults to Layout.SHARD_LEVELS.value.
+            path_handler (PathHandler, optional): path utilities.
+        """
+        self.embedder = embedder or HashingEmbedder()
+        self.top_k = top_k
+        self.recent_messages = recent_messages
+        self.min_score = min_score
+        self.context_weight = context_weight
+        self.cache = cache or LRUCache(
+            max_items=CacheLimits.MAX_ITEMS.value, size_of=memory_size
+        )
+        self.executor = executor
+        self.shard_levels = shard_levels
+        self.path_handler = path_handler or PathHandler()
+        """Derived data, rebuilt from the ChatHistorial if lost"""
+        self.log_handler = JsonLinesHandler(fsync=False)
+        self.chats_components = [root, Directories.DB.value, Directories.CHATS.value]
+        self.header = struct.pack(
+            Retrieval.HEADER_FORMAT.value,
+            Retrieval.MAGIC.value,
+            self.embedder.dimension,
+            sha256(self.embedder.name.encode()).digest()[:16],
+        )
+        self._locks = [Lock() for _ in range(_LOCK_STRIPES)]
+        """Last turn being remembered in background, by conversation"""
+        self._pending: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    def _lock(self, user_id: str, chat_id: str) -> Lock:
+        return self._locks[hash((user_id, chat_id)) % _LOCK_STRIPES]
+
+    def _paths(self, user_id: str, chat_id: str) -> Tuple[Path, Path]:
+        chat_dir = (
+            self.path_handler.compose_path(
+                self.chats_components,
+                shard_key=user_id,
+                shard_levels=self.shard_levels,
+            )
+            / user_id
+        )
+        return (
+            chat_dir / f"{chat_id}{Extensions.DOT_TURNS.value}",
+            chat_dir / f"{chat_id}{Extensions.DOT_VECTORS.value}",
+        )
+
+    @staticmethod
+    def _turn_text(turn: Turn) -> str:
+        return f"{turn[0].content}\n{turn[1].content}"
+
+    @staticmethod
+    def _turn_record(turn: Turn) -> Dict[str, Any]:
+        return {"prompt": turn[0].to_record(), "response": turn[1].to_record()}
+
+    def recent(self, messages: List[Message]) -> List[Message]:
+        """Latest non system messages, always sent.
+
+        Args:
+            messages (List[Message]): messages of the ChatHistorial.
+
+        Returns:
+            List[Message]: up to recent_messages messages, in conversation order.
+        """
+        if self.recent_messages <= 0:
+            return []
+        return [message for message in messages if message.role != Roles.SYSTEM.value][
+            -self.recent_messages :
+        ]
+
+    @staticmethod
+    def _historial_turns(messages: List[Message]) -> List[Turn]:
+        """User prompts followed by the assistant response."""
+        conversation = [
+            message for message in messages if message.role != Roles.SYSTEM.value
+        ]
+        return [
+            (CompactMessage.from_message(prompt), CompactMessage.from_message(response))
+            for prompt, response in zip(conversation, conversation[1:])
+            if prompt.role == Roles.USER.value
+            and response.role == Roles.ASSISTANT.value
+        ]
+
+    def _write(self, user_id: str, chat_id: str, memory: ConversationMemory) -> None:
+        """Replace both files of a conversation with its whole memory."""
+        turns_path, vectors_path = self._paths(user_id, chat_id)
+        self.path_handler.create_directory(turns_path.parent)
+        fd, temp_path = tempfile.mkstemp(
+            dir=vectors_path.parent, prefix=f".{vectors_path.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(self.header + memory.index.to_bytes())
+            os.replace(temp_path, vectors_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        self.log_handler.save(
+            [self._turn_record(turn) for turn in memory.turns], turns_path
+        )
+        memory.persisted = True
+
+    def _read(self, user_id: str, chat_id: str) -> ConversationMemory | None:
+        """Memory of a conversation as stored, None if there is none. Files
+        left apart by a crash or written by another embedder are repaired."""
+        turns_path, vectors_path = self._paths(user_id, chat_id)
+        if not turns_path.is_file() or not vectors_path.is_file():
+            return None
+        text = turns_path.read_text(encoding=Encodings.UTF_8.value)
+        data = vectors_path.read_bytes()
+        lines = text.split("\n")
+        turns = []
+        for line in lines[:-1]:
+            if line:
+                try:
+                    record = loads(line)
+                    turns.append(
+                        (
+                            CompactMessage(**record["prompt"]),
+                            CompactMessage(**record["response"]),
+                        )
+                    )
+                except (KeyError, TypeError) as k_e:
+                    raise ValueError(f"Corrupt turn in {turns_path}") from k_e
+        if data[:HEADER_SIZE] == self.header:
+            index = VectorIndex.from_bytes(data[HEADER_SIZE:], self.embedder.dimension)
+        else:
+            logger.info(f"Embedding again the turns of {user_id}/{chat_id}")
+            index = VectorIndex(self.embedder.dimension)
+        memory = ConversationMemory(turns, index)
+        if len(index) == len(turns) and not lines[-1]:
+            return memory
+        """An interrupted append, or vectors of another embedder"""
+        index.truncate(len(turns))
+        missing = turns[len(index) :]
+        if missing:
+            index.add(self.embedder.embed([self._turn_text(turn) for turn in missing]))
+        self._write(user_id, chat_id, memory)
+        return memory
+
+    def _memory(
+        self, user_id: str, chat_id: str, messages: List[Message] = None
+    ) -> ConversationMemory | None:
+        """Cached memory of a conversation, read or built from the messages
+        of its ChatHistorial if given."""
+        key = (user_id, chat_id)
+        memory = self.cache.get(key)
+        if memory is not None:
+            return memory
+        with self._lock(user_id, chat_id):
+            memory = self.cache.get(key)
+            if memory is not None:
+                return memory
+            memory = self._read(user_id, chat_id)
+            if memory is None:
+                if messages is None:
+                    return None
+                turns = self._historial_turns(messages)
+                index = VectorIndex(self.embedder.dimension)
+                memory = ConversationMemory(turns, index, persisted=False)
+                if turns:
+                    index.add(
+                        self.embedder.embed([self._turn_text(turn) for turn in turns])
+                    )
+                    self._write(user_id, chat_id, memory)
+            self.cache.put(key, memory)
+        return memory
+
+    def add_turn(
+        self, user_id: str, chat_id: str, prompt: Message, response: Message
+    ) -> bool:
+        """Remember a turn. Conversations without memory yet are skipped, they
+        are built with this turn from the ChatHistorial on next retrieve. The
+        memory is secondary, a failure is logged and doesn't fail the turn.
+
+        Args:
+            user_id (str): user id.
+            chat_id (str): chat id.
+            prompt (Message): user prompt.
+            response (Message): assistant response.
+
+        Returns:
+            bool: True if the turn was remembered, otherwise False
+        """
+        try:
+            memory = self._memory(user_id, chat_id)
+            if memory is None:
+                return False
+            turn = (
+                CompactMessage.from_message(prompt),
+                CompactMessage.from_message(response),
+            )
+            vector = self.embedder.embed([self._turn_text(turn)])
+            with self._lock(user_id, chat_id):
+                turns_path, vectors_path = self._paths(user_id, chat_id)
+                if not memory.persisted:
+                    self.path_handler.create_directory(vectors_path.parent)
+                    with open(vectors_path, "wb") as file:
+                        file.write(self.header)
+                    memory.persisted = True
+                self.log_handler.append([self._turn_record(turn)], turns_path)
+                with open(vectors_path, "ab") as file:
+                    file.write(VectorIndex.vector_bytes(vector))
+                memory.turns.append(turn)
+                memory.index.add(vector)
+            self.cache.put((user_id, chat_id), memory)
+        except (OSError, ValueError, OpenAIError) as x_e:
+            logger.error(x_e)
+            return False
+        return True
+
+    @retrieval_seconds.time()
+    def retrieve(
+        self, user_id: str, chat_id: str, content: str, messages: List[Message]
+    ) -> List[Turn] | None:
+        """Past turns of a conversation most similar to a new message, leaving
+        out the recent ones which are always sent.
+
+        Args:
+            user_id (str): user id.
+            chat_id (str): chat id.
+            content (str): new message.
+            messages (List[Message]): messages of the ChatHistorial.
+
+        Returns:
+            List[Turn] | None: prompt and response of the retrieved turns, in
+                conversation order. None if the memory is unavailable, the
+                whole ChatHistorial is to be sent then.
+        """
+        try:
+            memory = self._memory(user_id, chat_id, messages)
+            if not memory:
+                return []
+            recent = self.recent(messages)
+            previous = [
+                message.content
+                for message in recent
+                if message.role == Roles.USER.value
+            ][-1:]
+            """The new message and the previous one are looked up at once"""
+            hits = memory.index.search(
+                self.embedder.embed([content, *previous]), self.top_k + len(recent)
+            )
+        except (OSError, ValueError, OpenAIError) as x_e:
+            logger.error(x_e)
+            return None
+        scores: Dict[int, float] = {}
+        for query, query_hits in enumerate(hits):
+            weight = 1.0 if query == 0 else self.context_weight
+            for position, score in query_hits:
+                scores[position] = max(
+                    scores.get(position, float("-inf")), weight * score
+                )
+        recent_contents = {message.content for message in recent}
+        selected = [
+            position
+            for position, score in sorted(
+                scores.items(), key=lambda item: item[1], reverse=True
+            )
+            if score >= self.min_score
+            and memory.turns[position][0].content not in recent_contents
+        ][: self.top_k]
+        return [memory.turns[position] for position in sorted(selected)]
+
+    async def _run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if self.executor is None:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return await self.executor.run(func, *args, **kwargs)
+
+    async def aadd_turn(
+        self, user_id: str, chat_id: str, prompt: Message, response: Message
+    ) -> bool:
+        """Async version of add_turn."""
+        return await self._run(self.add_turn, user_id, chat_id, prompt, response)
+
+    def schedule_turn(
+        self, user_id: str, chat_id: str, prompt: Message, response: Message
+    ) -> asyncio.Task:
+        """Remember a turn in background, once the previous turns of the
+        conversation are remembered so they keep their order.
+
+        Args:
+            user_id (str): user id.
+            chat_id (str): chat id.
+            prompt (Message): user prompt.
+            response (Message): assistant response.
+
+        Returns:
+            asyncio.Task: task remembering the turn, see add_turn.
+        """
+        key = (user_id, chat_id)
+        previous = self._pending.get(key)
+
+        async def add() -> bool:
+            if previous is not None:
+                await asyncio.wait([previous])
+            return await self.aadd_turn(user_id, chat_id, prompt, response)
+
+        task = asyncio.create_task(add())
+        self._pending[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return task
+
+    def _forget(self, key: Tuple[str, str], task: asyncio.Task) -> None:
+        if self._pending.get(key) is task:
+            del self._pending[key]
+
+    async def close(self) -> None:
+        """Wait for the turns being remembered in background."""
+        await asyncio.gather(*self._pending.values(), return_exceptions=True)
+
+    async def aretrieve(
+        self, user_id: str, chat_id: str, content: str, messages: List[Message]
+    ) -> List[Turn] | None:
+        """Async version of retrieve."""
+        return await self._run(self.retrieve, user_id, chat_id, content, messages)
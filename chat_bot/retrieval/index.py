@@ -0,0 +1,166 @@
+"""
+In-memory vector index of a conversation, NumPy backed when it is installed
+"""
+import heapq
+import sys
+from array import array
+from typing import List, Sequence, Tuple
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+
+class VectorIndex:
+    """
+    Unit vectors of fixed dimension searched by cosine similarity. Vectors
+    are only appended. With NumPy they are rows of a float32 matrix grown by
+    doubling, and a batch of queries is answered with a single matrix
+    product; otherwise they are kept as float arrays.
+    """
+
+    def __init__(self, dimension: int) -> None:
+        self.dimension = dimension
+        self._size = 0
+        if numpy is not None:
+            self._matrix = numpy.zeros((0, dimension), dtype=numpy.float32)
+        else:
+            self._vectors: List[array] = []
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, vectors: Sequence[Sequence[float]]) -> None:
+        """Append vectors, their position is the amount of vectors before them.
+
+        Args:
+            vectors (Sequence[Sequence[float]]): vectors of the index dimension.
+
+        Raises:
+            ValueError: A vector doesn't have the index dimension.
+        """
+        if any(len(vector) != self.dimension for vector in vectors):
+            raise ValueError(f"Vectors must have {self.dimension} dimensions")
+        if numpy is None:
+            self._vectors.extend(array("f", vector) for vector in vectors)
+            self._size += len(vectors)
+            return
+        needed = self._size + len(vectors)
+        if needed > len(self._matrix):
+            matrix = numpy.zeros(
+                (max(needed, 2 * len(self._matrix)), self.dimension),
+                dtype=numpy.float32,
+            )
+            matrix[: self._size] = self._matrix[: self._size]
+            self._matrix = matrix
+        self._matrix[self._size : needed] = vectors
+        self._size = needed
+
+    def search(
+        self, queries: Sequence[Sequence[float]], k: int
+    ) -> List[List[Tuple[int, float]]]:
+        """Most similar vectors of each query of a batch.
+
+        Args:
+            queries (Sequence[Sequence[float]]): unit vectors to look up.
+            k (int): max amount of results per query.
+
+        Returns:
+            List[List[Tuple[int, float]]]: per query, positions and cosine
+                similarities of the results, most similar first.
+        """
+        if not queries or self._size == 0 or k <= 0:
+            return [[] for _ in queries]
+        k = min(k, self._size)
+        if numpy is None:
+            results = []
+            for query in queries:
+                """Hashed texts are sparse, only their dimensions are multiplied"""
+                dimensions = [(d, value) for d, value in enumerate(query) if value]
+                scores = [
+                    sum(vector[d] * value for d, value in dimensions)
+                    for vector in self._vectors
+                ]
+                results.append(
+                    heapq.nlargest(k, enumerate(scores), key=lambda item: item[1])
+                )
+            return results
+        scores = (
+            self._matrix[: self._size] @ numpy.asarray(queries, dtype=numpy.float32).T
+        )
+        """Top k of each column without sorting every score"""
+        top = numpy.argpartition(-scores, k - 1, axis=0)[:k]
+        results = []
+        for column in range(scores.shape[1]):
+            positions = top[:, column]
+            ranked = positions[numpy.argsort(-scores[positions, column])]
+            results.append(
+                [
+                    (int(position), float(scores[position, column]))
+                    for position in ranked
+                ]
+            )
+        return results
+
+    def to_bytes(self) -> bytes:
+        """Vectors as little endian float32, row after row."""
+        if numpy is not None:
+            return self._matrix[: self._size].astype("<f4").tobytes()
+        data = array("f")
+        for vector in self._vectors:
+            data.extend(vector)
+        if sys.byteorder == "big":
+            data.byteswap()
+        return data.tobytes()
+
+    @staticmethod
+    def vector_bytes(vectors: Sequence[Sequence[float]]) -> bytes:
+        """Vectors as stored by to_bytes, to append them to a file."""
+        data = array("f")
+        for vector in vectors:
+            data.extend(vector)
+        if sys.byteorder == "big":
+            data.byteswap()
+        return data.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, dimension: int) -> "VectorIndex":
+        """Index of the vectors written by to_bytes. A trailing incomplete
+        vector is ignored.
+
+        Args:
+            data (bytes): little endian float32 vectors.
+            dimension (int): dimension of the vectors.
+
+        Returns:
+            VectorIndex: index holding the vectors.
+        """
+        index = cls(dimension)
+        row_bytes = 4 * dimension
+        data = data[: len(data) - len(data) % row_bytes]
+        if numpy is not None:
+            index._matrix = (
+                numpy.frombuffer(data, dtype="<f4")
+                .astype(numpy.float32)
+                .reshape(-1, dimension)
+            )
+            index._size = len(index._matrix)
+            return index
+        values = array("f", data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        index._vectors = [
+            values[start : start + dimension]
+            for start in range(0, len(values), dimension)
+        ]
+        index._size = len(index._vectors)
+        return index
+
+    def truncate(self, size: int) -> None:
+        """Keep only the first size vectors."""
+        if size >= self._size:
+            return
+        if numpy is None:
+            del self._vectors[size:]
+        self._size = size
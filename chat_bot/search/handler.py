@@ -0,0 +1,278 @@
+"""
+Search handler class to index and search the ChatHistorial messages
+
+The user and assistant messages are kept on a SQLite FTS5 full-text index
+at db/search.sqlite3, updated by the ChatHistorialHandler as every turn is
+appended. A search looks up the terms and the user id on the inverted index
+and ranks the matches by bm25, so it only reads the matching messages of the
+user whatever the size of the history.
+
+Messages replaced by a summary stay searchable. The chats stored before the
+index existed are added by chat_bot.search.rebuild.
+"""
+import asyncio
+import re
+import sqlite3
+from pathlib import Path
+from threading import Lock, local
+from time import time
+from typing import Any, Callable, List, Set, TypeVar
+
+from chat_bot.models.message import Message
+from chat_bot.models.search import SearchResult
+from chat_bot.storage.base import StorageBackend
+from chat_bot.utils.enums import Directories, Extensions, Roles, Search
+from chat_bot.utils.executor import BlockingIOExecutor
+from chat_bot.utils.logger import logger
+from chat_bot.utils.metrics import metrics_registry
+
+T = TypeVar("T")
+
+"""remove_diacritics, a search of "cancion" finds "canción" too"""
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+    content,
+    user_id,
+    chat_id,
+    role UNINDEXED,
+    timestamp UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+"""Only the content ranks, the id columns are there to scope the searches"""
+RANK = "bm25(messages, 1.0, 0.0, 0.0)"
+
+INDEXED_ROLES = (Roles.USER.value, Roles.ASSISTANT.value)
+
+_TERM = re.compile(r"\w+")
+
+
+def _quote(text: str) -> str:
+    """FTS5 string of a text, matched as a phrase."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+search_seconds = metrics_registry.histogram(
+    "chat_bot_search_seconds", "Seconds spent on full-text searches"
+)
+
+
+class SearchHandler:
+    """
+    Class to index the ChatHistorial messages and search them by user.
+    Each thread gets its own connection, all of them are closed by close. The
+    a-prefixed methods run on an executor, to be awaited from the event loop.
+    """
+
+    def __init__(
+        self,
+        database: str | Path = None,
+        executor: BlockingIOExecutor = None,
+        synchronous: str = "NORMAL",
+    ) -> None:
+        """
+        Args:
+            database (str | Path, optional): index file, db/search.sqlite3 if None.
+            executor (BlockingIOExecutor, optional): executor of the async methods.
+            synchronous (str, optional): SQLite synchronous pragma, the index
+                can be rebuilt from storage. Defaults to "NORMAL".
+        """
+        self.database = Path(
+            database
+            or Path(Directories.CWD.value)
+            / Directories.DB.value
+            / f"{Directories.SEARCH.value}{Extensions.DOT_SQLITE3.value}"
+        )
+        self.executor = executor
+        self.synchronous = synchronous
+        self._local = local()
+        self._connections: Set[sqlite3.Connection] = set()
+        self._connections_lock = Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or connection not in self._connections:
+            """Opened on first use, building the handler touches no file"""
+            self.database.parent.mkdir(parents=True, exist_ok=True)
+            """Only its thread uses it, close runs on another one"""
+            connection = sqlite3.connect(
+                self.database, timeout=30, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"PRAGMA synchronous={self.synchronous}")
+            connection.executescript(SCHEMA)
+            with self._connections_lock:
+                self._connections.add(connection)
+            self._local.connection = connection
+        return connection
+
+    def close(self) -> None:
+        """Close the connections of every thread, the executor ones included."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, set()
+        for connection in connections:
+            connection.close()
+        self._local.connection = None
+
+    @staticmethod
+    def _rows(
+        user_id: str, chat_id: str, messages: List[Message], timestamp: float | None
+    ) -> List[tuple]:
+        return [
+            (message.content, user_id, chat_id, message.role, timestamp)
+            for message in messages
+            if message.role in INDEXED_ROLES and message.content
+        ]
+
+    def add(self, user_id: str, chat_id: str, messages: List[Message]) -> bool:
+        """Index the messages appended to a ChatHistorial. The index is
+        secondary, a failure is logged and doesn't fail the turn.
+
+        Args:
+            user_id (str): user id.
+            chat_id (str): chat id.
+            messages (List[Message]): appended messages, the system ones
+                                      are not indexed.
+
+        Returns:
+            bool: True if the messages were indexed, otherwise False
+        """
+        rows = self._rows(user_id, chat_id, messages, time())
+        if not rows:
+            return True
+        try:
+            with self._connection() as connection:
+                connection.executemany(
+                    "INSERT INTO messages (content, user_id, chat_id, role, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+        except sqlite3.Error as s_e:
+            logger.error(s_e)
+            return False
+        return True
+
+    def rebuild(self, storage: StorageBackend) -> int:
+        """Index again every stored ChatHistorial, replacing the index.
+
+        Args:
+            storage (StorageBackend): storage holding the ChatHistorial.
+
+        Raises:
+            s_e: SQLite error writing the index.
+
+        Returns:
+            int: amount of indexed messages.
+        """
+        indexed = 0
+        try:
+            with self._connection() as connection:
+                connection.execute("DELETE FROM messages")
+                for user_id, chat_id in storage.iter_chats():
+                    chat_historial = storage.load_chat(user_id, chat_id)
+                    if chat_historial is None:
+                        continue
+                    rows = self._rows(user_id, chat_id, chat_historial.messages, None)
+                    connection.executemany(
+                        "INSERT INTO messages (content, user_id, chat_id, role, "
+                        "timestamp) VALUES (?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                    indexed += len(rows)
+                """Merge the index segments, searches read a single one"""
+                connection.execute(
+                    "INSERT INTO messages (messages) VALUES ('optimize')"
+                )
+        except sqlite3.Error as s_e:
+            logger.error(s_e)
+            raise s_e
+        logger.info(f"Search index rebuilt with {indexed} messages")
+        return indexed
+
+    @staticmethod
+    def _match(
+        user_id: str, terms: List[str], chat_id: str = None, any_term: bool = False
+    ) -> str:
+        """FTS5 query of the terms on the content of the messages of a user.
+        Terms are quoted, the text of a search is never parsed as syntax."""
+        operator = " OR " if any_term else " AND "
+        query = f"user_id : {_quote(user_id)} AND content : ("
+        query += operator.join(_quote(term) for term in terms) + ")"
+        if chat_id is not None:
+            query += f" AND chat_id : {_quote(chat_id)}"
+        return query
+
+    @search_seconds.time()
+    def search(
+        self,
+        user_id: str,
+        query: str,
+        chat_id: str = None,
+        limit: int = Search.LIMIT.value,
+    ) -> List[SearchResult]:
+        """Messages of a user holding every term of a query, or any of them
+        if none holds them all.
+
+        Args:
+            user_id (str): user whose messages are searched.
+            query (str): free text, words are matched ignoring case and accents.
+            chat_id (str, optional): chat to search in, every chat if None.
+            limit (int, optional): max amount of results. Defaults to Search.LIMIT.value.
+
+        Raises:
+            s_e: SQLite error reading the index.
+
+        Returns:
+            List[SearchResult]: best ranked first.
+        """
+        terms = _TERM.findall(query)
+        if not terms:
+            return []
+        try:
+            connection = self._connection()
+            for any_term in (False, True):
+                rows = connection.execute(
+                    "SELECT user_id, chat_id, role, snippet(messages, 0, ?, ?, ?, ?), "
+                    f"timestamp, {RANK} FROM messages WHERE messages MATCH ? "
+                    f"ORDER BY {RANK}, rowid DESC LIMIT ?",
+                    (
+                        Search.SNIPPET_MARK.value,
+                        Search.SNIPPET_MARK.value,
+                        Search.SNIPPET_ELLIPSIS.value,
+                        Search.SNIPPET_TOKENS.value,
+                        self._match(user_id, terms, chat_id, any_term),
+                        limit,
+                    ),
+                ).fetchall()
+                if rows or len(terms) == 1:
+                    break
+        except sqlite3.Error as s_e:
+            logger.error(s_e)
+            raise s_e
+        return [
+            SearchResult(
+                user_id=row[0],
+                chat_id=row[1],
+                role=row[2],
+                snippet=row[3],
+                timestamp=row[4],
+                score=row[5],
+            )
+            for row in rows
+        ]
+
+    async def _run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if self.executor is None:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return await self.executor.run(func, *args, **kwargs)
+
+    async def asearch(
+        self,
+        user_id: str,
+        query: str,
+        chat_id: str = None,
+        limit: int = Search.LIMIT.value,
+    ) -> List[SearchResult]:
+        """Async version of search."""
+        return await self._run(self.search, user_id, query, chat_id, limit)
@@ -0,0 +1,34 @@
+"""
+Rebuild the search index from every ChatHistorial in storage, e.g. to add
+the chats stored before the index existed. Run from the directory holding db/:
+
+    python -m chat_bot.search.rebuild [index path]
+
+The storage is read from STORAGE_BACKEND, STORAGE_SQLITE_PATH and
+STORAGE_SHARD_LEVELS. The bot can keep running, the turns indexed meanwhile
+may be indexed twice.
+"""
+import os
+import sys
+
+from chat_bot.search.handler import SearchHandler
+from chat_bot.storage.factory import create_storage
+from chat_bot.utils.enums import Layout, StorageBackends
+from chat_bot.utils.logger import logger
+
+
+if __name__ == "__main__":
+    storage = create_storage(
+        backend=StorageBackends(
+            os.environ.get("STORAGE_BACKEND", StorageBackends.FILESYSTEM.value)
+        ),
+        sqlite_path=os.environ.get("STORAGE_SQLITE_PATH"),
+        shard_levels=int(
+            os.environ.get("STORAGE_SHARD_LEVELS", Layout.SHARD_LEVELS.value)
+        ),
+    )
+    search_handler = SearchHandler(*sys.argv[1:2])
+    messages = search_handler.rebuild(storage)
+    search_handler.close()
+    storage.close()
+    logger.info(f"{messages} messages indexed")
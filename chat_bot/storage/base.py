@@ -0,0 +1,72 @@
+"""
+Storage backend interface for Users and ChatHistorial
+"""
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Set, Tuple
+
+from chat_bot.models.historial import ChatHistorial
+from chat_bot.models.message import Message
+from chat_bot.models.user import User
+
+
+class StorageBackend(ABC):
+    """
+    Persistence used by UserHandler and ChatHistorialHandler. Backends only
+    deal with storage, caching and validation of the flow stay on the handlers.
+    """
+
+    @abstractmethod
+    def load_user(self, user_id: str) -> User | None:
+        """Load a User, None if it doesn't exist."""
+
+    @abstractmethod
+    def save_user(self, user: User) -> bool:
+        """Create or replace a User."""
+
+    @abstractmethod
+    def user_exists(self, user_id: str) -> bool:
+        """Check if a User exists."""
+
+    @abstractmethod
+    def iter_users(self) -> Iterator[User]:
+        """Iterate over every stored User."""
+
+    @abstractmethod
+    def load_chat(self, user_id: str, chat_id: str) -> ChatHistorial | None:
+        """Load a ChatHistorial, None if it doesn't exist."""
+
+    @abstractmethod
+    def create_chat(self, user_id: str, chat_historial: ChatHistorial) -> bool:
+        """Create a ChatHistorial, replacing it if it exists."""
+
+    @abstractmethod
+    def append_chat(
+        self,
+        user_id: str,
+        chat_id: str,
+        flags: Dict[str, bool],
+        messages: List[Message],
+    ) -> bool:
+        """Set flags and add messages at the end of an existing ChatHistorial.
+        Raises FileNotFoundError if the ChatHistorial doesn't exist."""
+
+    @abstractmethod
+    def rewrite_chat(self, user_id: str, chat_historial: ChatHistorial) -> bool:
+        """Replace the whole content of an existing ChatHistorial."""
+
+    @abstractmethod
+    def chat_exists(self, user_id: str, chat_id: str) -> bool:
+        """Check if a ChatHistorial exists."""
+
+    @abstractmethod
+    def iter_chats(self) -> Iterator[Tuple[str, str]]:
+        """Iterate over the (user_id, chat_id) of every stored ChatHistorial."""
+
+    def scan(self, workers: int = 1) -> Tuple[Set[str], Set[Tuple[str, str]]]:
+        """Ids of every stored User and (user_id, chat_id) of every stored
+        ChatHistorial, to build an ExistenceIndex. Backends override it when
+        they can list them faster, or in parallel with workers threads."""
+        return {user.id for user in self.iter_users()}, set(self.iter_chats())
+
+    def close(self) -> None:
+        """Release the resources held by the backend."""
@@ -0,0 +1,49 @@
+"""
+Storage backend selection
+"""
+from chat_bot.storage.base import StorageBackend
+from chat_bot.storage.filesystem import FileSystemStorage
+from chat_bot.storage.sqlite import SQLiteStorage
+from chat_bot.utils.enums import Layout, StorageBackends
+from chat_bot.utils.handlers.file_handler import JsonHandler, JsonLinesHandler
+
+
+def create_storage(
+    backend: StorageBackends = StorageBackends.FILESYSTEM,
+    file_handler: JsonHandler = None,
+    log_handler: JsonLinesHandler = None,
+    sqlite_path: str = None,
+    trusted_loads: bool = True,
+    shard_levels: int = Layout.SHARD_LEVELS.value,
+) -> StorageBackend:
+    """Build the configured storage backend.
+
+    Args:
+        backend (StorageBackends, optional): backend to build.
+                                             Defaults to StorageBackends.FILESYSTEM.
+        file_handler (JsonHandler, optional): json handler of the filesystem backend.
+        log_handler (JsonLinesHandler, optional): json lines handler of the
+                                                  filesystem backend.
+        sqlite_path (str, optional): database file of the sqlite backend,
+                                     db/chat_bot.sqlite3 if None.
+        trusted_loads (bool, optional): skip the validation of the stored
+                                        ChatHistorial. Defaults to True.
+        shard_levels (int, optional): hash prefix directories of the filesystem
+                                      backend. Defaults to Layout.SHARD_LEVELS.value.
+
+    Raises:
+        ValueError: Unknown backend.
+
+    Returns:
+        StorageBackend: the storage backend.
+    """
+    if backend == StorageBackends.FILESYSTEM:
+        return FileSystemStorage(
+            file_handler=file_handler,
+            log_handler=log_handler,
+            trusted_loads=trusted_loads,
+            shard_levels=shard_levels,
+        )
+    if backend == StorageBackends.SQLITE:
+        return SQLiteStorage(database=sqlite_path, trusted_loads=trusted_loads)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,350 @@
+"""
+Filesystem storage backend, one json file per User and one append-only json
+lines log per ChatHistorial under db/
+
+With shard_levels the Users and the chat directories of each user are kept
+under hash prefix directories of the user id (db/users/ab/cd/<user_id>.json,
+db/chats/ab/cd/<user_id>/<chat_id>.jsonl) so no directory grows unbounded.
+chat_bot.storage.layout moves the files of an existing db/ between layouts.
+
+Each ChatHistorial log has a header record with the chat ids, flags records
+with the flags turned on, a summary record if the chat was compacted and one
+record per message. Chats stored with the legacy one json document format are
+migrated to the log format the first time they are accessed, unless
+migrate_legacy is unset: they are then read as they are and left in place.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Set, Tuple
+from pydantic import ValidationError
+from chat_bot.models.historial import ChatHistorial
+from chat_bot.models.message import Message
+from chat_bot.models.user import User
+from chat_bot.storage.base import StorageBackend
+from chat_bot.utils.handlers.file_handler import JsonHandler, JsonLinesHandler
+from chat_bot.utils.handlers.path_handler import PathHandler
+from chat_bot.utils.enums import Directories, Extensions, Layout, RecordTypes
+from chat_bot.utils.logger import logger
+
+
+class FileSystemStorage(StorageBackend):
+    """
+    Stores Users and ChatHistorial as files under db/
+    """
+
+    def __init__(
+        self,
+        file_handler: JsonHandler = None,
+        path_handler: PathHandler = None,
+        log_handler: JsonLinesHandler = None,
+        root: str = Directories.CWD.value,
+        trusted_loads: bool = True,
+        shard_levels: int = Layout.SHARD_LEVELS.value,
+        migrate_legacy: bool = True,
+    ) -> None:
+        """
+        Args:
+            file_handler (JsonHandler, optional): handler of the User files.
+            path_handler (PathHandler, optional): path utilities.
+            log_handler (JsonLinesHandler, optional): handler of the ChatHistorial logs.
+            root (str, optional): directory holding db/. Defaults to Directories.CWD.value.
+            trusted_loads (bool, optional): build the ChatHistorial logs, written
+                by this backend, without validating them again. Defaults to True.
+            shard_levels (int, optional): hash prefix directories above the
+                files of each user. Defaults to Layout.SHARD_LEVELS.value.
+            migrate_legacy (bool, optional): convert the legacy json chats to
+                the log format when loaded, which removes the json files.
+                Defaults to True.
+        """
+        self.trusted_loads = trusted_loads
+        self.migrate_legacy = migrate_legacy
+        self.shard_levels = shard_levels
+        self.file_handler = file_handler or JsonHandler()
+        self.path_handler = path_handler or PathHandler()
+        self.log_handler = log_handler or JsonLinesHandler()
+        self.users_components = [root, Directories.DB.value, Directories.USERS.value]
+        self.chats_components = [root, Directories.DB.value, Directories.CHATS.value]
+
+    def _user_dir(self, user_id: str) -> Path:
+        return self.path_handler.compose_path(
+            self.users_components, shard_key=user_id, shard_levels=self.shard_levels
+        )
+
+    def _user_path(self, user_id: str) -> Path:
+        return self._user_dir(user_id) / f"{user_id}{Extensions.DOT_JSON.value}"
+
+    def _chat_dir(self, user_id: str) -> Path:
+        return (
+            self.path_handler.compose_path(
+                self.chats_components,
+                shard_key=user_id,
+                shard_levels=self.shard_levels,
+            )
+            / user_id
+        )
+
+    def _chat_path(self, user_id: str, chat_id: str) -> Path:
+        return self._chat_dir(user_id) / f"{chat_id}{Extensions.DOT_JSONL.value}"
+
+    def _legacy_chat_path(self, user_id: str, chat_id: str) -> Path:
+        return self._chat_dir(user_id) / f"{chat_id}{Extensions.DOT_JSON.value}"
+
+    def _leaf_directories(self, components: List[str]) -> List[Path]:
+        """Directories below the shard prefixes of db/users or db/chats."""
+        path = self.path_handler.compose_path(components)
+        if not path.is_dir():
+            return []
+        return self.path_handler.list_leaf_directories(path, self.shard_levels)
+
+    def _user_directories(self) -> List[Path]:
+        """Directories holding the User files."""
+        return self._leaf_directories(self.users_components)
+
+    def _chat_directories(self, executor: ThreadPoolExecutor = None) -> List[Path]:
+        """Directories holding the ChatHistorial logs, one per user, listed
+        on executor if given."""
+        leaves = self._leaf_directories(self.chats_components)
+        list_directories = (map if executor is None else executor.map)(
+            self.path_handler.list_directory_directories, leaves
+        )
+        return [
+            leaf / user_id
+            for leaf, user_ids in zip(leaves, list_directories)
+            for user_id in user_ids
+        ]
+
+    @staticmethod
+    def _chat_ids(chat_dir: Path) -> List[Tuple[str, str]]:
+        """(user_id, chat_id) of the ChatHistorial of a user directory."""
+        chat_ids = []
+        for file_name in PathHandler.list_directory_files(chat_dir):
+            for extension in (Extensions.DOT_JSONL, Extensions.DOT_JSON):
+                if file_name.endswith(extension.value):
+                    chat_ids.append((chat_dir.name, file_name[: -len(extension.value)]))
+                    break
+        return chat_ids
+
+    @staticmethod
+    def _to_records(chat_historial: ChatHistorial) -> List[Dict[str, Any]]:
+        """Serialize a ChatHistorial as log records.
+
+        Args:
+            chat_historial (ChatHistorial): ChatHistorial to serialize.
+
+        Returns:
+            List[Dict[str, Any]]: header record, summary record if any and
+                                  one record per message.
+        """
+        header = chat_historial.dict(exclude={"messages", "summary"})
+        records = [{"type": RecordTypes.HEADER.value, **header}]
+        if chat_historial.summary is not None:
+            records.append(
+                {
+                    "type": RecordTypes.SUMMARY.value,
+                    **chat_historial.summary.to_record(),
+                }
+            )
+        records.extend(
+            {"type": RecordTypes.MESSAGE.value, **message.to_record()}
+            for message in chat_historial.messages
+        )
+        return records
+
+    @staticmethod
+    def _from_records(
+        records: List[Dict[str, Any]], trusted: bool = False
+    ) -> ChatHistorial:
+        """Replay log records to build the ChatHistorial.
+
+        Args:
+            records (List[Dict[str, Any]]): records in the order they were written.
+            trusted (bool, optional): skip the validation. Defaults to False.
+
+        Raises:
+            v_e: Records don't comply with the allowed structure.
+
+        Returns:
+            ChatHistorial: ChatHistorial Model populated.
+        """
+        data = {"messages": []}
+        for record in records:
+            record_type = record.pop("type")
+            if record_type == RecordTypes.MESSAGE.value:
+                data["messages"].append(record)
+            elif record_type == RecordTypes.SUMMARY.value:
+                data["summary"] = record
+            else:
+                data.update(record)
+        if trusted:
+            return ChatHistorial.from_trusted(data)
+        return ChatHistorial.parse_obj(data)
+
+    def load_user(self, user_id: str) -> User | None:
+        user = None
+        try:
+            user = User.parse_file(self._user_path(user_id))
+        except FileNotFoundError as f_e:
+            logger.warning(f_e)
+        return user
+
+    def save_user(self, user: User) -> bool:
+        self.path_handler.create_directory(self._user_dir(user.id))
+        return self.file_handler.save(user.dict(), self._user_path(user.id))
+
+    def user_exists(self, user_id: str) -> bool:
+        return self.path_handler.file_exists(
+            self._user_dir(user_id), f"{user_id}{Extensions.DOT_JSON.value}"
+        )
+
+    def iter_users(self) -> Iterator[User]:
+        for users_path in self._user_directories():
+            for file_name in self.path_handler.list_directory_files(users_path):
+                if file_name.endswith(Extensions.DOT_JSON.value):
+                    yield User.parse_file(users_path / file_name)
+
+    def migrate(self, user_id: str, chat_id: str) -> bool:
+        """Convert a legacy json ChatHistorial to the log format.
+
+        Args:
+            user_id (str): user_id
+            chat_id (str): chat_id related to the user_id
+
+        Raises:
+            v_e: File loaded don't comply with the allowed structure.
+            o_e: OS Error over directory/file operations.
+
+        Returns:
+            bool: True if a legacy file was migrated, otherwise False
+        """
+        legacy_path = self._legacy_chat_path(user_id, chat_id)
+        if not legacy_path.is_file():
+            return False
+        try:
+            chat_historial = ChatHistorial.parse_file(legacy_path)
+            self.log_handler.save(
+                self._to_records(chat_historial), self._chat_path(user_id, chat_id)
+            )
+            legacy_path.unlink()
+            logger.info(f"ChatHistorial migrated to log format: {legacy_path}")
+        except ValidationError as v_e:
+            logger.error(v_e)
+            raise v_e
+        except OSError as o_e:
+            logger.error(o_e)
+            raise o_e
+        return True
+
+    def migrate_all(self) -> int:
+        """Convert every legacy json ChatHistorial under db/chats to the log format.
+
+        Returns:
+            int: amount of migrated chats.
+        """
+        migrated = 0
+        for chat_dir in self._chat_directories():
+            for file_name in self.path_handler.list_directory_files(chat_dir):
+                if file_name.endswith(Extensions.DOT_JSON.value):
+                    chat_id = file_name[: -len(Extensions.DOT_JSON.value)]
+                    migrated += self.migrate(chat_dir.name, chat_id)
+        return migrated
+
+    def repair_all(self) -> int:
+        """Cut the incomplete last line an interrupted append left on any
+        ChatHistorial log under db/chats. Run while the bot is stopped.
+
+        Returns:
+            int: amount of repaired chats.
+        """
+        repaired = 0
+        for chat_dir in self._chat_directories():
+            for file_name in self.path_handler.list_directory_files(chat_dir):
+                if file_name.endswith(Extensions.DOT_JSONL.value):
+                    repaired += self.log_handler.repair(chat_dir / file_name) > 0
+        return repaired
+
+    def load_chat(self, user_id: str, chat_id: str) -> ChatHistorial | None:
+        chat_historial = None
+        try:
+            chat_path = self._chat_path(user_id, chat_id)
+            if not chat_path.is_file():
+                if not self.migrate_legacy:
+                    return ChatHistorial.parse_file(
+                        self._legacy_chat_path(user_id, chat_id)
+                    )
+                self.migrate(user_id, chat_id)
+            chat_historial = self._from_records(
+                self.log_handler.load(chat_path), trusted=self.trusted_loads
+            )
+        except FileNotFoundError as f_e:
+            logger.warning(f_e)
+        return chat_historial
+
+    def create_chat(self, user_id: str, chat_historial: ChatHistorial) -> bool:
+        self.path_handler.create_directory(self._chat_dir(user_id))
+        return self.log_handler.save(
+            self._to_records(chat_historial),
+            self._chat_path(user_id, chat_historial.id),
+        )
+
+    def append_chat(
+        self,
+        user_id: str,
+        chat_id: str,
+        flags: Dict[str, bool],
+        messages: List[Message],
+    ) -> bool:
+        chat_path = self._chat_path(user_id, chat_id)
+        if not chat_path.is_file() and not self.migrate(user_id, chat_id):
+            raise FileNotFoundError(f"ChatHistorial not found: {chat_path}")
+        records = []
+        if flags:
+            records.append({"type": RecordTypes.FLAGS.value, **flags})
+        records.extend(
+            {"type": RecordTypes.MESSAGE.value, **message.to_record()}
+            for message in messages
+        )
+        if not records:
+            return True
+        return self.log_handler.append(records, chat_path)
+
+    def rewrite_chat(self, user_id: str, chat_historial: ChatHistorial) -> bool:
+        return self.log_handler.save(
+            self._to_records(chat_historial),
+            self._chat_path(user_id, chat_historial.id),
+        )
+
+    def chat_exists(self, user_id: str, chat_id: str) -> bool:
+        chat_path = self._chat_dir(user_id)
+        return self.path_handler.file_exists(
+            chat_path, f"{chat_id}{Extensions.DOT_JSONL.value}"
+        ) or self.path_handler.file_exists(
+            chat_path, f"{chat_id}{Extensions.DOT_JSON.value}"
+        )
+
+    def iter_chats(self) -> Iterator[Tuple[str, str]]:
+        for chat_dir in self._chat_directories():
+            yield from self._chat_ids(chat_dir)
+
+    def scan(self, workers: int = 1) -> Tuple[Set[str], Set[Tuple[str, str]]]:
+        """Lists the user and chat directories on workers threads, the files
+        are not read."""
+        suffix = Extensions.DOT_JSON.value
+        with ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="storage-scan"
+        ) as executor:
+            user_ids = {
+                file_name[: -len(suffix)]
+                for file_names in executor.map(
+                    self.path_handler.list_directory_files, self._user_directories()
+                )
+                for file_name in file_names
+                if file_name.endswith(suffix)
+            }
+            chat_ids = {
+                chat_id
+                for chat_dir_ids in executor.map(
+                    self._chat_ids, self._chat_directories(executor)
+                )
+                for chat_id in chat_dir_ids
+            }
+        return user_ids, chat_ids
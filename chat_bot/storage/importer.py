@@ -0,0 +1,56 @@
+"""
+Bulk import of the Users and ChatHistorial stored under db/ into the SQLite
+backend. Legacy json chats are read as well, without migrating them: db/ is
+only read and left as it is. Run from the directory holding db/:
+
+    python -m chat_bot.storage.importer [database path]
+
+The layout of db/ is read from STORAGE_SHARD_LEVELS.
+"""
+import os
+import sys
+from typing import Tuple
+
+from chat_bot.storage.base import StorageBackend
+from chat_bot.storage.filesystem import FileSystemStorage
+from chat_bot.storage.sqlite import SQLiteStorage
+from chat_bot.utils.enums import Layout
+from chat_bot.utils.logger import logger
+
+
+def import_storage(source: StorageBackend, target: StorageBackend) -> Tuple[int, int]:
+    """Copy every User and ChatHistorial from a backend to another. Items
+    already on the target are replaced. A FileSystemStorage source built
+    with migrate_legacy=False is left as it is.
+
+    Args:
+        source (StorageBackend): backend to read from.
+        target (StorageBackend): backend to write to.
+
+    Returns:
+        Tuple[int, int]: amount of imported users and chats.
+    """
+    imported_users = 0
+    imported_chats = 0
+    for user in source.iter_users():
+        imported_users += target.save_user(user)
+    for user_id, chat_id in source.iter_chats():
+        chat_historial = source.load_chat(user_id, chat_id)
+        if chat_historial is None:
+            logger.warning(f"Skipping unreadable chat: {user_id}/{chat_id}")
+            continue
+        imported_chats += target.create_chat(user_id, chat_historial)
+    return imported_users, imported_chats
+
+
+if __name__ == "__main__":
+    sqlite_storage = SQLiteStorage(*sys.argv[1:2])
+    filesystem_storage = FileSystemStorage(
+        shard_levels=int(
+            os.environ.get("STORAGE_SHARD_LEVELS", Layout.SHARD_LEVELS.value)
+        ),
+        migrate_legacy=False,
+    )
+    users, chats = import_storage(filesystem_storage, sqlite_storage)
+    sqlite_storage.close()
+    logger.info(f"{users} Users and {chats} ChatHistorial imported")
@@ -0,0 +1,111 @@
+"""
+In-memory index of the stored Users and ChatHistorial
+"""
+from threading import Lock
+from time import monotonic
+from typing import Set, Tuple
+
+from chat_bot.storage.base import StorageBackend
+from chat_bot.utils.enums import Scans
+from chat_bot.utils.logger import logger
+
+
+class ExistenceIndex:
+    """
+    Ids of the known Users and (user_id, chat_id) of the known ChatHistorial,
+    answering the exists checks of the handlers from memory. It is built once
+    on start scanning the storage and kept current by the handlers on create.
+
+    An authoritative index, the only writer of the storage, also answers the
+    unknown ids as missing. Otherwise, e.g. sharded workers sharing db/, an
+    unknown id is checked on storage and learnt if found.
+    """
+
+    def __init__(
+        self, authoritative: bool = True, workers: int = Scans.WORKERS.value
+    ) -> None:
+        """
+        Args:
+            authoritative (bool, optional): answer unknown ids as missing once
+                                            built. Defaults to True.
+            workers (int, optional): threads listing the storage on build.
+                                     Defaults to Scans.WORKERS.value.
+        """
+        self.authoritative = authoritative
+        self.workers = workers
+        self._users: Set[str] = set()
+        self._chats: Set[Tuple[str, str]] = set()
+        self._ready = False
+        self._lock = Lock()
+
+    @property
+    def ready(self) -> bool:
+        """Check if the index was built."""
+        return self._ready
+
+    def build(self, storage: StorageBackend) -> None:
+        """Add every stored User and ChatHistorial. The ones added meanwhile
+        by the handlers are kept.
+
+        Args:
+            storage (StorageBackend): storage to scan.
+        """
+        start = monotonic()
+        users, chats = storage.scan(self.workers)
+        with self._lock:
+            self._users |= users
+            self._chats |= chats
+            self._ready = True
+        logger.info(
+            f"Existence index built with {len(users)} users and {len(chats)} "
+            f"chats in {monotonic() - start:.2f}s"
+        )
+
+    def add_user(self, user_id: str) -> None:
+        """Index a User."""
+        self._users.add(user_id)
+
+    def add_chat(self, user_id: str, chat_id: str) -> None:
+        """Index a ChatHistorial."""
+        self._chats.add((user_id, chat_id))
+
+    def user_exists(self, user_id: str) -> bool | None:
+        """Check if a User exists.
+
+        Args:
+            user_id (str): user_id
+
+        Returns:
+            bool | None: True if indexed, False if it isn't and the index is
+                authoritative and built, None if storage must be checked.
+        """
+        if user_id in self._users:
+            return True
+        if self.authoritative and self._ready:
+            return False
+        return None
+
+    def chat_exists(self, user_id: str, chat_id: str) -> bool | None:
+        """Check if a ChatHistorial exists.
+
+        Args:
+            user_id (str): user_id
+            chat_id (str): chat_id
+
+        Returns:
+            bool | None: True if indexed, False if it isn't and the index is
+                authoritative and built, None if storage must be checked.
+        """
+        if (user_id, chat_id) in self._chats:
+            return True
+        if self.authoritative and self._ready:
+            return False
+        return None
+
+    def users(self) -> int:
+        """Amount of indexed Users."""
+        return len(self._users)
+
+    def chats(self) -> int:
+        """Amount of indexed ChatHistorial."""
+        return len(self._chats)
@@ -0,0 +1,107 @@
+"""
+Move the Users and ChatHistorial under db/ between directory layouts, e.g.
+from the flat one to two levels of hash prefix directories. Stop the bot
+before and set STORAGE_SHARD_LEVELS to the new amount of levels after. Run
+from the directory holding db/:
+
+    python -m chat_bot.storage.layout --to-levels 2 [--from-levels 0]
+
+Files are renamed, not copied, and the ones already on their new place are
+skipped, so an interrupted run can be resumed.
+"""
+import argparse
+from pathlib import Path
+from typing import Tuple
+
+from chat_bot.storage.filesystem import FileSystemStorage
+from chat_bot.utils.enums import Directories, Extensions, Layout
+from chat_bot.utils.logger import logger
+
+
+def _move(source: Path, target: Path) -> bool:
+    """Rename source to target unless target exists."""
+    if target.exists():
+        logger.warning(f"Skipping {source}, {target} already exists")
+        return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    source.rename(target)
+    return True
+
+
+def _remove_empty_directories(path: Path, levels: int) -> None:
+    """Remove the prefix directories left empty, up to levels deep."""
+    if levels <= 0 or not path.is_dir():
+        return
+    for directory in path.iterdir():
+        if directory.is_dir():
+            _remove_empty_directories(directory, levels - 1)
+            if not any(directory.iterdir()):
+                directory.rmdir()
+
+
+def relayout(
+    from_levels: int,
+    to_levels: int,
+    root: str = Directories.CWD.value,
+) -> Tuple[int, int]:
+    """Move every User file and every chat directory from a layout to another.
+
+    Args:
+        from_levels (int): hash prefix directories of the current layout.
+        to_levels (int): hash prefix directories of the new layout.
+        root (str, optional): directory holding db/. Defaults to Directories.CWD.value.
+
+    Raises:
+        o_e: OS Error over directory/file operations.
+
+    Returns:
+        Tuple[int, int]: amount of moved users and chat directories.
+    """
+    source = FileSystemStorage(root=root, shard_levels=from_levels)
+    target = FileSystemStorage(root=root, shard_levels=to_levels)
+    moved_users = 0
+    moved_chats = 0
+    if from_levels == to_levels:
+        return moved_users, moved_chats
+    # pylint: disable=protected-access
+    try:
+        """Listed before moving, the new layout may share directories"""
+        user_files = [
+            users_path / file_name
+            for users_path in source._user_directories()
+            for file_name in source.path_handler.list_directory_files(users_path)
+            if file_name.endswith(Extensions.DOT_JSON.value)
+        ]
+        chat_directories = source._chat_directories()
+        for user_file in user_files:
+            user_id = user_file.name[: -len(Extensions.DOT_JSON.value)]
+            moved_users += _move(user_file, target._user_path(user_id))
+        for chat_dir in chat_directories:
+            moved_chats += _move(chat_dir, target._chat_dir(chat_dir.name))
+        for components in (source.users_components, source.chats_components):
+            _remove_empty_directories(
+                source.path_handler.compose_path(components), from_levels
+            )
+    except OSError as o_e:
+        logger.error(o_e)
+        raise o_e
+    return moved_users, moved_chats
+
+
+def parse_args() -> argparse.Namespace:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--from-levels", type=int, default=Layout.SHARD_LEVELS.value)
+    parser.add_argument("--to-levels", type=int, required=True)
+    parser.add_argument("--root", default=Directories.CWD.value)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    users, chats = relayout(
+        arguments.from_levels, arguments.to_levels, root=arguments.root
+    )
+    logger.info(f"{users} Users and {chats} chat directories moved")
@@ -0,0 +1,402 @@
+"""
+Incremental snapshots of db/ into restore/, and restores of db/ from them.
+Run from the directory holding db/:
+
+    python -m chat_bot.storage.snapshot create [--keep 7]
+    python -m chat_bot.storage.snapshot list
+    python -m chat_bot.storage.snapshot restore [snapshot id] [--verify]
+
+Every file content is stored once under restore/objects, named by its sha256.
+A snapshot is a manifest plus a db/ tree of hard links to those objects under
+restore/snapshots/<snapshot id>, so an unchanged file costs a directory entry.
+Only the files whose size, mtime or inode changed since the previous snapshot
+are read and hashed again.
+
+Snapshots are taken while the bot runs. Every file under db/ is listed and
+stat-ed first, the cut, and copied after. The ChatHistorial and usage logs
+are append-only, each one is copied up to the size it had on the cut and to
+its last complete line, so the logs are taken as they were on the cut. The
+User files are replaced atomically by renames and taken whole, as are the
+logs rewritten meanwhile. SQLite databases are copied through the backup API.
+Appends still buffered by the group commit writer of the bot are left out.
+
+Restores rebuild db/ next to it and swap it in with a rename, the replaced
+db/ is kept under restore/replaced. Stop the bot before restoring.
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from chat_bot.utils.enums import Directories, Extensions, Scans, Snapshots
+from chat_bot.utils.handlers.file_handler import JsonHandler, fsync_directory
+from chat_bot.utils.logger import logger
+
+"""Files left by SQLite beside a database, covered by its backup"""
+_SQLITE_SUFFIXES = ("-wal", "-shm", "-journal")
+
+
+class SnapshotManager:
+    """
+    Creates, lists, prunes and restores the snapshots of db/
+    """
+
+    def __init__(
+        self,
+        root: str = Directories.CWD.value,
+        workers: int = Scans.WORKERS.value,
+        file_handler: JsonHandler = None,
+    ) -> None:
+        """
+        Args:
+            root (str, optional): directory holding db/ and restore/.
+                                  Defaults to Directories.CWD.value.
+            workers (int, optional): threads reading and copying files.
+                                     Defaults to Scans.WORKERS.value.
+            file_handler (JsonHandler, optional): handler of the manifests.
+        """
+        self.root = Path(root)
+        self.db_path = self.root / Directories.DB.value
+        restore_path = self.root / Directories.RESTORE.value
+        self.objects_path = restore_path / Directories.OBJECTS.value
+        self.snapshots_path = restore_path / Directories.SNAPSHOTS.value
+        self.replaced_path = restore_path / Directories.REPLACED.value
+        self.workers = max(workers, 1)
+        self.file_handler = file_handler or JsonHandler()
+
+    @staticmethod
+    def _now_id() -> str:
+        return datetime.now(timezone.utc).strftime(Snapshots.ID_FORMAT.value)
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects_path / digest[:2] / digest
+
+    def _cut(self) -> Dict[str, os.stat_result]:
+        """Stat every file under db/, skipping the temporary files of the
+        atomic writes and the side files of SQLite."""
+        cut = {}
+        for directory, _, file_names in os.walk(self.db_path):
+            for file_name in file_names:
+                if file_name.startswith(".") or file_name.endswith(_SQLITE_SUFFIXES):
+                    continue
+                path = Path(directory) / file_name
+                try:
+                    cut[path.relative_to(self.db_path).as_posix()] = path.stat()
+                except FileNotFoundError:
+                    """Removed since listed, e.g. a migrated legacy chat"""
+                    continue
+        return cut
+
+    def _store(self, data: bytes) -> Tuple[str, bool]:
+        """Store a content under restore/objects unless already there.
+
+        Args:
+            data (bytes): file content.
+
+        Returns:
+            Tuple[str, bool]: sha256 of the content and if it was new.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = self._object_path(digest)
+        if object_path.exists():
+            return digest, False
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=object_path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(temp_path, Snapshots.OBJECT_MODE.value)
+            os.replace(temp_path, object_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return digest, True
+
+    @staticmethod
+    def _read_log(path: Path, cut_stat: os.stat_result) -> bytes:
+        """Content of an append-only log as it was on the cut."""
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_ino == cut_stat.st_ino:
+                data = file.read(cut_stat.st_size)
+            else:
+                """Rewritten since the cut, the new content is taken"""
+                data = file.read()
+        """An append in progress may have left half a line"""
+        return data[: data.rfind(b"\n") + 1]
+
+    @staticmethod
+    def _read_sqlite(path: Path) -> bytes:
+        """Consistent copy of a SQLite database, including its WAL."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            backup_path = Path(temp_dir) / path.name
+            source = sqlite3.connect(path)
+            target = sqlite3.connect(backup_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            return backup_path.read_bytes()
+
+    def _snapshot_file(
+        self,
+        relative_path: str,
+        cut_stat: os.stat_result,
+        previous: Dict[str, Any] | None,
+        snapshot_path: Path,
+    ) -> Tuple[Dict[str, Any], int]:
+        """Store a file if it changed and hard link it into the snapshot.
+
+        Returns:
+            Tuple[Dict[str, Any], int]: manifest entry and bytes of new content.
+        """
+        path = self.db_path / relative_path
+        entry = {
+            "size": cut_stat.st_size,
+            "mtime_ns": cut_stat.st_mtime_ns,
+            "inode": cut_stat.st_ino,
+        }
+        new_bytes = 0
+        """A database can change on its WAL only, it is always backed up"""
+        unchanged = (
+            previous is not None
+            and not relative_path.endswith(Extensions.DOT_SQLITE3.value)
+            and all(previous.get(field) == value for field, value in entry.items())
+            and self._object_path(previous["hash"]).exists()
+        )
+        if unchanged:
+            entry["hash"] = previous["hash"]
+        else:
+            if relative_path.endswith(Extensions.DOT_SQLITE3.value):
+                data = self._read_sqlite(path)
+            elif relative_path.endswith(Extensions.DOT_JSONL.value):
+                data = self._read_log(path, cut_stat)
+            else:
+                data = path.read_bytes()
+            entry["hash"], is_new = self._store(data)
+            new_bytes = len(data) if is_new else 0
+        link_path = snapshot_path / Directories.DB.value / relative_path
+        link_path.parent.mkdir(parents=True, exist_ok=True)
+        os.link(self._object_path(entry["hash"]), link_path)
+        return entry, new_bytes
+
+    def snapshots(self) -> List[str]:
+        """Ids of the complete snapshots, from the oldest."""
+        if not self.snapshots_path.is_dir():
+            return []
+        return sorted(
+            snapshot_path.name
+            for snapshot_path in self.snapshots_path.iterdir()
+            if (snapshot_path / Snapshots.MANIFEST.value).is_file()
+        )
+
+    def load_manifest(self, snapshot_id: str) -> Dict[str, Any]:
+        """Manifest of a snapshot.
+
+        Args:
+            snapshot_id (str): snapshot id.
+
+        Raises:
+            f_e: Snapshot not found.
+
+        Returns:
+            Dict[str, Any]: id, previous snapshot id and files by path under db/.
+        """
+        return self.file_handler.load(
+            self.snapshots_path / snapshot_id / Snapshots.MANIFEST.value
+        )
+
+    def create(self, keep: int = Snapshots.KEEP.value) -> str:
+        """Snapshot db/, storing only the files changed since the last snapshot.
+
+        Args:
+            keep (int, optional): snapshots kept after this one is taken, all if 0.
+                                  Defaults to Snapshots.KEEP.value.
+
+        Raises:
+            o_e: OS Error over directory/file operations.
+
+        Returns:
+            str: id of the new snapshot.
+        """
+        snapshot_id = self._now_id()
+        existing = self.snapshots()
+        previous_id = existing[-1] if existing else None
+        previous_files = self.load_manifest(previous_id)["files"] if previous_id else {}
+        """Published by a rename once complete, listings skip dot directories"""
+        staging_path = self.snapshots_path / f".{snapshot_id}"
+        try:
+            staging_path.mkdir(parents=True)
+            cut = self._cut()
+            with ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="snapshot"
+            ) as executor:
+                results = list(
+                    executor.map(
+                        lambda item: self._snapshot_file(
+                            item[0], item[1], previous_files.get(item[0]), staging_path
+                        ),
+                        cut.items(),
+                    )
+                )
+            files = {
+                relative_path: entry for relative_path, (entry, _) in zip(cut, results)
+            }
+            manifest = {"id": snapshot_id, "previous": previous_id, "files": files}
+            self.file_handler.save(manifest, staging_path / Snapshots.MANIFEST.value)
+            os.rename(staging_path, self.snapshots_path / snapshot_id)
+            fsync_directory(self.snapshots_path)
+        except OSError as o_e:
+            logger.error(o_e)
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise o_e
+        new_bytes = sum(new for _, new in results)
+        logger.info(
+            f"Snapshot {snapshot_id} of {len(files)} files, "
+            f"{new_bytes} bytes of new content"
+        )
+        if keep > 0:
+            self.prune(keep)
+        return snapshot_id
+
+    def prune(self, keep: int) -> Tuple[int, int]:
+        """Remove the oldest snapshots and the contents only they referenced.
+
+        Args:
+            keep (int): amount of recent snapshots to keep.
+
+        Returns:
+            Tuple[int, int]: amount of removed snapshots and contents.
+        """
+        existing = self.snapshots()
+        removed = existing[: max(len(existing) - max(keep, 1), 0)]
+        for snapshot_id in removed:
+            shutil.rmtree(self.snapshots_path / snapshot_id)
+        removed_objects = 0
+        if self.objects_path.is_dir():
+            """A content linked by no snapshot has a single link left"""
+            for directory, _, file_names in os.walk(self.objects_path):
+                for file_name in file_names:
+                    object_path = Path(directory) / file_name
+                    if object_path.stat().st_nlink == 1:
+                        object_path.unlink()
+                        removed_objects += 1
+        logger.info(f"Pruned {len(removed)} snapshots and {removed_objects} contents")
+        return len(removed), removed_objects
+
+    def _restore_file(
+        self, relative_path: str, entry: Dict[str, Any], db_path: Path, verify: bool
+    ) -> None:
+        object_path = self._object_path(entry["hash"])
+        if verify:
+            digest = hashlib.sha256(object_path.read_bytes()).hexdigest()
+            if digest != entry["hash"]:
+                raise ValueError(f"Corrupted snapshot content: {object_path}")
+        target_path = db_path / relative_path
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        """A copy, the bot appends to its files and the contents are shared"""
+        shutil.copyfile(object_path, target_path)
+
+    def restore(self, snapshot_id: str = None, verify: bool = False) -> int:
+        """Rebuild db/ from a snapshot. The current db/ is moved under
+        restore/replaced.
+
+        Args:
+            snapshot_id (str, optional): snapshot to restore, the latest if None.
+            verify (bool, optional): check the hash of every content.
+                                     Defaults to False.
+
+        Raises:
+            f_e: No snapshot to restore.
+            v_e: A content doesn't match its hash.
+            o_e: OS Error over directory/file operations.
+
+        Returns:
+            int: amount of restored files.
+        """
+        existing = self.snapshots()
+        snapshot_id = snapshot_id or (existing[-1] if existing else None)
+        if snapshot_id not in existing:
+            f_e = FileNotFoundError(f"Snapshot not found: {snapshot_id}")
+            logger.error(f_e)
+            raise f_e
+        files = self.load_manifest(snapshot_id)["files"]
+        staging_path = self.root / f".{Directories.DB.value}.{snapshot_id}"
+        try:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            staging_path.mkdir(parents=True)
+            with ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="restore"
+            ) as executor:
+                list(
+                    executor.map(
+                        lambda item: self._restore_file(
+                            item[0], item[1], staging_path, verify
+                        ),
+                        files.items(),
+                    )
+                )
+            if self.db_path.exists():
+                replaced_path = self.replaced_path / self._now_id()
+                replaced_path.mkdir(parents=True)
+                os.rename(self.db_path, replaced_path / Directories.DB.value)
+                logger.info(f"Previous db/ moved to {replaced_path}")
+            os.rename(staging_path, self.db_path)
+            fsync_directory(self.root)
+        except ValueError as v_e:
+            logger.error(v_e)
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise v_e
+        except OSError as o_e:
+            logger.error(o_e)
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise o_e
+        logger.info(f"Restored {len(files)} files from snapshot {snapshot_id}")
+        return len(files)
+
+
+def parse_args() -> argparse.Namespace:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--root", default=Directories.CWD.value)
+    parser.add_argument("--workers", type=int, default=Scans.WORKERS.value)
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="snapshot db/")
+    create.add_argument(
+        "--keep",
+        type=int,
+        default=Snapshots.KEEP.value,
+        help="recent snapshots to keep, all if 0",
+    )
+    commands.add_parser("list", help="list the snapshots")
+    restore = commands.add_parser("restore", help="rebuild db/ from a snapshot")
+    restore.add_argument("snapshot_id", nargs="?", help="the latest if not set")
+    restore.add_argument("--verify", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    manager = SnapshotManager(root=arguments.root, workers=arguments.workers)
+    try:
+        if arguments.command == "create":
+            print(manager.create(keep=arguments.keep))
+        elif arguments.command == "list":
+            for listed_id in manager.snapshots():
+                print(listed_id)
+        else:
+            manager.restore(arguments.snapshot_id, verify=arguments.verify)
+    except (OSError, ValueError):
+        sys.exit(1)
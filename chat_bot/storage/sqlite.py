@@ -0,0 +1,270 @@
+"""
+SQLite storage backend, Users and ChatHistorial headers as rows and one row
+per message, indexed by user and chat
+"""
+import sqlite3
+from pathlib import Path
+from threading import Lock, local
+from typing import Dict, Iterator, List, Set, Tuple
+
+from chat_bot.models.historial import ChatHistorial
+from chat_bot.models.message import Message
+from chat_bot.models.user import User
+from chat_bot.storage.base import StorageBackend
+from chat_bot.utils.enums import Directories, Extensions
+from chat_bot.utils.logger import logger
+from chat_bot.utils.serialization import dumps, loads
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    display_name TEXT NOT NULL,
+    discriminator TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chats (
+    user_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    message_to_react_id TEXT NOT NULL,
+    system_profile_set INTEGER NOT NULL DEFAULT 0,
+    is_reaction_positive INTEGER NOT NULL DEFAULT 0,
+    reacted_to_profiling_step INTEGER NOT NULL DEFAULT 0,
+    summary TEXT,
+    PRIMARY KEY (user_id, chat_id)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    name TEXT,
+    tokens INTEGER
+);
+CREATE INDEX IF NOT EXISTS messages_by_chat ON messages (user_id, chat_id, id);
+"""
+
+FLAGS = ("system_profile_set", "is_reaction_positive", "reacted_to_profiling_step")
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Stores Users and ChatHistorial on an embedded SQLite database in WAL
+    mode. Each thread gets its own connection, all of them are closed by close.
+    """
+
+    def __init__(
+        self,
+        database: str | Path = None,
+        synchronous: str = "NORMAL",
+        trusted_loads: bool = True,
+    ) -> None:
+        self.database = Path(
+            database
+            or Path(Directories.CWD.value)
+            / Directories.DB.value
+            / f"{Directories.DATABASE.value}{Extensions.DOT_SQLITE3.value}"
+        )
+        """Rows are written by this backend, they are not validated again"""
+        self.trusted_loads = trusted_loads
+        self.synchronous = synchronous
+        self._local = local()
+        self._connections: Set[sqlite3.Connection] = set()
+        self._connections_lock = Lock()
+        self.database.parent.mkdir(parents=True, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        """A connection closed by close is opened again"""
+        if connection is None or connection not in self._connections:
+            """Only its thread uses it, close runs on another one"""
+            connection = sqlite3.connect(
+                self.database, timeout=30, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"PRAGMA synchronous={self.synchronous}")
+            with self._connections_lock:
+                self._connections.add(connection)
+            self._local.connection = connection
+        return connection
+
+    def close(self) -> None:
+        """Close the connections of every thread, the executor ones included."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, set()
+        for connection in connections:
+            connection.close()
+        self._local.connection = None
+
+    def load_user(self, user_id: str) -> User | None:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT id, name, display_name, discriminator FROM users WHERE id = ?",
+                (user_id,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            logger.warning(f"User not found: {user_id}")
+            return None
+        return User(id=row[0], name=row[1], display_name=row[2], discriminator=row[3])
+
+    def save_user(self, user: User) -> bool:
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO users (id, name, display_name, discriminator) "
+                "VALUES (?, ?, ?, ?)",
+                (user.id, user.name, user.display_name, user.discriminator),
+            )
+        return True
+
+    def user_exists(self, user_id: str) -> bool:
+        return (
+            self._connection()
+            .execute("SELECT 1 FROM users WHERE id = ?", (user_id,))
+            .fetchone()
+            is not None
+        )
+
+    def iter_users(self) -> Iterator[User]:
+        for row in self._connection().execute(
+            "SELECT id, name, display_name, discriminator FROM users"
+        ):
+            yield User(
+                id=row[0], name=row[1], display_name=row[2], discriminator=row[3]
+            )
+
+    def load_chat(self, user_id: str, chat_id: str) -> ChatHistorial | None:
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT message_to_react_id, system_profile_set, is_reaction_positive, "
+            "reacted_to_profiling_step, summary FROM chats "
+            "WHERE user_id = ? AND chat_id = ?",
+            (user_id, chat_id),
+        ).fetchone()
+        if row is None:
+            logger.warning(f"ChatHistorial not found: {user_id}/{chat_id}")
+            return None
+        messages = [
+            {"role": role, "content": content, "name": name, "tokens": tokens}
+            for role, content, name, tokens in connection.execute(
+                "SELECT role, content, name, tokens FROM messages "
+                "WHERE user_id = ? AND chat_id = ? ORDER BY id",
+                (user_id, chat_id),
+            )
+        ]
+        data = {
+            "id": chat_id,
+            "message_to_react_id": row[0],
+            "system_profile_set": bool(row[1]),
+            "is_reaction_positive": bool(row[2]),
+            "reacted_to_profiling_step": bool(row[3]),
+            "summary": loads(row[4]) if row[4] else None,
+            "messages": messages,
+        }
+        if self.trusted_loads:
+            return ChatHistorial.from_trusted(data)
+        return ChatHistorial.parse_obj(data)
+
+    @staticmethod
+    def _insert_messages(
+        connection: sqlite3.Connection,
+        user_id: str,
+        chat_id: str,
+        messages: List[Message],
+    ) -> None:
+        connection.executemany(
+            "INSERT INTO messages (user_id, chat_id, role, content, name, tokens) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    user_id,
+                    chat_id,
+                    message.role,
+                    message.content,
+                    message.name,
+                    message.tokens,
+                )
+                for message in messages
+            ],
+        )
+
+    def _write_chat(
+        self, connection: sqlite3.Connection, user_id: str, chat: ChatHistorial
+    ) -> None:
+        connection.execute(
+            "INSERT OR REPLACE INTO chats (user_id, chat_id, message_to_react_id, "
+            "system_profile_set, is_reaction_positive, reacted_to_profiling_step, "
+            "summary) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                user_id,
+                chat.id,
+                chat.message_to_react_id,
+                chat.system_profile_set,
+                chat.is_reaction_positive,
+                chat.reacted_to_profiling_step,
+                dumps(chat.summary.to_record()) if chat.summary is not None else None,
+            ),
+        )
+        connection.execute(
+            "DELETE FROM messages WHERE user_id = ? AND chat_id = ?",
+            (user_id, chat.id),
+        )
+        self._insert_messages(connection, user_id, chat.id, chat.messages)
+
+    def create_chat(self, user_id: str, chat_historial: ChatHistorial) -> bool:
+        with self._connection() as connection:
+            self._write_chat(connection, user_id, chat_historial)
+        return True
+
+    def append_chat(
+        self,
+        user_id: str,
+        chat_id: str,
+        flags: Dict[str, bool],
+        messages: List[Message],
+    ) -> bool:
+        with self._connection() as connection:
+            if not self.chat_exists(user_id, chat_id):
+                raise FileNotFoundError(f"ChatHistorial not found: {user_id}/{chat_id}")
+            if flags:
+                assignments = ", ".join(
+                    f"{name} = ?" for name in flags if name in FLAGS
+                )
+                connection.execute(
+                    f"UPDATE chats SET {assignments} WHERE user_id = ? AND chat_id = ?",
+                    (
+                        *[value for name, value in flags.items() if name in FLAGS],
+                        user_id,
+                        chat_id,
+                    ),
+                )
+            self._insert_messages(connection, user_id, chat_id, messages)
+        return True
+
+    def rewrite_chat(self, user_id: str, chat_historial: ChatHistorial) -> bool:
+        with self._connection() as connection:
+            self._write_chat(connection, user_id, chat_historial)
+        return True
+
+    def chat_exists(self, user_id: str, chat_id: str) -> bool:
+        return (
+            self._connection()
+            .execute(
+                "SELECT 1 FROM chats WHERE user_id = ? AND chat_id = ?",
+                (user_id, chat_id),
+            )
+            .fetchone()
+            is not None
+        )
+
+    def iter_chats(self) -> Iterator[Tuple[str, str]]:
+        yield from self._connection().execute("SELECT user_id, chat_id FROM chats")
+
+    def scan(self, workers: int = 1) -> Tuple[Set[str], Set[Tuple[str, str]]]:
+        connection = self._connection()
+        return {row[0] for row in connection.execute("SELECT id FROM users")}, set(
+            connection.execute("SELECT user_id, chat_id FROM chats")
+        )
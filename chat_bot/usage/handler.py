@@ -0,0 +1,209 @@
+"""
+Usage handler class to record and query the usage of the OpenAI API
+
+Every turn is appended to a json lines log per day under db/usage through a
+group commit writer, so recording never waits on the disk. Counters per
+user, channel and guild and per day are kept in memory and rebuilt from
+the logs the first time a day is accessed.
+"""
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Any, Callable, Dict, List, Set, Tuple, TypeVar
+
+from chat_bot.models.usage import UsageRecord, UsageTotals
+from chat_bot.utils.enums import (
+    Directories,
+    GroupCommit,
+    Extensions,
+    UsageScopes,
+)
+from chat_bot.utils.executor import BlockingIOExecutor
+from chat_bot.utils.handlers.file_handler import GroupCommitWriter, JsonLinesHandler
+from chat_bot.utils.handlers.path_handler import PathHandler
+
+T = TypeVar("T")
+
+
+def usage_day(timestamp: float) -> date:
+    """UTC day of a timestamp"""
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).date()
+
+
+class UsageHandler:
+    """
+    Class to record UsageRecord and query the aggregated UsageTotals.
+    The a-prefixed methods run on an executor, to be awaited from the event loop.
+    """
+
+    def __init__(
+        self,
+        writer: GroupCommitWriter = None,
+        path_handler: PathHandler = None,
+        executor: BlockingIOExecutor = None,
+        root: str = Directories.CWD.value,
+        partition: str = None,
+    ) -> None:
+        """
+        Args:
+            writer (GroupCommitWriter, optional): writer buffering the appends,
+                one flushing every GroupCommit.USAGE_FLUSH_INTERVAL seconds if None.
+            path_handler (PathHandler, optional): path utilities.
+            executor (BlockingIOExecutor, optional): executor of the async methods.
+            root (str, optional): directory holding db/. Defaults to Directories.CWD.value.
+            partition (str, optional): subdirectory of db/usage, for processes
+                recording usage side by side. Defaults to None.
+        """
+        self.writer = writer or GroupCommitWriter(
+            interval=GroupCommit.USAGE_FLUSH_INTERVAL.value, sync_directory=False
+        )
+        self.log_handler = JsonLinesHandler(writer=self.writer)
+        self.path_handler = path_handler or PathHandler()
+        self.executor = executor
+        self.path_components = [root, Directories.DB.value, Directories.USAGE.value]
+        if partition is not None:
+            self.path_components.append(partition)
+        self._totals: Dict[Tuple[str, str, date], UsageTotals] = {}
+        self._loaded_days: Set[date] = set()
+        self._lock = Lock()
+
+    def start(self) -> None:
+        """Load the counters of today and start flushing the buffered appends."""
+        self._ensure_loaded(usage_day(time()))
+        self.writer.start()
+
+    def stop(self) -> None:
+        """Flush the buffered appends and stop."""
+        self.writer.stop()
+
+    def _day_path(self, day: date) -> Path:
+        return self.path_handler.compose_path(
+            [*self.path_components, f"{day.isoformat()}{Extensions.DOT_JSONL.value}"]
+        )
+
+    @staticmethod
+    def _scopes(record: UsageRecord) -> List[Tuple[str, str]]:
+        scopes = [
+            (UsageScopes.USER.value, record.user_id),
+            (UsageScopes.CHANNEL.value, record.chat_id),
+        ]
+        if record.guild_id is not None:
+            scopes.append((UsageScopes.GUILD.value, record.guild_id))
+        return scopes
+
+    def _count(self, record: UsageRecord, day: date) -> None:
+        """Add a record to the counters, the lock must be held."""
+        for scope, scope_id in self._scopes(record):
+            totals = self._totals.get((scope, scope_id, day))
+            if totals is None:
+                totals = self._totals[(scope, scope_id, day)] = UsageTotals()
+            totals.add(record)
+
+    def _ensure_loaded(self, day: date) -> None:
+        """Replay the log of a day into the counters, once."""
+        with self._lock:
+            if day in self._loaded_days:
+                return
+            self._loaded_days.add(day)
+            self.path_handler.create_directory(
+                self.path_handler.compose_path(self.path_components)
+            )
+            day_path = self._day_path(day)
+            if day_path.is_file():
+                for data in self.log_handler.load(day_path):
+                    self._count(UsageRecord.parse_obj(data), day)
+
+    def record(self, record: UsageRecord) -> None:
+        """Count a turn and queue it on the log of its day. Reads the log the
+        first time a day is recorded, see arecord.
+
+        Args:
+            record (UsageRecord): usage of the turn.
+        """
+        day = usage_day(record.timestamp)
+        self._ensure_loaded(day)
+        with self._lock:
+            self._count(record, day)
+        self.log_handler.append([record.dict()], self._day_path(day))
+
+    async def arecord(self, record: UsageRecord) -> None:
+        """Async version of record, the log of a new day is read out of the
+        event loop and the append is only queued."""
+        day = usage_day(record.timestamp)
+        if day not in self._loaded_days:
+            await self._run(self._ensure_loaded, day)
+        self.record(record)
+
+    @staticmethod
+    def _days(start: date, end: date) -> List[date]:
+        return [
+            start + timedelta(days=offset) for offset in range((end - start).days + 1)
+        ]
+
+    def query(
+        self, scope: UsageScopes, scope_id: str, start: date, end: date = None
+    ) -> UsageTotals:
+        """Usage of a user, channel or guild over a range of days.
+
+        Args:
+            scope (UsageScopes): kind of scope_id.
+            scope_id (str): user, channel or guild id.
+            start (date): first UTC day.
+            end (date, optional): last UTC day, included. Defaults to start.
+
+        Returns:
+            UsageTotals: aggregated usage.
+        """
+        result = UsageTotals()
+        for day in self._days(start, end or start):
+            self._ensure_loaded(day)
+            with self._lock:
+                totals = self._totals.get((scope.value, scope_id, day))
+                if totals is not None:
+                    result.add(totals)
+        return result
+
+    def top(
+        self, scope: UsageScopes, start: date, end: date = None, limit: int = 10
+    ) -> List[Tuple[str, UsageTotals]]:
+        """Users, channels or guilds with the highest token usage.
+
+        Args:
+            scope (UsageScopes): scope to rank.
+            start (date): first UTC day.
+            end (date, optional): last UTC day, included. Defaults to start.
+            limit (int, optional): max amount of results. Defaults to 10.
+
+        Returns:
+            List[Tuple[str, UsageTotals]]: ids and usage, by descending total tokens.
+        """
+        days = set(self._days(start, end or start))
+        for day in days:
+            self._ensure_loaded(day)
+        ranking: Dict[str, UsageTotals] = {}
+        with self._lock:
+            for (totals_scope, scope_id, day), totals in self._totals.items():
+                if totals_scope == scope.value and day in days:
+                    ranking.setdefault(scope_id, UsageTotals()).add(totals)
+        return sorted(
+            ranking.items(), key=lambda item: item[1].total_tokens, reverse=True
+        )[:limit]
+
+    async def _run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if self.executor is None:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return await self.executor.run(func, *args, **kwargs)
+
+    async def aquery(
+        self, scope: UsageScopes, scope_id: str, start: date, end: date = None
+    ) -> UsageTotals:
+        """Async version of query."""
+        return await self._run(self.query, scope, scope_id, start, end)
+
+    async def atop(
+        self, scope: UsageScopes, start: date, end: date = None, limit: int = 10
+    ) -> List[Tuple[str, UsageTotals]]:
+        """Async version of top."""
+        return await self._run(self.top, scope, start, end, limit)
@@ -1,31 +1,54 @@
 """
 User handler class to load and save Users
 """
+import asyncio
+from typing import Any, Callable, TypeVar
 from pydantic import ValidationError
 from chat_bot.models.user import User
-from chat_bot.utils.handlers.file_handler import JsonHandler
-from chat_bot.utils.handlers.path_handler import PathHandler
-from chat_bot.utils.enums import Directories, Extensions
+from chat_bot.storage.base import StorageBackend
+from chat_bot.storage.filesystem import FileSystemStorage
+from chat_bot.storage.index import ExistenceIndex
+from chat_bot.utils.cache import LRUCache
+from chat_bot.utils.executor import BlockingIOExecutor
 from chat_bot.utils.logger import logger
 
+T = TypeVar("T")
+
 
 class UserHandler:
     """
-    Class to load and update Chat Historial
+    Class to load and create Users. When a cache is given loaded and created
+    Users are kept in memory and every write goes through to storage, only
+    the saved ones are cached.
+    When an index is given exists is answered from memory. The a-prefixed
+    methods run the storage calls on an executor, to be awaited from the
+    event loop.
     """
 
     def __init__(
         self,
-        file_handler: JsonHandler = JsonHandler(),
-        path_handler: PathHandler = PathHandler(),
+        storage: StorageBackend = None,
+        cache: LRUCache = None,
+        executor: BlockingIOExecutor = None,
+        index: ExistenceIndex = None,
     ) -> None:
-        self.file_handler = file_handler
-        self.path_handler = path_handler
-        self.path_components = [
-            Directories.CWD.value,
-            Directories.DB.value,
-            Directories.USERS.value,
-        ]
+        self.storage = storage or FileSystemStorage()
+        self.cache = cache
+        self.executor = executor
+        self.index = index
+
+    def _known(self, user_id: str) -> bool | None:
+        """Existence of a user answered from memory, None if unknown."""
+        if self.cache is not None and user_id in self.cache:
+            return True
+        if self.index is not None:
+            return self.index.user_exists(user_id)
+        return None
+
+    async def _run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if self.executor is None:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return await self.executor.run(func, *args, **kwargs)
 
     def load(self, user_id: str) -> User:
         """
@@ -35,25 +58,23 @@ class UserHandler:
             user_id (str): user_id
 
         Raises:
-            v_e: File loaded don't comply with the allowed structure.
+            v_e: Stored user don't comply with the allowed structure.
 
         Returns:
             User: User Model populated.
         """
         user = None
+        if self.cache is not None:
+            user = self.cache.get(user_id)
+            if user is not None:
+                return user
         try:
-            user_path = self.path_handler.compose_path(
-                [
-                    *self.path_components,
-                    f"{user_id}{Extensions.DOT_JSON.value}",
-                ]
-            )
-            user = User.parse_file(user_path)
+            user = self.storage.load_user(user_id)
+            if self.cache is not None and user is not None:
+                self.cache.put(user_id, user)
         except ValidationError as v_e:
             logger.error(v_e)
             raise v_e
-        except FileNotFoundError as f_e:
-            logger.warning(f_e)
         return user
 
     def create(self, user: User) -> bool:
@@ -71,16 +92,12 @@ class UserHandler:
             bool: True if the save was sucessfull, otherwise False
         """
         is_saved = False
-        user_path = None
         try:
-            user_path = self.path_handler.compose_path(
-                [
-                    *self.path_components,
-                    f"{user.id}{Extensions.DOT_JSON.value}",
-                ]
-            )
-            self.file_handler.save(user.dict(), user_path)
-            is_saved = True
+            is_saved = self.storage.save_user(user)
+            if is_saved and self.cache is not None:
+                self.cache.put(user.id, user)
+            if is_saved and self.index is not None:
+                self.index.add_user(user.id)
 
         except ValidationError as v_e:
             logger.error(v_e)
@@ -94,14 +111,37 @@ class UserHandler:
         return is_saved
 
     def exists(self, user_id: str) -> bool:
-        """Check if an specific chat file exists.
+        """Check if an specific user exists.
 
         Args:
             user_id (str): user_id
         Returns:
             bool: True, otherwise False
         """
-        chat_path = self.path_handler.compose_path([*self.path_components])
-        return self.path_handler.file_exists(
-            chat_path, f"{user_id}{Extensions.DOT_JSON.value}"
-        )
+        known = self._known(user_id)
+        if known is not None:
+            return known
+        exists = self.storage.user_exists(user_id)
+        if exists and self.index is not None:
+            self.index.add_user(user_id)
+        return exists
+
+    async def aload(self, user_id: str) -> User:
+        """Async version of load, cache hits are served without the executor."""
+        if self.cache is not None:
+            user = self.cache.get(user_id)
+            if user is not None:
+                return user
+        return await self._run(self.load, user_id)
+
+    async def acreate(self, user: User) -> bool:
+        """Async version of create."""
+        return await self._run(self.create, user)
+
+    async def aexists(self, user_id: str) -> bool:
+        """Async version of exists, cache and index hits are served without
+        the executor."""
+        known = self._known(user_id)
+        if known is not None:
+            return known
+        return await self._run(self.exists, user_id)
@@ -0,0 +1,146 @@
+"""
+In-memory cache util classes
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from sys import getsizeof
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Hashable
+
+from chat_bot.utils.enums import CacheLimits
+
+
+@dataclass
+class CacheStats:
+    """
+    Counters of a LRUCache
+    """
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    items: int = 0
+    size: int = 0
+
+
+class LRUCache:
+    """
+    Thread safe least recently used cache bounded by amount of items and by
+    the estimated memory size of the stored values. When a ttl is given values
+    expire ttl seconds after they were stored.
+    """
+
+    def __init__(
+        self,
+        max_items: int = CacheLimits.MAX_ITEMS.value,
+        max_size: int = CacheLimits.MAX_SIZE.value,
+        size_of: Callable[[Any], int] = getsizeof,
+        ttl: float = None,
+    ) -> None:
+        self.max_items = max_items
+        self.max_size = max_size
+        self.size_of = size_of
+        self.ttl = ttl
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+        self._sizes: dict[Hashable, int] = {}
+        self._expires: dict[Hashable, float] = {}
+        self._lock = Lock()
+        self._stats = CacheStats()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value stored for key, marking it as recently used.
+
+        Args:
+            key (Hashable): cache key.
+            default (Any, optional): value returned on a miss. Defaults to None.
+
+        Returns:
+            Any: cached value, otherwise default.
+        """
+        with self._lock:
+            if key not in self._items or self._expire(key):
+                self._stats.misses += 1
+                return default
+            self._stats.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used ones when the
+        cache goes over its limits. Also used to refresh the size of a
+        value mutated in place.
+
+        Args:
+            key (Hashable): cache key.
+            value (Any): value to store.
+        """
+        size = self.size_of(value)
+        with self._lock:
+            if key in self._items:
+                self._stats.size -= self._sizes[key]
+            self._items[key] = value
+            self._items.move_to_end(key)
+            self._sizes[key] = size
+            self._stats.size += size
+            if self.ttl is not None:
+                self._expires[key] = monotonic() + self.ttl
+            while len(self._items) > 1 and (
+                len(self._items) > self.max_items or self._stats.size > self.max_size
+            ):
+                evicted_key, _ = self._items.popitem(last=False)
+                self._stats.size -= self._sizes.pop(evicted_key)
+                self._expires.pop(evicted_key, None)
+                self._stats.evictions += 1
+
+    def _expire(self, key: Hashable) -> bool:
+        """Remove a stored value if its ttl is over, the lock must be held."""
+        expires = self._expires.get(key)
+        if expires is None or expires > monotonic():
+            return False
+        del self._items[key]
+        del self._expires[key]
+        self._stats.size -= self._sizes.pop(key)
+        self._stats.expirations += 1
+        return True
+
+    def pop(self, key: Hashable) -> Any:
+        """Remove a value from the cache.
+
+        Args:
+            key (Hashable): cache key.
+
+        Returns:
+            Any: removed value, otherwise None.
+        """
+        with self._lock:
+            value = self._items.pop(key, None)
+            self._expires.pop(key, None)
+            if key in self._sizes:
+                self._stats.size -= self._sizes.pop(key)
+            return value
+
+    def stats(self) -> CacheStats:
+        """Snapshot of the cache counters.
+
+        Returns:
+            CacheStats: counters.
+        """
+        with self._lock:
+            return CacheStats(
+                hits=self._stats.hits,
+                misses=self._stats.misses,
+                evictions=self._stats.evictions,
+                expirations=self._stats.expirations,
+                items=len(self._items),
+                size=self._stats.size,
+            )
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._items and not self._expire(key)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
@@ -1,13 +1,115 @@
 """
 Env vars mapping
 """
+from typing import Dict, List
+
 from pydantic import BaseSettings
 
+from chat_bot.models.routing import RoutingPolicy
+from chat_bot.utils.enums import (
+    CacheLimits,
+    Durability,
+    Embedders,
+    Engines,
+    GroupCommit,
+    Layout,
+    Limits,
+    Logging,
+    LoopMonitoring,
+    Observability,
+    RateLimits,
+    Retrieval,
+    Routing,
+    Scans,
+    StorageBackends,
+    Summarization,
+    Workers,
+)
+
 
 class OpenAISettings(BaseSettings):
     """en var mapping"""
 
     OPENAI_API_KEY: str
+    OPENAI_MAX_CONCURRENT_REQUESTS: int = Limits.MAX_CONCURRENT_REQUESTS.value
+    OPENAI_TOKEN_VALIDATION_TTL: float = Limits.TOKEN_VALIDATION_TTL.value
+    OPENAI_SUMMARIZATION_ENABLED: bool = False
+    OPENAI_SUMMARIZATION_THRESHOLD: int = Summarization.THRESHOLD.value
+    OPENAI_SUMMARIZATION_KEEP_RECENT: int = Summarization.KEEP_RECENT.value
+    OPENAI_RESPONSE_CACHE_MAX_ITEMS: int = CacheLimits.MAX_ITEMS.value
+    OPENAI_RESPONSE_CACHE_TTL: float = CacheLimits.RESPONSE_TTL.value
+    OPENAI_REQUESTS_PER_MINUTE: int = RateLimits.REQUESTS_PER_MINUTE.value
+    OPENAI_TOKENS_PER_MINUTE: int = RateLimits.TOKENS_PER_MINUTE.value
+    OPENAI_MAX_RETRIES: int = RateLimits.MAX_RETRIES.value
+    OPENAI_BACKOFF_BASE: float = RateLimits.BACKOFF_BASE.value
+    OPENAI_BACKOFF_MAX: float = RateLimits.BACKOFF_MAX.value
+    """Default routing policy, models from the preferred one"""
+    OPENAI_ROUTING_MODELS: List[str] = [Engines.GPT_3_5_TURBO.value]
+    OPENAI_ROUTING_DEADLINE: float = Routing.DEADLINE.value
+    """Routing policies by guild id, as a json object"""
+    OPENAI_ROUTING_POLICIES: Dict[str, RoutingPolicy] = {}
+    OPENAI_ROUTING_LOG_ENABLED: bool = True
+    """Send the past turns relevant to each message instead of the whole chat"""
+    OPENAI_RETRIEVAL_ENABLED: bool = False
+    OPENAI_RETRIEVAL_EMBEDDER: Embedders = Embedders.HASHING
+    OPENAI_RETRIEVAL_DIMENSION: int = Retrieval.HASHING_DIMENSION.value
+    OPENAI_RETRIEVAL_TOP_K: int = Retrieval.TOP_K.value
+    OPENAI_RETRIEVAL_RECENT_MESSAGES: int = Retrieval.RECENT_MESSAGES.value
+    OPENAI_RETRIEVAL_MIN_SCORE: float = Retrieval.MIN_SCORE.value
+    OPENAI_RETRIEVAL_CACHE_MAX_ITEMS: int = CacheLimits.MAX_ITEMS.value
 
 
 OPENAI_SETTINGS = OpenAISettings()
+
+
+class StorageSettings(BaseSettings):
+    """en var mapping"""
+
+    STORAGE_BACKEND: StorageBackends = StorageBackends.FILESYSTEM
+    STORAGE_SQLITE_PATH: str = None
+    STORAGE_TRUSTED_LOADS: bool = True
+    """Hash prefix directories of db/users and db/chats, see chat_bot.storage.layout"""
+    STORAGE_SHARD_LEVELS: int = Layout.SHARD_LEVELS.value
+    STORAGE_EXISTENCE_INDEX: bool = True
+    STORAGE_SCAN_WORKERS: int = Scans.WORKERS.value
+    """Full-text index of the messages for the search command"""
+    STORAGE_SEARCH_ENABLED: bool = True
+    STORAGE_SEARCH_PATH: str = None
+    CHAT_CACHE_MAX_ITEMS: int = CacheLimits.MAX_ITEMS.value
+    CHAT_CACHE_MAX_SIZE: int = CacheLimits.MAX_SIZE.value
+    CHAT_CACHE_COMPACT: bool = True
+    USER_CACHE_MAX_ITEMS: int = CacheLimits.MAX_ITEMS.value
+    STORAGE_FSYNC: bool = Durability.FSYNC.value
+    STORAGE_SYNC_DIRECTORY: bool = Durability.SYNC_DIRECTORY.value
+    STORAGE_GROUP_COMMIT_INTERVAL: float = GroupCommit.INTERVAL.value
+    STORAGE_USAGE_FLUSH_INTERVAL: float = GroupCommit.USAGE_FLUSH_INTERVAL.value
+    STORAGE_IO_WORKERS: int = Workers.IO_WORKERS.value
+    STORAGE_LOOP_LAG_INTERVAL: float = LoopMonitoring.INTERVAL.value
+    STORAGE_LOOP_STALL_THRESHOLD: float = LoopMonitoring.STALL_THRESHOLD.value
+
+
+STORAGE_SETTINGS = StorageSettings()
+
+
+class MetricsSettings(BaseSettings):
+    """en var mapping"""
+
+    METRICS_ENABLED: bool = False
+    METRICS_HOST: str = Observability.HOST.value
+    METRICS_PORT: int = Observability.PORT.value
+    METRICS_TRACE_SAMPLE_RATE: float = Observability.TRACE_SAMPLE_RATE.value
+
+
+METRICS_SETTINGS = MetricsSettings()
+
+
+class LoggingSettings(BaseSettings):
+    """en var mapping"""
+
+    LOG_LEVEL: str = Logging.LEVEL.value
+    """File receiving every log, none if empty"""
+    LOG_FILE: str = Logging.FILE.value
+    LOG_DIAGNOSE: bool = True
+
+
+LOGGING_SETTINGS = LoggingSettings()
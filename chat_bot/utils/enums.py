@@ -2,7 +2,7 @@
 Enum classes
 """
 import os
-from enum import Enum
+from enum import Enum, unique
 
 
 class Engines(Enum):
@@ -11,6 +11,63 @@ class Engines(Enum):
     """
 
     GPT_3_5_TURBO = "gpt-3.5-turbo"
+    GPT_3_5_TURBO_16K = "gpt-3.5-turbo-16k"
+    GPT_4 = "gpt-4"
+
+
+class ContextWindows(Enum):
+    """
+    Max tokens of a request (prompt plus completion) by engine,
+    members are named as the Engines ones
+    """
+
+    GPT_3_5_TURBO = 4096
+    GPT_3_5_TURBO_16K = 16384
+    GPT_4 = 8192
+
+
+class ModelCosts(Enum):
+    """
+    USD per 1K prompt tokens by engine, members are named as the Engines ones.
+    Only their order matters to the router, cheaper models are tried first
+    on fallback
+    """
+
+    GPT_3_5_TURBO = 0.0015
+    GPT_3_5_TURBO_16K = 0.003
+    GPT_4 = 0.03
+
+
+@unique
+class TokenCounts(Enum):
+    """
+    Token accounting constants
+    """
+
+    PER_MESSAGE = 4
+    PER_REPLY = 3
+    COMPLETION_RESERVE = 512
+
+
+class TokenEstimates(Enum):
+    """
+    Token count estimation used when tiktoken isn't installed
+    """
+
+    CHARS_PER_TOKEN = 4
+
+
+class Prompts(Enum):
+    """
+    Prompts used internally by the bot
+    """
+
+    SUMMARIZE = (
+        "Summarize the following conversation between a user and an assistant "
+        "in a single paragraph, keeping names, facts and decisions that could "
+        "be needed to continue it. Include the previous summary if any."
+    )
+    SUMMARY_PREFIX = "Summary of the earlier conversation: "
 
 
 class Encodings(Enum):
@@ -28,8 +85,16 @@ class Directories(Enum):
 
     CWD = os.getcwd()
     DB = "db"
+    DATABASE = "chat_bot"
     USERS = "users"
     CHATS = "chats"
+    USAGE = "usage"
+    ROUTING = "routing"
+    RESTORE = "restore"
+    OBJECTS = "objects"
+    SNAPSHOTS = "snapshots"
+    REPLACED = "replaced"
+    SEARCH = "search"
 
 
 class Extensions(Enum):
@@ -38,6 +103,41 @@ class Extensions(Enum):
     """
 
     DOT_JSON = ".json"
+    DOT_JSONL = ".jsonl"
+    DOT_SQLITE3 = ".sqlite3"
+    """Retrieval memory of a ChatHistorial, stored beside its log"""
+    DOT_TURNS = ".turns"
+    DOT_VECTORS = ".vectors"
+
+
+class StorageBackends(Enum):
+    """
+    Storage backends available for Users and ChatHistorial
+    """
+
+    FILESYSTEM = "filesystem"
+    SQLITE = "sqlite"
+
+
+class UsageScopes(Enum):
+    """
+    Scopes usage is aggregated by
+    """
+
+    USER = "user"
+    CHANNEL = "channel"
+    GUILD = "guild"
+
+
+class RecordTypes(Enum):
+    """
+    Record types of the append-only ChatHistorial log
+    """
+
+    HEADER = "header"
+    FLAGS = "flags"
+    MESSAGE = "message"
+    SUMMARY = "summary"
 
 
 class Roles(Enum):
@@ -48,3 +148,228 @@ class Roles(Enum):
     USER = "user"
     ASSISTANT = "assistant"
     SYSTEM = "system"
+
+
+@unique
+class Limits(Enum):
+    """
+    Default limits for OpenAI API usage
+    """
+
+    MAX_CONCURRENT_REQUESTS = 16
+    TOKEN_VALIDATION_TTL = 3600
+
+
+@unique
+class Summarization(Enum):
+    """
+    Default settings of the background summaries of long chats
+    """
+
+    THRESHOLD = 3000
+    KEEP_RECENT = 1000
+    """Summary requests of a single background summary, the rest waits a turn"""
+    MAX_CHUNKS = 8
+    """Seconds before retrying a failed summary, doubled on every failure"""
+    RETRY_DELAY = 30
+    MAX_RETRY_DELAY = 3600
+
+
+class RateLimits(Enum):
+    """
+    Default OpenAI API budgets and retry policy
+    """
+
+    REQUESTS_PER_MINUTE = 3500
+    TOKENS_PER_MINUTE = 90000
+    MAX_RETRIES = 5
+    """Seconds, doubled on every retry up to BACKOFF_MAX"""
+    BACKOFF_BASE = 1.0
+    BACKOFF_MAX = 60.0
+
+
+class CacheLimits(Enum):
+    """
+    Default limits for in-memory caches
+    """
+
+    MAX_ITEMS = 1024
+    MAX_SIZE = 64 * 1024 * 1024
+    """Seconds a cached API response is reused"""
+    RESPONSE_TTL = 3600
+
+
+@unique
+class Durability(Enum):
+    """
+    Default durability settings for file writes
+    """
+
+    FSYNC = True
+    SYNC_DIRECTORY = False
+
+
+@unique
+class GroupCommit(Enum):
+    """
+    Default settings of the buffered appends of the json lines files
+    """
+
+    """Seconds between group commits, 0 writes every append right away"""
+    INTERVAL = 0.0
+    """Seconds between flushes of the usage log, it is always buffered"""
+    USAGE_FLUSH_INTERVAL = 5.0
+    """Failed flushes in a row before the appends of a file are dropped"""
+    MAX_ATTEMPTS = 3
+
+
+class Workers(Enum):
+    """
+    Default sizes of the worker pools
+    """
+
+    IO_WORKERS = 8
+
+
+class Scans(Enum):
+    """
+    Scans of the db/ directory tree by the index and the snapshots
+    """
+
+    """Threads listing and reading the files of a scan"""
+    WORKERS = 8
+
+
+class Layout(Enum):
+    """
+    Hash prefix sharding of the db/users and db/chats directories
+    """
+
+    """0 keeps the flat layout"""
+    SHARD_LEVELS = 0
+    """Hex characters of a prefix directory, 256 directories per level"""
+    SHARD_WIDTH = 2
+
+
+class Snapshots(Enum):
+    """
+    Snapshots of db/ under restore/
+    """
+
+    MANIFEST = "manifest.json"
+    """UTC creation time, snapshot ids sort as they were taken"""
+    ID_FORMAT = "%Y%m%dT%H%M%S%fZ"
+    """0 keeps every snapshot"""
+    KEEP = 0
+    """Read only, a hard link must never let a write reach a stored content"""
+    OBJECT_MODE = 0o444
+
+
+class Search(Enum):
+    """
+    Defaults of the full-text search over the ChatHistorial messages
+    """
+
+    LIMIT = 5
+    """Tokens around the matched terms shown of each message"""
+    SNIPPET_TOKENS = 16
+    """Discord bold, wraps the matched terms"""
+    SNIPPET_MARK = "**"
+    SNIPPET_ELLIPSIS = "..."
+
+
+class Embedders(Enum):
+    """
+    Embedders available for the retrieval memory
+    """
+
+    HASHING = "hashing"
+    OPENAI = "openai"
+
+
+class Retrieval(Enum):
+    """
+    Defaults of the retrieval memory of the conversations
+    """
+
+    """Past turns retrieved for a new message"""
+    TOP_K = 4
+    """Latest non system messages always sent, the older ones are retrieved"""
+    RECENT_MESSAGES = 6
+    """Cosine similarity a past turn needs to be retrieved"""
+    MIN_SCORE = 0.2
+    """Weight of the previous user message when ranking, it gives the context
+    of short follow ups"""
+    CONTEXT_WEIGHT = 0.5
+    """Dimensions of the hashing embedder, 2**n spreads the hashes evenly"""
+    HASHING_DIMENSION = 1024
+    """Shorter words, mostly articles and prepositions, aren't hashed"""
+    MIN_WORD_LENGTH = 3
+    EMBEDDING_MODEL = "text-embedding-ada-002"
+    EMBEDDING_DIMENSION = 1536
+    """Vectors file header: magic, dimension and embedder fingerprint"""
+    MAGIC = b"CBV1"
+    HEADER_FORMAT = "<4sI16s"
+
+
+class LoopMonitoring(Enum):
+    """
+    Default event loop lag sampling, in seconds
+    """
+
+    INTERVAL = 0.5
+    STALL_THRESHOLD = 0.1
+
+
+class Observability(Enum):
+    """
+    Defaults of the metrics endpoint and of the trace sampling
+    """
+
+    HOST = "127.0.0.1"
+    PORT = 9108
+    TRACE_SAMPLE_RATE = 0.01
+    LATENCY_BUCKETS = (
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+        30.0,
+    )
+
+
+class Logging(Enum):
+    """
+    Defaults of the loguru sinks set by configure_logging
+    """
+
+    LEVEL = "INFO"
+    FORMAT = "[{time} | {level}] - {message}"
+    FILE = "dev_logs.log"
+    ROTATION = "500 MB"
+    COMPRESSION = "zip"
+
+
+class Routing(Enum):
+    """
+    Defaults of the model router
+    """
+
+    """Seconds a user waits for the first content of a response"""
+    DEADLINE = 30.0
+    """Latencies kept per model to estimate the next ones"""
+    LATENCY_WINDOW = 50
+    """Seconds a latency is remembered, a slow model is tried again after it"""
+    LATENCY_MAX_AGE = 300.0
+    """Share of the deadline kept for the fallback while its latency is unknown"""
+    FALLBACK_SHARE = 0.3
+    LATENCY_QUANTILE = 0.9
@@ -0,0 +1,162 @@
+"""
+Blocking I/O offloading and event loop lag instrumentation
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, TypeVar
+
+from chat_bot.utils.enums import LoopMonitoring, Workers
+from chat_bot.utils.logger import logger
+
+T = TypeVar("T")
+
+
+@dataclass
+class ExecutorStats:
+    """
+    Counters of a BlockingIOExecutor
+    """
+
+    calls: int = 0
+    running: int = 0
+    total_queue_wait: float = 0.0
+    total_run_time: float = 0.0
+    max_run_time: float = 0.0
+
+
+class BlockingIOExecutor:
+    """
+    Thread pool where the handlers run their blocking file and database calls,
+    so the event loop keeps serving other events meanwhile.
+    """
+
+    def __init__(self, max_workers: int = Workers.IO_WORKERS.value) -> None:
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="blocking-io"
+        )
+        self._stats = ExecutorStats()
+        self._stats_lock = Lock()
+
+    def _timed(self, submitted_at: float, func: Callable[[], T]) -> T:
+        started_at = monotonic()
+        with self._stats_lock:
+            self._stats.running += 1
+        try:
+            return func()
+        finally:
+            run_time = monotonic() - started_at
+            with self._stats_lock:
+                self._record(started_at - submitted_at, run_time)
+
+    def _record(self, queue_wait: float, run_time: float) -> None:
+        self._stats.running -= 1
+        self._stats.calls += 1
+        self._stats.total_queue_wait += queue_wait
+        self._stats.total_run_time += run_time
+        self._stats.max_run_time = max(self._stats.max_run_time, run_time)
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run a blocking callable on the pool and await its result.
+
+        Args:
+            func (Callable[..., T]): blocking callable.
+            *args (Any): positional arguments of the callable.
+            **kwargs (Any): keyword arguments of the callable.
+
+        Returns:
+            T: result of the callable, its exceptions are raised as they are.
+        """
+        loop = asyncio.get_running_loop()
+        """The context is copied as asyncio.to_thread does, so the call is
+        part of the trace of the caller"""
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._pool,
+            context.run,
+            self._timed,
+            monotonic(),
+            partial(func, *args, **kwargs),
+        )
+
+    def stats(self) -> ExecutorStats:
+        """Snapshot of the executor counters.
+
+        Returns:
+            ExecutorStats: counters.
+        """
+        with self._stats_lock:
+            return ExecutorStats(**vars(self._stats))
+
+    def shutdown(self) -> None:
+        """Wait for the running calls and release the threads."""
+        self._pool.shutdown(wait=True)
+
+
+@dataclass
+class LoopLagStats:
+    """
+    Counters of a LoopLagMonitor
+    """
+
+    samples: int = 0
+    total_lag: float = 0.0
+    max_lag: float = 0.0
+    stalls: int = 0
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task sleeping interval seconds.
+    The delay is the time the loop spent blocked running something else.
+    """
+
+    def __init__(
+        self,
+        interval: float = LoopMonitoring.INTERVAL.value,
+        stall_threshold: float = LoopMonitoring.STALL_THRESHOLD.value,
+    ) -> None:
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self._stats = LoopLagStats()
+        self._task: asyncio.Task = None
+
+    def start(self) -> None:
+        """Start sampling on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop sampling."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(monotonic() - expected, 0.0)
+            self._stats.samples += 1
+            self._stats.total_lag += lag
+            self._stats.max_lag = max(self._stats.max_lag, lag)
+            if lag > self.stall_threshold:
+                self._stats.stalls += 1
+                logger.warning(f"Event loop blocked for {lag * 1000:.1f} ms")
+
+    def stats(self) -> LoopLagStats:
+        """Snapshot of the lag counters.
+
+        Returns:
+            LoopLagStats: counters.
+        """
+        return LoopLagStats(**vars(self._stats))
@@ -2,11 +2,247 @@
 File handlers util classes
 """
 import json
+import os
+import tempfile
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Any, Union
+from threading import Event, Lock, Thread
+from typing import BinaryIO, Dict, Any, Iterator, List, Union
 
 from chat_bot.utils.logger import logger
-from chat_bot.utils.enums import Encodings
+from chat_bot.utils.enums import Encodings, GroupCommit
+from chat_bot.utils.serialization import dumps, loads
+from chat_bot.utils.metrics import metrics_registry, tracer
+
+"""Bytes read at a time looking back for the last complete line"""
+_TAIL_CHUNK = 4096
+
+file_operation_seconds = metrics_registry.histogram(
+    "chat_bot_file_operation_seconds", "Seconds spent on json file operations"
+)
+
+
+def fsync_directory(path: Union[str, Path]) -> None:
+    """Flush a directory entry to disk, so a rename done on it survives a crash.
+
+    Args:
+        path (Union[str, Path]): directory path.
+    """
+    dir_fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def atomic_write(
+    text: str,
+    full_path: Union[str, Path],
+    encoding: str = Encodings.UTF_8.value,
+    fsync: bool = True,
+    sync_directory: bool = False,
+) -> None:
+    """Write a file through a temporary file renamed over the target, so
+    readers and crashes only ever see the old or the new full content.
+
+    Args:
+        text (str): content of the file.
+        full_path (Union[str, Path]): full path of the file.
+        encoding (str, optional): Enconding used to write file.
+                                  Defaults to Encodings.UTF_8.value.
+        fsync (bool, optional): flush the file to disk before the rename.
+                                Defaults to True.
+        sync_directory (bool, optional): flush the directory after the rename.
+                                         Defaults to False.
+    """
+    path = Path(full_path)
+    fd, temp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as file:
+            file.write(text)
+            file.flush()
+            if fsync:
+                os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    if sync_directory:
+        fsync_directory(path.parent)
+
+
+def truncate_torn_tail(file: BinaryIO) -> int:
+    """Cut the incomplete last line an interrupted append left at the end of a
+    json lines file, so the next append starts on a line of its own.
+
+    Args:
+        file (BinaryIO): file opened for binary reading and writing.
+
+    Returns:
+        int: amount of bytes removed.
+    """
+    size = file.seek(0, os.SEEK_END)
+    if size == 0:
+        return 0
+    file.seek(size - 1)
+    if file.read(1) == b"\n":
+        return 0
+    end = size
+    while end > 0:
+        start = max(end - _TAIL_CHUNK, 0)
+        file.seek(start)
+        newline = file.read(end - start).rfind(b"\n")
+        if newline != -1:
+            end = start + newline + 1
+            break
+        end = start
+    file.truncate(end)
+    return size - end
+
+
+class GroupCommitWriter:
+    """
+    Buffers appends and applies them every interval seconds from a background
+    thread, so the cost of fsync is paid once per file and per directory for
+    each flush instead of once per append. A file that fails to be written
+    keeps its appends queued until max_attempts flushes failed in a row, then
+    they are dropped and logged.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        encoding: str = Encodings.UTF_8.value,
+        sync_directory: bool = True,
+        max_attempts: int = GroupCommit.MAX_ATTEMPTS.value,
+    ) -> None:
+        self.interval = interval
+        self.encoding = encoding
+        self.sync_directory = sync_directory
+        self.max_attempts = max_attempts
+        self._appends: Dict[Path, List[str]] = {}
+        """Failed flushes in a row by file, only used under the flush lock"""
+        self._failures: Dict[Path, int] = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._stop = Event()
+        self._thread: Thread = None
+
+    def start(self) -> None:
+        """Start the background flush thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name="group-commit", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and flush pending appends."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def append(self, text: str, full_path: Union[str, Path]) -> None:
+        """Queue an append at the end of a file."""
+        with self._lock:
+            self._appends.setdefault(Path(full_path), []).append(text)
+
+    def pending(self, full_path: Union[str, Path]) -> bool:
+        """Check if a file has queued appends."""
+        with self._lock:
+            return Path(full_path) in self._appends
+
+    @contextmanager
+    def rewriting(self, full_path: Union[str, Path]) -> Iterator[None]:
+        """Hold the flushes while a file is fully rewritten, dropping the
+        appends queued for it since the new content already includes them."""
+        with self._flush_lock:
+            with self._lock:
+                self._appends.pop(Path(full_path), None)
+            yield
+
+    def _write(self, path: Path, texts: List[str]) -> None:
+        with open(path, "a+b") as file:
+            truncate_torn_tail(file)
+            start = file.tell()
+            try:
+                file.write("".join(texts).encode(self.encoding))
+                file.flush()
+                os.fsync(file.fileno())
+            except OSError:
+                """Undo a partial write, the texts are written again whole"""
+                file.truncate(start)
+                raise
+
+    def _take(self, full_path: Union[str, Path, None]) -> Dict[Path, List[str]]:
+        """Queued appends of every file, or of a single one, the lock must be held."""
+        if full_path is None:
+            appends, self._appends = self._appends, {}
+            return appends
+        path = Path(full_path)
+        if path not in self._appends:
+            return {}
+        return {path: self._appends.pop(path)}
+
+    def flush(self, full_path: Union[str, Path] = None) -> None:
+        """Apply the queued appends of every file, or only of full_path, and
+        flush them to disk. The errors of each file are logged. The appends
+        of a file that fails are queued again, before the ones queued since,
+        unless it failed max_attempts times in a row.
+
+        Args:
+            full_path (Union[str, Path], optional): the only file to flush,
+                every file if None. Defaults to None.
+
+        Raises:
+            o_e: OS related errors writing full_path, only when given.
+        """
+        error = None
+        with self._flush_lock:
+            with self._lock:
+                appends = self._take(full_path)
+            written = []
+            failed: Dict[Path, List[str]] = {}
+            for path, texts in appends.items():
+                try:
+                    self._write(path, texts)
+                    written.append(path)
+                    self._failures.pop(path, None)
+                except OSError as o_e:
+                    logger.error(o_e)
+                    error = o_e
+                    attempts = self._failures.get(path, 0) + 1
+                    if attempts < self.max_attempts:
+                        self._failures[path] = attempts
+                        failed[path] = texts
+                    else:
+                        self._failures.pop(path, None)
+                        logger.error(
+                            f"Dropped {len(texts)} appends to {path} after "
+                            f"{attempts} failed flushes"
+                        )
+            if failed:
+                with self._lock:
+                    for path, texts in failed.items():
+                        self._appends[path] = texts + self._appends.get(path, [])
+            if self.sync_directory:
+                for directory in {path.parent for path in written}:
+                    try:
+                        fsync_directory(directory)
+                    except OSError as o_e:
+                        logger.error(o_e)
+        if written:
+            logger.debug(f"Group commit of {len(written)} files")
+        if full_path is not None and error is not None:
+            raise error
 
 
 class JsonHandler:
@@ -14,12 +250,45 @@ class JsonHandler:
     Json file utility class
     """
 
-    def __init__(self) -> None:
-        pass
+    def __init__(
+        self,
+        atomic: bool = True,
+        fsync: bool = True,
+        sync_directory: bool = False,
+        writer: GroupCommitWriter = None,
+    ) -> None:
+        """
+        Args:
+            atomic (bool, optional): write through a temporary file and a rename.
+                                     Defaults to True.
+            fsync (bool, optional): flush files to disk on save. Defaults to True.
+            sync_directory (bool, optional): flush the directory after a rename.
+                                             Defaults to False.
+            writer (GroupCommitWriter, optional): batch appends through a group
+                                                  commit writer. Defaults to None.
+        """
+        self.atomic = atomic
+        self.fsync = fsync
+        self.sync_directory = sync_directory
+        self.writer = writer
 
-    @staticmethod
+    def _write(self, text: str, full_path: Union[str, Path], encoding: str) -> None:
+        if self.writer is not None:
+            with self.writer.rewriting(full_path):
+                atomic_write(text, full_path, encoding, self.fsync, self.sync_directory)
+        elif self.atomic:
+            atomic_write(text, full_path, encoding, self.fsync, self.sync_directory)
+        else:
+            with open(full_path, "w", encoding=encoding) as file:
+                file.write(text)
+
+    def _flush_pending(self, full_path: Union[str, Path]) -> None:
+        if self.writer is not None and self.writer.pending(full_path):
+            self.writer.flush(full_path)
+
+    @file_operation_seconds.time(operation="load")
     def load(
-        full_path: Union[str, Path], encoding: str = Encodings.UTF_8.value
+        self, full_path: Union[str, Path], encoding: str = Encodings.UTF_8.value
     ) -> Dict[str, Any]:
         """Load a json file using an specific encoding.
 
@@ -38,9 +307,10 @@ class JsonHandler:
         """
         data = None
         try:
+            self._flush_pending(full_path)
             with open(full_path, "r", encoding=encoding) as file:
-                data = json.load(file)
-            logger.info(f"File load sucessfully!: {full_path}")
+                data = loads(file.read())
+            tracer.log(f"File load sucessfully!: {full_path}")
         except FileNotFoundError as f_e:
             logger.error(f_e)
             raise f_e
@@ -52,12 +322,13 @@ class JsonHandler:
             raise v_e
         return data
 
-    @staticmethod
+    @file_operation_seconds.time(operation="save")
     def save(
+        self,
         data: Dict[str, Any],
         full_path: str,
         encoding: str = Encodings.UTF_8.value,
-        indent: str = 4,
+        indent: int = None,
     ) -> bool:
         """Save a dict-like object to a json file.
 
@@ -66,7 +337,8 @@ class JsonHandler:
             full_path (str): full path where to save the file.
             encoding (str, optional): Enconding used to write file.
                                     Defaults to Encodings.UTF_8.value.
-            indent (str, optional): identation of the file. Defaults to 4.
+            indent (int, optional): identation of the file, compact if None.
+                                    Defaults to None.
 
         Raises:
             f_e: File where to store doesn't exists.
@@ -78,10 +350,9 @@ class JsonHandler:
         """
         is_saved = False
         try:
-            with open(full_path, "w", encoding=encoding) as file:
-                json.dump(data, file, indent=indent)
+            self._write(dumps(data, indent=indent), full_path, encoding)
             is_saved = True
-            logger.info(f"File saved sucessfully!: {full_path}")
+            tracer.log(f"File saved sucessfully!: {full_path}")
         except FileNotFoundError as f_e:
             logger.error(f_e)
             raise f_e
@@ -92,3 +363,162 @@ class JsonHandler:
             logger.error(o_e)
             raise o_e
         return is_saved
+
+
+class JsonLinesHandler(JsonHandler):
+    """
+    Json Lines file utility class, one json document per line.
+    """
+
+    @file_operation_seconds.time(operation="load")
+    def load(
+        self, full_path: Union[str, Path], encoding: str = Encodings.UTF_8.value
+    ) -> List[Dict[str, Any]]:
+        """Load every record of a json lines file. A trailing line left
+        incomplete by an interrupted append is ignored, the next append or
+        repair cuts it.
+
+        Args:
+            full_path (Union[str, Path]): full path to the file to be loaded.
+            encoding (str, optional):Encoding to be used to open the file.
+                                    Defaults to Encodings.UTF_8.value.
+
+        Raises:
+            f_e: File not found found.
+            j_e: File with syntax JSON non-compatible.
+
+        Returns:
+            List[Dict[str, Any]]: records stored on the file.
+        """
+        records = []
+        try:
+            self._flush_pending(full_path)
+            with open(full_path, "r", encoding=encoding) as file:
+                lines = file.read().split("\n")
+            """Last item is empty if the file ends on a complete line"""
+            for line in lines[:-1]:
+                if line:
+                    records.append(loads(line))
+            if lines[-1]:
+                logger.warning(f"Ignoring incomplete last line: {full_path}")
+            tracer.log(f"File load sucessfully!: {full_path}")
+        except FileNotFoundError as f_e:
+            logger.error(f_e)
+            raise f_e
+        except json.JSONDecodeError as j_e:
+            logger.error(j_e)
+            raise j_e
+        return records
+
+    @file_operation_seconds.time(operation="append")
+    def append(
+        self,
+        records: List[Dict[str, Any]],
+        full_path: Union[str, Path],
+        encoding: str = Encodings.UTF_8.value,
+    ) -> bool:
+        """Append records at the end of a json lines file, creating it if needed.
+
+        Args:
+            records (List[Dict[str, Any]]): Dict-like objects to be serialized.
+            full_path (Union[str, Path]): full path of the file.
+            encoding (str, optional): Enconding used to write file.
+                                    Defaults to Encodings.UTF_8.value.
+
+        Raises:
+            t_e: Incompatible data object.
+            o_e: OS related errors during writing process.
+
+        Returns:
+            bool: True records were appended succcesfully, otherwise False.
+        """
+        is_saved = False
+        try:
+            lines = "".join(f"{dumps(record)}\n" for record in records)
+            if self.writer is not None:
+                self.writer.append(lines, full_path)
+            else:
+                with open(full_path, "a+b") as file:
+                    """Appending after a torn line would corrupt both records"""
+                    torn_bytes = truncate_torn_tail(file)
+                    if torn_bytes:
+                        logger.warning(
+                            f"Cut {torn_bytes} bytes of incomplete last line: {full_path}"
+                        )
+                    file.write(lines.encode(encoding))
+                    if self.fsync:
+                        file.flush()
+                        os.fsync(file.fileno())
+            is_saved = True
+            tracer.log(f"File appended sucessfully!: {full_path}")
+        except TypeError as t_e:
+            logger.error(t_e)
+            raise t_e
+        except OSError as o_e:
+            logger.error(o_e)
+            raise o_e
+        return is_saved
+
+    def repair(self, full_path: Union[str, Path]) -> int:
+        """Cut the incomplete last line left by an interrupted append.
+
+        Args:
+            full_path (Union[str, Path]): full path of the file.
+
+        Raises:
+            o_e: OS related errors during writing process.
+
+        Returns:
+            int: amount of bytes removed.
+        """
+        try:
+            self._flush_pending(full_path)
+            with open(full_path, "r+b") as file:
+                torn_bytes = truncate_torn_tail(file)
+                if torn_bytes and self.fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+        except OSError as o_e:
+            logger.error(o_e)
+            raise o_e
+        if torn_bytes:
+            logger.warning(
+                f"Cut {torn_bytes} bytes of incomplete last line: {full_path}"
+            )
+        return torn_bytes
+
+    @file_operation_seconds.time(operation="save")
+    def save(
+        self,
+        records: List[Dict[str, Any]],
+        full_path: Union[str, Path],
+        encoding: str = Encodings.UTF_8.value,
+    ) -> bool:
+        """Write a whole json lines file replacing its current content.
+
+        Args:
+            records (List[Dict[str, Any]]): Dict-like objects to be serialized.
+            full_path (Union[str, Path]): full path of the file.
+            encoding (str, optional): Enconding used to write file.
+                                    Defaults to Encodings.UTF_8.value.
+
+        Raises:
+            t_e: Incompatible data object.
+            o_e: OS related errors during writing process.
+
+        Returns:
+            bool: True file was saved succcesfully, otherwise False.
+        """
+        is_saved = False
+        try:
+            lines = "".join(f"{dumps(record)}\n" for record in records)
+            self._write(lines, full_path, encoding)
+            is_saved = True
+            tracer.log(f"File saved sucessfully!: {full_path}")
+        except TypeError as t_e:
+            logger.error(t_e)
+            raise t_e
+        except OSError as o_e:
+            logger.error(o_e)
+            raise o_e
+        return is_saved
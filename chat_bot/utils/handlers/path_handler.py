@@ -1,8 +1,11 @@
 """
 OS Path utility class
 """
+import hashlib
+import os
 from pathlib import Path
 from typing import List
+from chat_bot.utils.enums import Layout
 from chat_bot.utils.logger import logger
 
 
@@ -53,7 +56,9 @@ class PathHandler:
             List of file names in the directory.
         """
         path = PathHandler.get_path(path)
-        return [file.name for file in path.iterdir() if file.is_file()]
+        """scandir entries know their type, no stat call per file"""
+        with os.scandir(path) as entries:
+            return [entry.name for entry in entries if entry.is_file()]
 
     @staticmethod
     def list_directory_directories(path: str | Path) -> list[str]:
@@ -67,7 +72,8 @@ class PathHandler:
             List of subdirectory names in the directory.
         """
         path = PathHandler.get_path(path)
-        return [dir.name for dir in path.iterdir() if dir.is_dir()]
+        with os.scandir(path) as entries:
+            return [entry.name for entry in entries if entry.is_dir()]
 
     @staticmethod
     def file_exists(path: str | Path, file_name: str) -> bool:
@@ -126,13 +132,36 @@ class PathHandler:
         return path_obj
 
     @staticmethod
-    def compose_path(components: List[str]) -> Path:
+    def shard_components(key: str, levels: int) -> List[str]:
+        """Hash prefix directories of a key, each level holds up to 256
+        directories so directory sizes stay bounded.
+
+        Args:
+            key (str): key to shard, e.g. an user id.
+            levels (int): amount of prefix directories.
+
+        Returns:
+            List[str]: prefix directory names, empty with 0 levels.
+        """
+        if levels <= 0:
+            return []
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        width = Layout.SHARD_WIDTH.value
+        return [digest[level * width : (level + 1) * width] for level in range(levels)]
+
+    @staticmethod
+    def compose_path(
+        components: List[str], shard_key: str = None, shard_levels: int = 0
+    ) -> Path:
         """Based on a list of strings returns
         a Path object build with the items on the
         same order of the item list.
 
         Args:
             components (List[str]): items to compose the path.
+            shard_key (str, optional): key whose hash prefix directories are
+                                       appended after the components.
+            shard_levels (int, optional): amount of prefix directories. Defaults to 0.
 
         Returns:
             Path: a Path object.
@@ -140,4 +169,29 @@ class PathHandler:
         path = Path("/")
         for component in components:
             path /= component
+        if shard_key is not None:
+            for component in PathHandler.shard_components(shard_key, shard_levels):
+                path /= component
         return path
+
+    @staticmethod
+    def list_leaf_directories(path: str | Path, levels: int) -> List[Path]:
+        """
+        Returns the directories levels below the given directory path, the
+        ones holding the items of a sharded layout.
+
+        Args:
+            path (str | Path): The root directory of the sharded layout.
+            levels (int): amount of prefix directories.
+
+        Returns:
+            List of directory paths, only the root with 0 levels.
+        """
+        directories = [PathHandler.get_path(path)]
+        for _ in range(levels):
+            directories = [
+                directory / name
+                for directory in directories
+                for name in PathHandler.list_directory_directories(directory)
+            ]
+        return directories
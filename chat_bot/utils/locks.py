@@ -0,0 +1,116 @@
+"""
+Per conversation async locks
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from time import monotonic
+from typing import AsyncIterator, Dict, Tuple
+
+from chat_bot.utils.metrics import metrics_registry
+
+lock_wait_seconds = metrics_registry.histogram(
+    "chat_bot_conversation_lock_wait_seconds",
+    "Seconds a turn waited for the previous turn of its conversation",
+)
+
+
+@dataclass
+class LockStats:
+    """
+    Counters of a ConversationLockManager
+    """
+
+    acquisitions: int = 0
+    contended: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    waiting: int = 0
+    max_queue_depth: int = 0
+    active_conversations: int = 0
+
+
+class ConversationLockManager:
+    """
+    Serializes the turns of a single conversation, identified by
+    (user_id, chat_id), while different conversations run in parallel.
+    Locks only exist while a turn is running or waiting on them.
+    """
+
+    def __init__(self) -> None:
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._holders: Dict[Tuple[str, str], int] = {}
+        self._stats = LockStats()
+
+    @asynccontextmanager
+    async def acquire(self, user_id: str, chat_id: str) -> AsyncIterator[float]:
+        """Wait for the turn of the conversation.
+
+        Args:
+            user_id (str): user id.
+            chat_id (str): chat id.
+
+        Yields:
+            float: seconds waited for the lock.
+        """
+        key = (user_id, chat_id)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._holders[key] = self._holders.get(key, 0) + 1
+        start = monotonic()
+        try:
+            if lock.locked():
+                self._stats.contended += 1
+                self._stats.waiting += 1
+                self._stats.max_queue_depth = max(
+                    self._stats.max_queue_depth, self.queue_depth(user_id, chat_id)
+                )
+                try:
+                    await lock.acquire()
+                finally:
+                    self._stats.waiting -= 1
+            else:
+                await lock.acquire()
+            try:
+                wait = monotonic() - start
+                lock_wait_seconds.observe(wait)
+                self._stats.acquisitions += 1
+                self._stats.total_wait += wait
+                self._stats.max_wait = max(self._stats.max_wait, wait)
+                yield wait
+            finally:
+                lock.release()
+        finally:
+            self._holders[key] -= 1
+            if not self._holders[key]:
+                del self._holders[key]
+                del self._locks[key]
+
+    def queue_depth(self, user_id: str, chat_id: str) -> int:
+        """Turns waiting behind the running one of a conversation.
+
+        Args:
+            user_id (str): user id.
+            chat_id (str): chat id.
+
+        Returns:
+            int: amount of waiting turns.
+        """
+        return max(self._holders.get((user_id, chat_id), 0) - 1, 0)
+
+    def stats(self) -> LockStats:
+        """Snapshot of the lock counters.
+
+        Returns:
+            LockStats: counters.
+        """
+        return LockStats(
+            acquisitions=self._stats.acquisitions,
+            contended=self._stats.contended,
+            total_wait=self._stats.total_wait,
+            max_wait=self._stats.max_wait,
+            waiting=self._stats.waiting,
+            max_queue_depth=self._stats.max_queue_depth,
+            active_conversations=len(self._locks),
+        )
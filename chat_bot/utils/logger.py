@@ -1,18 +1,43 @@
 """
-Logger config file
+Logger config file. Importing the logger adds no sinks, the entry points call
+configure_logging once on start.
 """
 from sys import stderr
-from logging import INFO
 
 from loguru import logger
 
+from chat_bot.utils.enums import Logging
 
-logger.add(
-    sink=stderr,
-    level=INFO,
-    format="[{time} | {level}] - {message}",
-    colorize=True,
-    backtrace=True,
-    diagnose=True,
-)
-logger.add(sink="dev_logs.log", rotation="500 MB", compression="zip")
+
+def configure_logging(
+    level: str = Logging.LEVEL.value,
+    log_file: str = Logging.FILE.value,
+    diagnose: bool = True,
+) -> None:
+    """Replace the sinks of the logger with a stderr one and, if given, a
+    rotating file one receiving every level.
+
+    Args:
+        level (str, optional): minimum level logged on stderr.
+                               Defaults to Logging.LEVEL.value.
+        log_file (str, optional): file of the file sink, no file sink if empty.
+                                  Defaults to Logging.FILE.value.
+        diagnose (bool, optional): show variable values on tracebacks.
+                                   Defaults to True.
+    """
+    logger.remove()
+    logger.add(
+        sink=stderr,
+        level=level,
+        format=Logging.FORMAT.value,
+        colorize=True,
+        backtrace=True,
+        diagnose=diagnose,
+    )
+    if log_file:
+        logger.add(
+            sink=log_file,
+            rotation=Logging.ROTATION.value,
+            compression=Logging.COMPRESSION.value,
+            diagnose=diagnose,
+        )
@@ -0,0 +1,408 @@
+"""
+Counters, histograms and timing spans of the hot path, exported in the
+Prometheus text format through a small local HTTP endpoint.
+
+Every span is measured, but only the traces picked by the sample rate are
+logged, so the observability doesn't cost a log line per file operation.
+"""
+import random
+import secrets
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import monotonic
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from chat_bot.utils.enums import Observability
+from chat_bot.utils.logger import logger
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+LabelValues = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, LabelValues, float]
+
+
+def _label_values(labels: Dict[str, str]) -> LabelValues:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_sample(name: str, labels: LabelValues, value: float) -> str:
+    if not labels:
+        return f"{name} {_format_value(value)}"
+    escaped = ",".join(f'{label}="{_escape(text)}"' for label, text in labels)
+    return f"{name}{{{escaped}}} {_format_value(value)}"
+
+
+class Counter:
+    """
+    Monotonic value per label set. When collect is given the value is read
+    from it instead, to export counters kept elsewhere (e.g. cache stats).
+    """
+
+    kind = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, collect: Callable[[], float] = None
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """Add amount to the value of the label set."""
+        key = _label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Current value of the label set."""
+        if self.collect is not None:
+            return self.collect()
+        with self._lock:
+            return self._values.get(_label_values(labels), 0.0)
+
+    def samples(self) -> List[Sample]:
+        """Exported samples."""
+        if self.collect is not None:
+            return [(self.name, (), self.collect())]
+        with self._lock:
+            return [
+                (self.name, labels, value) for labels, value in self._values.items()
+            ]
+
+
+class Gauge:
+    """
+    Value read from collect when exported, for queue lengths and the like
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, collect: Callable[[], float]
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+
+    def samples(self) -> List[Sample]:
+        """Exported samples."""
+        return [(self.name, (), self.collect())]
+
+
+class Histogram:
+    """
+    Distribution of observed values per label set over fixed buckets
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = Observability.LATENCY_BUCKETS.value,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        """Per label set: count of every bucket (not cumulative), sum and count"""
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record a value on the label set."""
+        key = _label_values(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, totals = self._values.get(key) or self._values.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0, 0.0])
+            )
+            counts[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the seconds spent inside the context, also when it raises."""
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(monotonic() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        """Amount of observations of the label set."""
+        with self._lock:
+            values = self._values.get(_label_values(labels))
+            return int(values[1][1]) if values else 0
+
+    def total(self, **labels: str) -> float:
+        """Sum of the observations of the label set."""
+        with self._lock:
+            values = self._values.get(_label_values(labels))
+            return values[1][0] if values else 0.0
+
+    def samples(self) -> List[Sample]:
+        """Exported samples, with cumulative buckets."""
+        samples = []
+        with self._lock:
+            items = [
+                (labels, list(counts), list(totals))
+                for labels, (counts, totals) in self._values.items()
+            ]
+        for labels, counts, totals in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        labels + (("le", _format_value(float(bound))),),
+                        cumulative,
+                    )
+                )
+            samples.append((f"{self.name}_sum", labels, totals[0]))
+            samples.append((f"{self.name}_count", labels, int(totals[1])))
+        return samples
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class MetricsRegistry:
+    """
+    Named metrics of the process. Asking twice for the same name returns the
+    same metric, so modules can declare the ones they use at import time.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(
+        self, name: str, documentation: str, collect: Callable[[], float] = None
+    ) -> Counter:
+        """Counter registered as name.
+
+        Args:
+            name (str): metric name.
+            documentation (str): help text.
+            collect (Callable[[], float], optional): source of the value, if
+                kept elsewhere. A new one replaces the previous one.
+
+        Returns:
+            Counter: registered counter.
+        """
+        counter = self._register(Counter(name, documentation, collect))
+        if collect is not None:
+            counter.collect = collect
+        return counter
+
+    def gauge(
+        self, name: str, documentation: str, collect: Callable[[], float]
+    ) -> Gauge:
+        """Gauge registered as name, a new collect replaces the previous one.
+
+        Args:
+            name (str): metric name.
+            documentation (str): help text.
+            collect (Callable[[], float]): source of the value.
+
+        Returns:
+            Gauge: registered gauge.
+        """
+        gauge = self._register(Gauge(name, documentation, collect))
+        gauge.collect = collect
+        return gauge
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = Observability.LATENCY_BUCKETS.value,
+    ) -> Histogram:
+        """Histogram registered as name.
+
+        Args:
+            name (str): metric name.
+            documentation (str): help text.
+            buckets (Sequence[float], optional): bucket upper bounds.
+                Defaults to Observability.LATENCY_BUCKETS.value.
+
+        Returns:
+            Histogram: registered histogram.
+        """
+        return self._register(Histogram(name, documentation, buckets))
+
+    def get(self, name: str) -> Metric:
+        """Metric registered as name, None if there isn't."""
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: exposition text.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error(e)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(_format_sample(*sample) for sample in samples)
+        return "\n".join(lines) + "\n"
+
+
+"""Id of the current trace and whether it is logged"""
+_current_trace: ContextVar[Tuple[str, bool]] = ContextVar("current_trace", default=None)
+
+
+class Tracer:
+    """
+    Times the phases of a chat turn. Every span is observed on the phase
+    histogram, only the spans of sampled traces are logged.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        sample_rate: float = Observability.TRACE_SAMPLE_RATE.value,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.trace_seconds = registry.histogram(
+            "chat_bot_trace_seconds", "Seconds spent on a traced command"
+        )
+        self.phase_seconds = registry.histogram(
+            "chat_bot_phase_seconds", "Seconds spent on each phase of a chat turn"
+        )
+
+    def sampled(self) -> bool:
+        """Check if the current trace is logged, outside of a trace every
+        call is sampled on its own."""
+        trace = _current_trace.get()
+        if trace is None:
+            return random.random() < self.sample_rate
+        return trace[1]
+
+    def log(self, message: str) -> None:
+        """Log message at INFO level if the current trace is sampled."""
+        if self.sampled():
+            trace = _current_trace.get()
+            logger.info(f"[trace {trace[0]}] {message}" if trace else message)
+
+    @contextmanager
+    def trace(self, name: str) -> Iterator[None]:
+        """Start a trace, the spans inside the context (also the ones run on
+        tasks and executors created from it) belong to it.
+
+        Args:
+            name (str): traced command.
+        """
+        context_token = _current_trace.set(
+            (secrets.token_hex(4), random.random() < self.sample_rate)
+        )
+        start = monotonic()
+        try:
+            yield
+        finally:
+            elapsed = monotonic() - start
+            self.trace_seconds.observe(elapsed, name=name)
+            self.log(f"{name} took {elapsed * 1000:.2f} ms")
+            _current_trace.reset(context_token)
+
+    @contextmanager
+    def span(self, phase: str) -> Iterator[None]:
+        """Time a phase of the current trace.
+
+        Args:
+            phase (str): phase name, label of the phase histogram.
+        """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            elapsed = monotonic() - start
+            self.phase_seconds.observe(elapsed, phase=phase)
+            self.log(f"{phase} took {elapsed * 1000:.2f} ms")
+
+
+metrics_registry = MetricsRegistry()
+tracer = Tracer(metrics_registry)
+
+
+class MetricsServer:
+    """
+    aiohttp server exporting a MetricsRegistry on GET /metrics. aiohttp.web is
+    imported when started, processes without the endpoint don't load it.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry = metrics_registry,
+        host: str = Observability.HOST.value,
+        port: int = Observability.PORT.value,
+    ) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: "web.AppRunner" = None
+
+    async def _metrics(self, _: "web.Request") -> "web.Response":
+        from aiohttp import web  # pylint: disable=import-outside-toplevel
+
+        return web.Response(
+            text=self.registry.render(),
+            content_type="text/plain",
+            headers={"X-Content-Type-Options": "nosniff"},
+        )
+
+    async def start(self) -> None:
+        """Start serving on host:port"""
+        from aiohttp import web  # pylint: disable=import-outside-toplevel
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Metrics endpoint on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        """Stop serving"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
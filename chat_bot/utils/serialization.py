@@ -0,0 +1,53 @@
+"""
+JSON codec of the storage, orjson is used when installed and the standard
+json module otherwise. Both produce the same compact documents and raise
+the errors of the json module (orjson ones subclass them).
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+CODEC = "json" if orjson is None else "orjson"
+
+
+def dumps(data: Any, indent: int = None) -> str:
+    """Serialize data as a json document.
+
+    Args:
+        data (Any): json compatible object.
+        indent (int, optional): pretty print with this indentation, compact
+                                if None. Defaults to None.
+
+    Raises:
+        TypeError: data is not json compatible.
+
+    Returns:
+        str: json document.
+    """
+    if indent is not None:
+        return json.dumps(data, indent=indent)
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(document: str | bytes) -> Any:
+    """Deserialize a json document.
+
+    Args:
+        document (str | bytes): json document.
+
+    Raises:
+        json.JSONDecodeError: document is not valid json.
+
+    Returns:
+        Any: deserialized object.
+    """
+    if orjson is not None:
+        return orjson.loads(document)
+    return json.loads(document)
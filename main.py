@@ -1,7 +1,28 @@
 "main file to run discord bot"
-from chat_bot.bot.bot import bot
+import sys
+
 from chat_bot.bot.utils.configs import DISCORD_SETTINGS
+from chat_bot.bot.utils.logger import configure_bot_logging
 
 
 if __name__ == "__main__":
-    bot.run(DISCORD_SETTINGS.DISCORD_BOT_TOKEN, log_handler=None)
+    configure_bot_logging()
+    if DISCORD_SETTINGS.DISCORD_WORKERS > 1:
+        """Sharded deployment, the bot is imported by each worker process"""
+        from chat_bot.bot.launcher import (  # pylint: disable=import-outside-toplevel
+            Launcher,
+        )
+
+        sys.exit(
+            Launcher(
+                workers=DISCORD_SETTINGS.DISCORD_WORKERS,
+                shard_count=DISCORD_SETTINGS.DISCORD_SHARD_COUNT,
+            ).run()
+        )
+    else:
+        # pylint: disable=import-outside-toplevel
+        from chat_bot.bot.bot import bot
+        from chat_bot.bot.launcher import run_bot
+
+        # pylint: enable=import-outside-toplevel
+        run_bot(bot, DISCORD_SETTINGS.DISCORD_BOT_TOKEN)
@@ -6,5 +6,5 @@ from setuptools import setup, find_packages
 setup(
     name="chat-bot",
     version="0.0.1",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
 )
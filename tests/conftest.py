@@ -0,0 +1,7 @@
+"""
+Settings required to import the modules under test
+"""
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("DISCORD_BOT_TOKEN", "test")
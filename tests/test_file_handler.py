@@ -0,0 +1,62 @@
+"""
+Tests of the json lines handler and the group commit writer
+"""
+from pathlib import Path
+
+import pytest
+
+from chat_bot.utils.handlers.file_handler import GroupCommitWriter, JsonLinesHandler
+
+
+def test_append_cuts_torn_last_line(tmp_path: Path):
+    handler = JsonLinesHandler()
+    path = tmp_path / "chat.jsonl"
+    handler.save([{"type": "header"}], path)
+    with open(path, "a", encoding="utf-8") as file:
+        file.write('{"type":"mess')
+
+    handler.append([{"type": "message"}], path)
+
+    assert handler.load(path) == [{"type": "header"}, {"type": "message"}]
+
+
+def test_failing_file_does_not_fail_the_others(tmp_path: Path):
+    writer = GroupCommitWriter(interval=1.0, max_attempts=2)
+    handler = JsonLinesHandler(writer=writer)
+    healthy = tmp_path / "ok.jsonl"
+    failing = tmp_path / "missing_dir" / "other.jsonl"
+    handler.save([{"type": "header"}], healthy)
+
+    handler.append([{"type": "message"}], failing)
+    handler.append([{"type": "message"}], healthy)
+
+    """Loading a file only flushes that file"""
+    assert handler.load(healthy) == [{"type": "header"}, {"type": "message"}]
+    assert writer.pending(failing)
+
+    """A flush of every file logs the errors instead of raising them"""
+    handler.append([{"type": "message"}], healthy)
+    writer.flush()
+    assert not writer.pending(healthy)
+    assert writer.pending(failing)
+
+    """The appends are dropped once max_attempts flushes failed in a row"""
+    writer.flush()
+    assert not writer.pending(failing)
+    with pytest.raises(FileNotFoundError):
+        handler.load(failing)
+
+
+def test_failed_flush_of_a_file_raises_and_keeps_its_appends(tmp_path: Path):
+    writer = GroupCommitWriter(interval=1.0, max_attempts=3)
+    handler = JsonLinesHandler(writer=writer)
+    failing = tmp_path / "missing_dir" / "other.jsonl"
+    handler.append([{"type": "message"}], failing)
+
+    with pytest.raises(FileNotFoundError):
+        writer.flush(failing)
+    assert writer.pending(failing)
+
+    failing.parent.mkdir()
+    writer.flush(failing)
+    assert handler.load(failing) == [{"type": "message"}]
@@ -0,0 +1,45 @@
+"""
+Tests of the caches of the Users and ChatHistorial handlers
+"""
+from pathlib import Path
+
+from chat_bot.historial.handler import ChatHistorialHandler, historial_size
+from chat_bot.models.message import Message
+from chat_bot.models.user import User
+from chat_bot.storage.filesystem import FileSystemStorage
+from chat_bot.user.handler import UserHandler
+from chat_bot.utils.cache import LRUCache
+from chat_bot.utils.enums import Roles
+
+
+class FailingStorage(FileSystemStorage):
+    """Storage whose writes are not saved"""
+
+    def save_user(self, user: User) -> bool:
+        return False
+
+    def create_chat(self, user_id, chat_historial) -> bool:
+        return False
+
+    def append_chat(self, user_id, chat_id, flags, messages) -> bool:
+        return False
+
+
+def test_failed_writes_are_not_cached(tmp_path: Path):
+    storage = FileSystemStorage(root=str(tmp_path))
+    chat_handler = ChatHistorialHandler(storage, cache=LRUCache(size_of=historial_size))
+    chat_handler.create("user", "chat", "message")
+    chat_handler.storage = failing = FailingStorage(root=str(tmp_path))
+    user_handler = UserHandler(failing, cache=LRUCache())
+
+    assert not chat_handler.update(
+        "user", "chat", new_prompt=Message(role=Roles.USER, content="hola")
+    )
+    assert not chat_handler.create("user", "other", "message")
+    assert not user_handler.create(
+        User(id="user", name="user", display_name="User", discriminator="0001")
+    )
+
+    assert chat_handler.load("user", "chat").messages == []
+    assert ("user", "other") not in chat_handler.cache
+    assert "user" not in user_handler.cache
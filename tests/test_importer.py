@@ -0,0 +1,32 @@
+"""
+Tests of the bulk import into the SQLite backend
+"""
+from pathlib import Path
+
+from chat_bot.models.historial import ChatHistorial
+from chat_bot.models.message import Message
+from chat_bot.storage.filesystem import FileSystemStorage
+from chat_bot.storage.importer import import_storage
+from chat_bot.storage.sqlite import SQLiteStorage
+from chat_bot.utils.enums import Roles
+
+
+def test_legacy_chats_are_imported_and_left_in_place(tmp_path: Path):
+    source = FileSystemStorage(root=str(tmp_path), migrate_legacy=False)
+    chat_historial = ChatHistorial(
+        id="chat",
+        message_to_react_id="message",
+        messages=[Message(role=Roles.USER, content="hola")],
+    )
+    legacy_path = source._legacy_chat_path("user", "chat")
+    legacy_path.parent.mkdir(parents=True)
+    legacy_path.write_text(chat_historial.json(), encoding="utf-8")
+    target = SQLiteStorage(tmp_path / "chat_bot.sqlite3")
+
+    try:
+        assert import_storage(source, target) == (0, 1)
+        assert target.load_chat("user", "chat").messages[0].content == "hola"
+    finally:
+        target.close()
+    assert legacy_path.is_file()
+    assert not source._chat_path("user", "chat").exists()
@@ -0,0 +1,54 @@
+"""
+Tests of the retrieval memory of the conversations
+"""
+import asyncio
+from pathlib import Path
+
+from chat_bot.historial.handler import ChatHistorialHandler
+from chat_bot.models.message import Message
+from chat_bot.retrieval.handler import RetrievalHandler
+from chat_bot.storage.filesystem import FileSystemStorage
+from chat_bot.utils.enums import Roles
+
+PROMPT = Message(role=Roles.USER, content="como hago pan")
+RESPONSE = Message(role=Roles.ASSISTANT, content="con harina, agua y sal")
+
+
+def test_corrupt_turns_dont_fail_the_update(tmp_path: Path):
+    retrieval = RetrievalHandler(root=str(tmp_path))
+    handler = ChatHistorialHandler(
+        FileSystemStorage(root=str(tmp_path)), retrieval=retrieval
+    )
+    handler.create("user", "chat", "message")
+    turns_path, vectors_path = retrieval._paths("user", "chat")
+    vectors_path.write_bytes(retrieval.header)
+    turns_path.write_text('{"prompt":{}}\n', encoding="utf-8")
+
+    assert handler.update("user", "chat", new_prompt=PROMPT, new_response=RESPONSE)
+    assert retrieval.retrieve("user", "chat", "pan", []) is None
+
+
+def test_turns_are_remembered_in_background_and_in_order(tmp_path: Path):
+    retrieval = RetrievalHandler(root=str(tmp_path), recent_messages=0)
+    handler = ChatHistorialHandler(
+        FileSystemStorage(root=str(tmp_path)), retrieval=retrieval
+    )
+    handler.create("user", "chat", "message")
+    retrieval.retrieve("user", "chat", "pan", [])
+
+    async def run():
+        for turn in range(3):
+            assert await handler.aupdate(
+                "user",
+                "chat",
+                new_prompt=Message(role=Roles.USER, content=f"pregunta {turn}"),
+                new_response=RESPONSE,
+            )
+        await retrieval.close()
+
+    asyncio.run(run())
+
+    memory = RetrievalHandler(root=str(tmp_path))._memory("user", "chat")
+    assert [prompt.content for prompt, _ in memory.turns] == [
+        f"pregunta {turn}" for turn in range(3)
+    ]
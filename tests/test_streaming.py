@@ -0,0 +1,36 @@
+"""
+Tests of the helpers showing streamed responses on Discord
+"""
+import asyncio
+from typing import AsyncIterator, List
+
+from benchmarks.fake_discord import FakeChannel, FakeMessage
+from chat_bot.bot.constants.enums import DefaultMessages
+from chat_bot.bot.utils.streaming import edit_with_stream
+
+
+async def stream(deltas: List[str]) -> AsyncIterator[str]:
+    for delta in deltas:
+        yield delta
+
+
+def show(deltas: List[str]) -> FakeChannel:
+    channel = FakeChannel(id=1)
+    message = FakeMessage(content="🤔", channel=channel)
+    channel.sent.append(message)
+    asyncio.run(edit_with_stream(message, stream(deltas), interval=0))
+    return channel
+
+
+def test_blank_response_shows_the_fallback():
+    channel = show(["", "  ", "\n"])
+
+    assert [message.content for message in channel.sent] == [
+        DefaultMessages.EMPTY_RESPONSE.value
+    ]
+
+
+def test_long_response_is_split_without_blank_messages():
+    channel = show(["a" * 2000, " " * 2000])
+
+    assert [message.content for message in channel.sent] == ["a" * 2000]
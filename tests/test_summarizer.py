@@ -0,0 +1,97 @@
+"""
+Tests of the historial summarizer against the fake OpenAI server
+"""
+import asyncio
+import socket
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List
+
+import openai
+import pytest
+
+from chat_bot.api import tokens
+from chat_bot.api.chat_gpt import OpenAIApi
+from chat_bot.api.fake_server import FakeOpenAIServer
+from chat_bot.api.summarizer import HistorialSummarizer
+from chat_bot.historial.handler import ChatHistorialHandler
+from chat_bot.models.message import Message
+from chat_bot.storage.filesystem import FileSystemStorage
+from chat_bot.utils.enums import Roles
+
+
+class WideEncoding:
+    """Tokenizer packing 8 characters per token, twice the length estimate"""
+
+    @staticmethod
+    def encode(text: str) -> List[str]:
+        return [text[index : index + 8] for index in range(0, len(text), 8)]
+
+    @staticmethod
+    def decode(pieces: List[str]) -> str:
+        return "".join(pieces)
+
+
+@pytest.fixture
+def wide_tokenizer(monkeypatch):
+    monkeypatch.setattr(
+        tokens, "tiktoken", SimpleNamespace(encoding_for_model=lambda _: WideEncoding)
+    )
+    monkeypatch.setattr(tokens, "_encodings", {})
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def summarize(tmp_path: Path, contents: list) -> tuple:
+    """Summarize a single chunk of a chat holding contents, returning the
+    transcript sent, the transcript budget and the messages left."""
+
+    async def run() -> tuple:
+        server = FakeOpenAIServer(port=free_port())
+        await server.start()
+        openai.api_base = server.api_base
+        try:
+            handler = ChatHistorialHandler(FileSystemStorage(root=str(tmp_path)))
+            handler.create("user", "chat", "message")
+            for content in contents:
+                handler.update(
+                    "user", "chat", new_prompt=Message(role=Roles.USER, content=content)
+                )
+            client = OpenAIApi("test", chat_historial_handler=handler)
+            summarizer = HistorialSummarizer(
+                client, handler, threshold=0, keep_recent=0, max_chunks=1
+            )
+            budget = summarizer._transcript_budget(handler.load("user", "chat"))
+            assert await summarizer.summarize("user", "chat")
+            transcript = server.requests[-1]["messages"][-1]["content"]
+            return transcript, budget, handler.load("user", "chat").messages
+        finally:
+            await server.stop()
+
+    return asyncio.run(run())
+
+
+def test_only_the_messages_sent_are_compacted(tmp_path: Path, wide_tokenizer):
+    contents = [f"{index}" * 8000 for index in range(10)]
+
+    transcript, budget, messages = summarize(tmp_path, contents)
+
+    sent = transcript.split("\n")
+    assert sent == [f"user: {content}" for content in contents[: len(sent)]]
+    assert tokens.count_tokens(transcript) <= budget
+    assert [message.content for message in messages] == contents[len(sent) :]
+
+
+def test_a_message_over_the_budget_is_cut_to_fit(tmp_path: Path):
+    contents = ["a" * 40000, "b" * 100]
+
+    transcript, budget, messages = summarize(tmp_path, contents)
+
+    assert transcript.startswith("user: aaa")
+    assert "b" not in transcript
+    assert tokens.count_tokens(transcript) <= budget
+    assert [message.content for message in messages] == contents[1:]